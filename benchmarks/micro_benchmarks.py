@@ -0,0 +1,328 @@
+"""
+Micro-benchmarks for the CPU-bound parts of genFcWsLoadFiles.
+
+Each benchmark times one function (attribute naming, abbreviation and
+sample type lookups, the replicate pickers, _add_file_attribute, the load
+file writers and UuidResolver) on synthetic data, without any network
+access.  Results are written as JSON; with --baseline the per-operation
+times are compared against an earlier results file.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from fcgdctools import fc_loadfiles
+from fcgdctools import gdc_uuidresolver
+
+import synthetic_manifest
+
+# workflow types and experimental strategies drawn for the naming benchmarks:
+# a mix of names with a table abbreviation and names that are translated
+WORKFLOW_TYPES = list(fc_loadfiles.WORKFLOW_ABBREVIATIONS) + ['ASCAT2', 'ScarTissue Pipeline', 'GATK4 MuTect2', None]
+EXP_STRATEGIES = list(fc_loadfiles.EXP_STRATEGY_ABBREVIATIONS) + ['ATAC-Seq', 'scRNA-Seq', None]
+SAMPLE_TYPE_IDS = list(fc_loadfiles.SampleType.SAMPLE_TYPES) + [None]
+
+
+def _synthetic_files(size, seed):
+    return synthetic_manifest.generate(size, seed)
+
+
+def _kind(doc):
+    return (doc['data_category'], doc['data_type'], doc['data_format'],
+            doc.get('experimental_strategy'), doc.get('analysis', {}).get('workflow_type'))
+
+
+def _tcga_aliquots(rng, size):
+    analytes = synthetic_manifest.RNA_ANALYTES + synthetic_manifest.DNA_ANALYTES
+    return ["TCGA-AB-{0:04d}-01A-{1:02d}{2}-A{3:03X}-{4:02d}".format(rng.randrange(10000), rng.randrange(10, 40), rng.choice(analytes),
+                                                                    rng.randrange(4096), rng.randrange(1, 30))
+            for _ in range(size)]
+
+
+def _target_aliquots(rng, size):
+    return ["TARGET-20-PA{0:04d}-09A-{1:02d}{2}".format(rng.randrange(10000), rng.randrange(1, 10), rng.choice('DEWXYRS'))
+            for _ in range(size)]
+
+
+def _entity_model(files):
+    """Build the known cases, samples and pairs for single-case files, the way get_file_metadata does."""
+    known_cases, known_samples, known_pairs = dict(), dict(), dict()
+    for doc in files:
+        cases = doc['cases']
+        if len(cases) != 1:
+            continue
+        case_id = fc_loadfiles._add_to_knowncases(cases[0], known_cases)
+        samples = cases[0].get('samples', [])
+        if len(samples) == 0:
+            entity_id, entity = case_id, known_cases[case_id]
+        elif len(samples) == 1:
+            entity_id, _ = fc_loadfiles._add_to_knownsamples(samples[0], case_id, known_samples)
+            entity = known_samples[entity_id]
+        else:
+            ids = [fc_loadfiles._add_to_knownsamples(s, case_id, known_samples) for s in samples]
+            tumor = [sample_id for sample_id, tn in ids if tn == fc_loadfiles.SAMPLE_TYPE.TUMOR][0]
+            normal = [sample_id for sample_id, tn in ids if tn != fc_loadfiles.SAMPLE_TYPE.TUMOR][0]
+            entity_id = fc_loadfiles._add_to_knownpairs(tumor, normal, known_pairs)
+            entity = known_pairs[entity_id]
+        data_category, data_type, data_format, experimental_strategy, workflow_type = _kind(doc)
+        basename = fc_loadfiles._constructAttributeName_base(experimental_strategy, workflow_type,
+                                                             data_category, data_type, data_format)
+        # replicates are resolved over the network; keep the first file, as an uncontested attribute
+        if basename + fc_loadfiles.UUID_ATTRIBUTE_SUFFIX not in entity:
+            entity[basename + fc_loadfiles.UUID_ATTRIBUTE_SUFFIX] = doc['file_id'] + fc_loadfiles.SEPARATOR + doc['file_name']
+            entity[basename + fc_loadfiles.URL_ATTRIBUTE_SUFFIX] = '__DELETE__'
+    return known_cases, known_samples, known_pairs
+
+
+# Each benchmark's setup(size, seed, work_dir) does the untimed preparation and returns
+# (operation count, function to time).  Setup is repeated for every timed run, so the
+# timed function may consume or modify what setup built.
+
+def setup_construct_attribute_name(size, seed, work_dir):
+    rng = random.Random(seed)
+    args = [(rng.choice(EXP_STRATEGIES), rng.choice(WORKFLOW_TYPES)) + _kind(doc)[:3]
+            for doc in rng.choices(_synthetic_files(200, seed), k=size)]
+
+    def run():
+        for experimental_strategy, workflow_type, data_category, data_type, data_format in args:
+            fc_loadfiles._constructAttributeName_base(experimental_strategy, workflow_type, data_category, data_type, data_format)
+    return len(args), run
+
+
+def setup_get_abbreviation(size, seed, work_dir):
+    rng = random.Random(seed)
+    names = [name for name in rng.choices(WORKFLOW_TYPES, k=size) if name is not None]
+
+    def run():
+        for name in names:
+            fc_loadfiles.WORKFLOW.getAbbreviation(name)
+    return len(names), run
+
+
+def setup_sample_type_lookup(size, seed, work_dir):
+    rng = random.Random(seed)
+    ids = rng.choices(SAMPLE_TYPE_IDS, k=size)
+
+    def run():
+        for sample_type_id in ids:
+            fc_loadfiles.SAMPLE_TYPE.getTumorNormalClassification(sample_type_id)
+            fc_loadfiles.SAMPLE_TYPE.getLetterCode(sample_type_id)
+    return len(ids), run
+
+
+def setup_pick_tcga_submitter(size, seed, work_dir):
+    rng = random.Random(seed)
+    a, b = _tcga_aliquots(rng, size), _tcga_aliquots(rng, size)
+
+    def run():
+        for x, y in zip(a, b):
+            fc_loadfiles._pick_tcga_submitter(x, y)
+    return size, run
+
+
+def setup_pick_target_submitter(size, seed, work_dir):
+    rng = random.Random(seed)
+    a, b = _target_aliquots(rng, size), _target_aliquots(rng, size)
+
+    def run():
+        for x, y in zip(a, b):
+            fc_loadfiles._pick_target_submitter(x, y)
+    return size, run
+
+
+def setup_pick_aliquot_pair(size, seed, work_dir):
+    rng = random.Random(seed)
+    tcga = [({'tumor': t1, 'normal': n1}, {'tumor': t2, 'normal': n2})
+            for t1, n1, t2, n2 in zip(*[_tcga_aliquots(rng, size // 2) for _ in range(4)])]
+    target = [({'tumor': t1, 'normal': n1}, {'tumor': t2, 'normal': n2})
+              for t1, n1, t2, n2 in zip(*[_target_aliquots(rng, size // 2) for _ in range(4)])]
+
+    def run():
+        for pair1, pair2 in tcga:
+            fc_loadfiles._pick_tcga_aliquot_pair(pair1, pair2)
+        for pair1, pair2 in target:
+            fc_loadfiles._pick_target_aliquot_pair(pair1, pair2)
+    return len(tcga) + len(target), run
+
+
+def setup_add_file_attribute(size, seed, work_dir):
+    # each file goes to its own fresh entity, so that no collision (and no GDC request) occurs
+    args = []
+    for doc in _synthetic_files(size, seed):
+        data_category, data_type, data_format, experimental_strategy, workflow_type = _kind(doc)
+        args.append((doc['file_id'], dict(), doc['file_id'], doc['file_name'], '__DELETE__', data_category, data_type,
+                     data_format, experimental_strategy, workflow_type, doc['access'], doc['cases'][0]['project']['program']['name']))
+
+    def run():
+        for entity_id, entity, file_uuid, filename, file_url, *rest in args:
+            fc_loadfiles._add_file_attribute(None, entity_id, entity, file_uuid, filename, file_url, *rest)
+    return len(args), run
+
+
+def _setup_writer(size, seed, work_dir, write):
+    model = _entity_model(_synthetic_files(size, seed))
+    basename = os.path.join(work_dir, 'bench')
+
+    def run():
+        write(model, basename)
+    return size, run
+
+
+def setup_create_participants_file(size, seed, work_dir):
+    return _setup_writer(size, seed, work_dir, lambda model, basename: fc_loadfiles.create_participants_file(model[0], basename))
+
+
+def setup_create_samples_file(size, seed, work_dir):
+    return _setup_writer(size, seed, work_dir, lambda model, basename: fc_loadfiles.create_samples_file(model[1], basename))
+
+
+def setup_create_pairs_file(size, seed, work_dir):
+    return _setup_writer(size, seed, work_dir, lambda model, basename: fc_loadfiles.create_pairs_file(model[2], model[1], basename))
+
+
+def _write_resolver_tsv(size, seed, work_dir):
+    rng = random.Random(seed)
+    uuids = [doc['file_id'] for doc in _synthetic_files(size, seed)]
+    tsv_filename = os.path.join(work_dir, 'uuid_to_url.tsv')
+    with open(tsv_filename, 'w') as fp:
+        for uuid in uuids:
+            fp.write("{0}\tgs://bench-bucket/{0}/{1:08x}\n".format(uuid, rng.getrandbits(32)))
+    return tsv_filename, uuids
+
+
+def setup_uuid_resolver_build(size, seed, work_dir):
+    tsv_filename, uuids = _write_resolver_tsv(size, seed, work_dir)
+
+    def run():
+        gdc_uuidresolver.UuidResolver(tsv_filename, '__DELETE__')
+    return len(uuids), run
+
+
+def setup_uuid_resolver_lookup(size, seed, work_dir):
+    tsv_filename, uuids = _write_resolver_tsv(size, seed, work_dir)
+    resolver = gdc_uuidresolver.UuidResolver(tsv_filename, '__DELETE__')
+    # a tenth of the lookups miss
+    lookups = uuids + [uuid[::-1] for uuid in uuids[:len(uuids) // 10]]
+    random.Random(seed).shuffle(lookups)
+
+    def run():
+        for uuid in lookups:
+            resolver.getURL(uuid)
+    return len(lookups), run
+
+
+BENCHMARKS = {
+    'construct_attribute_name': setup_construct_attribute_name,
+    'get_abbreviation': setup_get_abbreviation,
+    'sample_type_lookup': setup_sample_type_lookup,
+    'pick_tcga_submitter': setup_pick_tcga_submitter,
+    'pick_target_submitter': setup_pick_target_submitter,
+    'pick_aliquot_pair': setup_pick_aliquot_pair,
+    'add_file_attribute': setup_add_file_attribute,
+    'create_participants_file': setup_create_participants_file,
+    'create_samples_file': setup_create_samples_file,
+    'create_pairs_file': setup_create_pairs_file,
+    'uuid_resolver_build': setup_uuid_resolver_build,
+    'uuid_resolver_lookup': setup_uuid_resolver_lookup,
+}
+
+# the writers and the resolver do far more work per operation; run them on fewer operations
+# (each UuidResolver lookup reopens its dbm file)
+DEFAULT_SIZES = {'create_participants_file': 20000, 'create_samples_file': 20000, 'create_pairs_file': 20000,
+                 'uuid_resolver_build': 20000, 'uuid_resolver_lookup': 1000}
+DEFAULT_SIZE = 100000
+
+
+def run_benchmark(name, size, seed, repeat):
+    """Time benchmark name repeat times; returns its result entry."""
+    timings = []
+    operations = None
+    for _ in range(repeat):
+        work_dir = tempfile.mkdtemp(prefix="fcgdctools_micro_")
+        cwd = os.getcwd()
+        # UuidResolver keeps its dbm file in the current directory
+        os.chdir(work_dir)
+        try:
+            operations, run = BENCHMARKS[name](size, seed, work_dir)
+            start = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - start)
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(work_dir, ignore_errors=True)
+    best = min(timings)
+    return {'operations': operations, 'repeat': repeat, 'seconds': timings,
+            'best_ns_per_op': best / operations * 1e9,
+            'median_ns_per_op': statistics.median(timings) / operations * 1e9}
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results, baseline=None):
+    if baseline is None:
+        print("benchmark\toperations\tbest ns/op\tmedian ns/op")
+    else:
+        print("benchmark\toperations\tbest ns/op\tmedian ns/op\tbaseline ns/op\tspeedup")
+    for name, result in results.items():
+        line = "{0}\t{1}\t{2:.0f}\t{3:.0f}".format(name, result['operations'], result['best_ns_per_op'], result['median_ns_per_op'])
+        if baseline is not None:
+            previous = baseline['results'].get(name)
+            if previous is None:
+                line += "\t-\t-"
+            else:
+                line += "\t{0:.0f}\t{1:.2f}x".format(previous['best_ns_per_op'], previous['best_ns_per_op'] / result['best_ns_per_op'])
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='micro-benchmarks for the CPU-bound parts of genFcWsLoadFiles')
+    parser.add_argument("benchmarks", help="benchmarks to run (default: all)", nargs="*", default=[])
+    parser.add_argument("-n", "--size", help="operations per timed run (default: {0}, or {1} for the writers and the resolver)".format(
+        DEFAULT_SIZE, DEFAULT_SIZES['uuid_resolver_build']), type=int)
+    parser.add_argument("-r", "--repeat", help="timed runs per benchmark; the best is reported", type=int, default=5)
+    parser.add_argument("--seed", help="random seed for the synthetic data", type=int, default=0)
+    parser.add_argument("-b", "--baseline", help="results file of an earlier run to compare against")
+    parser.add_argument("-o", "--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    unknown = [name for name in args.benchmarks if name not in BENCHMARKS]
+    if unknown:
+        parser.error("unknown benchmarks {0}; choose from {1}".format(', '.join(unknown), ', '.join(BENCHMARKS)))
+    names = args.benchmarks if args.benchmarks else list(BENCHMARKS)
+    results = dict()
+    for name in names:
+        size = args.size if args.size is not None else DEFAULT_SIZES.get(name, DEFAULT_SIZE)
+        results[name] = run_benchmark(name, size, args.seed, args.repeat)
+
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)
+    print_results(results, baseline)
+
+    if args.output is not None:
+        report = {'python': platform.python_version(), 'platform': platform.platform(), 'commit': _git_commit(),
+                  'seed': args.seed, 'results': results}
+        with open(args.output, 'w') as fp:
+            json.dump(report, fp, indent=2)
+
+
+if __name__ == '__main__':
+    main()
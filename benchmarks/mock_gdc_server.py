@@ -0,0 +1,250 @@
+"""
+A local stand-in for the parts of the GDC API used by genFcWsLoadFiles.
+
+Serves file metadata documents (as written by synthetic_manifest.py) from
+GET /files/<uuid>?fields=<comma separated fields>, projecting each document
+onto the requested fields as the GDC does.  POST /files and POST /cases
+answer bulk queries whose filter selects files by file_id and cases by
+case_id; the case documents are assembled from the files' cases.  Latency and error rates
+can be injected, and a limit on concurrent requests enforced with HTTP 429
+responses, like the GDC's rate limiting.  GET /_stats returns the number
+of requests served per endpoint.
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+def _copy_path(src, dst, path):
+    key = path[0]
+    if not isinstance(src, dict) or key not in src:
+        return
+    value = src[key]
+    if len(path) == 1:
+        dst[key] = value
+    elif isinstance(value, list):
+        items = dst.setdefault(key, [dict() for _ in value])
+        for src_item, dst_item in zip(value, items):
+            _copy_path(src_item, dst_item, path[1:])
+    elif isinstance(value, dict):
+        _copy_path(value, dst.setdefault(key, dict()), path[1:])
+
+
+def project(doc, fields):
+    """Restrict a metadata document to the given dotted field paths."""
+    result = dict()
+    for field in fields:
+        _copy_path(doc, result, field.split('.'))
+    return result
+
+
+class MockGdc:
+
+    """The metadata served by the mock server, plus its fault injection settings and request counters
+
+    Attributes:
+        files (dict): maps file uuid to its metadata document
+        latency (float): seconds added to every response
+        jitter (float): up to this many additional seconds, drawn uniformly, per response
+        error_rate (float): fraction of requests answered with HTTP 503
+        max_in_flight (int): requests beyond this many in progress are answered with HTTP 429 (default: no limit)
+    """
+    def __init__(self, files, latency=0.0, jitter=0.0, error_rate=0.0, seed=0, max_in_flight=None):
+        self.files = files
+        self.cases = case_documents(files)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.max_in_flight = max_in_flight
+        self._in_flight = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.counts = dict()
+
+    def count(self, endpoint):
+        with self._lock:
+            self.counts[endpoint] = self.counts.get(endpoint, 0) + 1
+
+    def reset_counts(self):
+        with self._lock:
+            self.counts = dict()
+
+    def admit(self):
+        """Start a request; return False (and count it) if it is over the concurrency limit."""
+        with self._lock:
+            if self.max_in_flight is not None and self._in_flight >= self.max_in_flight:
+                self.counts['throttled'] = self.counts.get('throttled', 0) + 1
+                return False
+            self._in_flight += 1
+            return True
+
+    def finish(self):
+        with self._lock:
+            self._in_flight -= 1
+
+    def delay_and_fail(self):
+        """Sleep for the injected latency; return True if this request should fail."""
+        with self._lock:
+            delay = self.latency + self._rng.random() * self.jitter
+            fail = self._rng.random() < self.error_rate
+        if delay > 0:
+            time.sleep(delay)
+        return fail
+
+
+def case_documents(files):
+    """Assemble a document per case, with all its samples, from the cases of the file metadata documents."""
+    cases = dict()
+    for doc in files.values():
+        for file_case in doc.get('cases', []):
+            case = cases.get(file_case['case_id'])
+            if case is None:
+                case = cases[file_case['case_id']] = {key: value for key, value in file_case.items() if key != 'samples'}
+                case['samples'] = []
+            sample_ids = set(sample['sample_id'] for sample in case['samples'])
+            for sample in file_case.get('samples', []):
+                if sample['sample_id'] not in sample_ids:
+                    # aliquots are specific to the file
+                    case['samples'].append({key: value for key, value in sample.items() if key != 'portions'})
+    return cases
+
+
+def load_metadata(metadata_filename):
+    files = dict()
+    with open(metadata_filename, 'r') as fp:
+        for line in fp:
+            doc = json.loads(line)
+            files[doc['file_id']] = doc
+    return files
+
+
+class MockGdcHandler(BaseHTTPRequestHandler):
+
+    # set on the server subclass created by make_server()
+    gdc = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _throttle(self, handle):
+        if not self.gdc.admit():
+            self._send_json(429, {'message': 'too many requests'})
+            return
+        try:
+            handle()
+        finally:
+            self.gdc.finish()
+
+    def do_GET(self):
+        if urlparse(self.path).path.strip('/') == '_stats':
+            self._send_json(200, dict(self.gdc.counts))
+            return
+        self._throttle(self._get)
+
+    def do_POST(self):
+        self._throttle(self._post)
+
+    def _get(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        parts = url.path.strip('/').split('/')
+
+        if len(parts) == 2 and parts[0] == 'files':
+            self.gdc.count('files/<uuid>')
+            if self.gdc.delay_and_fail():
+                self._send_json(503, {'message': 'injected error'})
+                return
+            doc = self.gdc.files.get(parts[1])
+            if doc is None:
+                self._send_json(404, {'message': 'no file with id {0}'.format(parts[1])})
+                return
+            fields = query.get('fields', [''])[0]
+            data = project(doc, fields.split(',')) if fields else doc
+            self._send_json(200, {'data': data, 'warnings': {}})
+            return
+
+        self._send_json(404, {'message': 'unsupported endpoint {0}'.format(url.path)})
+
+    def _post(self):
+        url = urlparse(self.path)
+        endpoint = url.path.strip('/')
+        if endpoint == 'files':
+            documents, id_fields = self.gdc.files, ('file_id', 'files.file_id')
+        elif endpoint == 'cases':
+            documents, id_fields = self.gdc.cases, ('case_id', 'cases.case_id')
+        else:
+            self._send_json(404, {'message': 'unsupported endpoint {0}'.format(url.path)})
+            return
+        self.gdc.count(endpoint)
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        if self.gdc.delay_and_fail():
+            self._send_json(503, {'message': 'injected error'})
+            return
+        filters = body.get('filters', {})
+        content = filters.get('content', {})
+        if filters.get('op') != 'in' or content.get('field') not in id_fields:
+            self._send_json(400, {'message': 'only "in" filters on {0} are supported'.format(id_fields[0])})
+            return
+        fields = body.get('fields', '')
+        docs = [documents[doc_id] for doc_id in content['value'] if doc_id in documents]
+        size = int(body.get('size', 10))
+        hits = []
+        for doc in docs[:size]:
+            hit = project(doc, fields.split(',')) if fields else dict(doc)
+            hit['id'] = doc[id_fields[0]]
+            hits.append(hit)
+        pagination = {'count': len(hits), 'total': len(docs), 'size': size, 'from': 0}
+        self._send_json(200, {'data': {'hits': hits, 'pagination': pagination}, 'warnings': {}})
+
+
+def make_server(gdc, host='127.0.0.1', port=0):
+    """Create (but do not start) a threaded HTTP server serving gdc; port 0 picks a free port."""
+    handler = type('BoundMockGdcHandler', (MockGdcHandler,), {'gdc': gdc})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def start_in_thread(gdc, host='127.0.0.1', port=0):
+    """Start a server for gdc on a background thread; returns (server, api_root)."""
+    server = make_server(gdc, host, port)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, "http://{0}:{1}".format(*server.server_address[:2])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='serve synthetic GDC file metadata for benchmarking')
+    parser.add_argument("metadata", help="file metadata (JSON lines) written by synthetic_manifest.py")
+    parser.add_argument("--host", default='127.0.0.1')
+    parser.add_argument("--port", type=int, default=8088)
+    parser.add_argument("--latency", help="seconds added to every response", type=float, default=0.0)
+    parser.add_argument("--jitter", help="maximum additional random delay in seconds", type=float, default=0.0)
+    parser.add_argument("--error_rate", help="fraction of requests answered with HTTP 503", type=float, default=0.0)
+    parser.add_argument("--max_in_flight", help="answer requests beyond this many in progress with HTTP 429", type=int)
+    args = parser.parse_args()
+
+    gdc = MockGdc(load_metadata(args.metadata), args.latency, args.jitter, args.error_rate, max_in_flight=args.max_in_flight)
+    server = make_server(gdc, args.host, args.port)
+    print("serving {0} files at http://{1}:{2}".format(len(gdc.files), args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+End-to-end throughput benchmark for genFcWsLoadFiles.
+
+For each manifest size, generates a synthetic manifest, serves its
+metadata from a local mock GDC server and runs genFcWsLoadFiles against
+it, reporting files per second and request counts.
+"""
+
+import argparse
+import json
+import os
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+
+import mock_gdc_server
+import synthetic_manifest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_one(num_files, args, work_dir):
+    files = synthetic_manifest.generate(num_files, args.seed)
+    manifest_filename = os.path.join(work_dir, "manifest_{0}.txt".format(num_files))
+    synthetic_manifest.write_manifest(files, manifest_filename)
+
+    gdc = mock_gdc_server.MockGdc({doc['file_id']: doc for doc in files}, args.latency, args.jitter, args.error_rate, args.seed,
+                                 args.max_in_flight)
+    server, api_root = mock_gdc_server.start_in_thread(gdc)
+    stats_filename = os.path.join(work_dir, "stats_{0}.json".format(num_files))
+    command = [sys.executable, '-m', 'fcgdctools.fc_loadfiles', '--gdc_api_root', api_root, '--quiet',
+               '--stats', stats_filename] + shlex.split(args.extra_args) + [manifest_filename]
+    env = dict(os.environ)
+    env['PYTHONPATH'] = REPO_ROOT + os.pathsep + env.get('PYTHONPATH', '')
+
+    start = time.time()
+    try:
+        with open(os.path.join(work_dir, "output_{0}.txt".format(num_files)), 'w') as output:
+            returncode = subprocess.call(command, cwd=work_dir, env=env, stdout=output, stderr=subprocess.STDOUT)
+    finally:
+        server.shutdown()
+        server.server_close()
+    wall = time.time() - start
+
+    result = {'num_files': len(files), 'returncode': returncode, 'wall_seconds': wall,
+              'files_per_second': len(files) / wall if wall > 0 else None,
+              'server_requests': dict(gdc.counts)}
+    if os.path.exists(stats_filename):
+        with open(stats_filename) as fp:
+            stats = json.load(fp)
+        result['client_requests'] = {fields: entry['count'] for fields, entry in stats['requests'].items()}
+        result['retries'] = stats['counters'].get('retries', 0)
+        result['peak_rss_bytes'] = stats['peak_rss_bytes']
+        if 'aimd_controller' in stats.get('reports', {}):
+            result['aimd_controller'] = stats['reports']['aimd_controller']
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark genFcWsLoadFiles against a local mock GDC API server')
+    parser.add_argument("--sizes", help="manifest sizes to run", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--seed", help="random seed for the synthetic manifests and fault injection", type=int, default=0)
+    parser.add_argument("--latency", help="seconds added to every mock GDC response", type=float, default=0.0)
+    parser.add_argument("--jitter", help="maximum additional random delay in seconds", type=float, default=0.0)
+    parser.add_argument("--error_rate", help="fraction of mock GDC requests answered with HTTP 503", type=float, default=0.0)
+    parser.add_argument("--max_in_flight", help="answer mock GDC requests beyond this many in progress with HTTP 429", type=int)
+    parser.add_argument("--extra_args", help="additional genFcWsLoadFiles arguments, as one quoted string", default="")
+    parser.add_argument("--work_dir", help="directory for manifests and outputs (default: a temporary directory)")
+    parser.add_argument("-o", "--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    work_dir = args.work_dir if args.work_dir is not None else tempfile.mkdtemp(prefix="fcgdctools_bench_")
+    os.makedirs(work_dir, exist_ok=True)
+    print("working directory: {0}".format(work_dir))
+
+    results = []
+    print("files\tseconds\tfiles/s\trequests\tretries\texit")
+    for num_files in args.sizes:
+        result = run_one(num_files, args, work_dir)
+        results.append(result)
+        print("{0}\t{1:.1f}\t{2:.1f}\t{3}\t{4}\t{5}".format(result['num_files'], result['wall_seconds'], result['files_per_second'],
+                                                          sum(result['server_requests'].values()), result.get('retries', '-'),
+                                                          result['returncode']))
+
+    if args.output is not None:
+        with open(args.output, 'w') as fp:
+            json.dump({'settings': vars(args), 'results': results}, fp, indent=2)
+
+
+if __name__ == '__main__':
+    main()
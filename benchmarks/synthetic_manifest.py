@@ -0,0 +1,199 @@
+"""
+Generates synthetic GDC manifests, together with the file metadata
+served for them by mock_gdc_server.py.
+
+The generated files mimic a TCGA or TARGET project: per-case clinical and
+biospecimen XML files, single-sample files (some with replicate aliquots),
+tumor/normal paired files, and multi-case files (aggregated MAFs and BCR
+Biotab files).
+"""
+
+import argparse
+import csv
+import json
+import random
+import uuid
+
+PROGRAMS = ['TCGA', 'TARGET']
+
+# (data_category, data_type, data_format, experimental_strategy, workflow_type)
+CLINICAL_XML = ("Clinical", "Clinical Supplement", "BCR XML", None, None)
+BIOSPECIMEN_XML = ("Biospecimen", "Biospecimen Supplement", "BCR XML", None, None)
+SINGLE_SAMPLE_KINDS = [
+    ("Transcriptome Profiling", "Gene Expression Quantification", "TXT", "RNA-Seq", "HTSeq - Counts"),
+    ("Transcriptome Profiling", "Gene Expression Quantification", "TXT", "RNA-Seq", "HTSeq - FPKM"),
+    ("Transcriptome Profiling", "miRNA Expression Quantification", "TXT", "miRNA-Seq", "BCGSC miRNA Profiling"),
+    ("Copy Number Variation", "Copy Number Segment", "TXT", "Genotyping Array", "DNAcopy"),
+    ("DNA Methylation", "Methylation Beta Value", "TXT", "Methylation Array", "Liftover"),
+]
+PAIRED_KINDS = [
+    ("Simple Nucleotide Variation", "Raw Simple Somatic Mutation", "VCF", "WXS", "MuTect2"),
+    ("Simple Nucleotide Variation", "Annotated Somatic Mutation", "VCF", "WXS", "MuTect2 Annotation"),
+    ("Simple Nucleotide Variation", "Raw Simple Somatic Mutation", "VCF", "WXS", "VarScan2"),
+]
+MULTI_CASE_KINDS = [
+    ("Simple Nucleotide Variation", "Masked Somatic Mutation", "MAF", "WXS", "MuTect2 Variant Aggregation and Masking"),
+    ("Clinical", "Clinical Supplement", "BCR Biotab", None, None),
+]
+
+# analyte codes used for single-sample replicates: RNA and DNA
+RNA_ANALYTES = ['R', 'H', 'T']
+DNA_ANALYTES = ['D', 'W', 'X']
+
+MANIFEST_FIELDS = ['id', 'filename', 'md5', 'size', 'state']
+
+
+class SyntheticProject:
+
+    """Synthetic cases and samples of one project, and the files generated for them"""
+
+    def __init__(self, program, project_id, rng):
+        self.program = program
+        self.project_id = project_id
+        self.rng = rng
+        self.cases = []
+        self.files = []
+
+    def _uuid(self):
+        return str(uuid.UUID(int=self.rng.getrandbits(128), version=4))
+
+    def _make_case(self, i):
+        if self.program == 'TCGA':
+            submitter_id = "TCGA-{0}-{1:04d}".format(self.project_id[-2:], i)
+            tumor_code, normal_code = '01', '11' if self.rng.random() < 0.3 else '10'
+        else:
+            submitter_id = "TARGET-{0}-P{1:05d}".format(self.rng.choice(['10', '20', '30', '40']), i)
+            tumor_code, normal_code = '09', '14' if self.rng.random() < 0.3 else '10'
+        case = {'case_id': self._uuid(), 'submitter_id': submitter_id,
+                'project': {'project_id': self.project_id, 'program': {'name': self.program}}}
+        case['tumor'] = self._make_sample(case, tumor_code)
+        case['normal'] = self._make_sample(case, normal_code)
+        return case
+
+    def _make_sample(self, case, sample_type_id):
+        return {'sample_id': self._uuid(),
+                'submitter_id': "{0}-{1}A".format(case['submitter_id'], sample_type_id),
+                'sample_type_id': sample_type_id}
+
+    def _aliquot(self, sample, analyte):
+        if self.program == 'TCGA':
+            # TCGA-XX-NNNN-01A-11D-A12Q-09: analyte at index 19, plate at 21:25
+            plate = "A{0:03X}".format(self.rng.randrange(4096))
+            return "{0}-{1:02d}{2}-{3}-{4:02d}".format(sample['submitter_id'], self.rng.randrange(10, 40), analyte,
+                                                      plate, self.rng.randrange(1, 30))
+        # TARGET-20-PXXXXX-09A-01D: portion at [-3:-1], analyte last
+        return "{0}-{1:02d}{2}".format(sample['submitter_id'], self.rng.randrange(1, 10), analyte)
+
+    def _sample_doc(self, sample, analyte):
+        doc = {'sample_id': sample['sample_id'], 'submitter_id': sample['submitter_id'],
+               'sample_type_id': sample['sample_type_id'],
+               'portions': [{'analytes': [{'aliquots': [{'submitter_id': self._aliquot(sample, analyte)}]}]}]}
+        return doc
+
+    def _case_doc(self, case, samples=None):
+        doc = {'case_id': case['case_id'], 'submitter_id': case['submitter_id'], 'project': case['project']}
+        if samples is not None:
+            doc['samples'] = samples
+        return doc
+
+    def _add_file(self, kind, cases, extension):
+        data_category, data_type, data_format, experimental_strategy, workflow_type = kind
+        file_id = self._uuid()
+        doc = {'file_id': file_id, 'file_name': "{0}.{1}".format(file_id, extension),
+               'data_category': data_category, 'data_type': data_type, 'data_format': data_format,
+               'access': 'open', 'cases': cases, 'file_size': self.rng.randrange(10**3, 10**9)}
+        if experimental_strategy is not None:
+            doc['experimental_strategy'] = experimental_strategy
+        if workflow_type is not None:
+            doc['analysis'] = {'workflow_type': workflow_type}
+        self.files.append(doc)
+
+    def _add_case_files(self, case, replicate_rate):
+        # one clinical and one biospecimen XML per case
+        self._add_file(CLINICAL_XML, [self._case_doc(case)], 'xml')
+        self._add_file(BIOSPECIMEN_XML, [self._case_doc(case)], 'xml')
+        for kind in SINGLE_SAMPLE_KINDS:
+            analytes = RNA_ANALYTES if kind[3] in ('RNA-Seq', 'miRNA-Seq') else DNA_ANALYTES
+            samples = [case['tumor'], case['normal']] if kind[0] == "Copy Number Variation" else [case['tumor']]
+            for sample in samples:
+                # a replicate is a second file for the same sample, from another aliquot
+                copies = 2 if self.rng.random() < replicate_rate else 1
+                for _ in range(copies):
+                    self._add_file(kind, [self._case_doc(case, [self._sample_doc(sample, self.rng.choice(analytes))])], 'txt')
+        for kind in PAIRED_KINDS:
+            copies = 2 if self.rng.random() < replicate_rate else 1
+            for _ in range(copies):
+                samples = [self._sample_doc(case['tumor'], 'D'), self._sample_doc(case['normal'], 'D')]
+                self.rng.shuffle(samples)
+                self._add_file(kind, [self._case_doc(case, samples)], 'vcf.gz')
+
+    def _add_multi_case_file(self):
+        kind = self.rng.choice(MULTI_CASE_KINDS)
+        members = self.rng.sample(self.cases, min(len(self.cases), self.rng.randrange(2, 200)))
+        if kind[2] == 'MAF':
+            self._add_file(kind, [self._case_doc(c, [self._sample_doc(c['tumor'], 'D'),
+                                                     self._sample_doc(c['normal'], 'D')]) for c in members], 'maf.gz')
+        else:
+            self._add_file(kind, [self._case_doc(c) for c in members], 'txt')
+
+    def generate(self, num_files, replicate_rate, multi_case_rate):
+        """Generate about num_files files, adding cases until there are enough."""
+        num_multi_case = int(num_files * multi_case_rate)
+        while len(self.files) < num_files - num_multi_case:
+            case = self._make_case(len(self.cases))
+            self.cases.append(case)
+            self._add_case_files(case, replicate_rate)
+        if len(self.cases) >= 2:
+            for _ in range(num_multi_case):
+                self._add_multi_case_file()
+        return self.files
+
+
+def generate(num_files, seed=0, programs=PROGRAMS, replicate_rate=0.05, multi_case_rate=0.002):
+    """Return the metadata documents of about num_files synthetic files, mixing the given programs."""
+    rng = random.Random(seed)
+    files = []
+    per_program = max(1, num_files // len(programs))
+    for program in programs:
+        project_id = "TCGA-LUAD" if program == 'TCGA' else "TARGET-AML"
+        project = SyntheticProject(program, project_id, rng)
+        files += project.generate(per_program, replicate_rate, multi_case_rate)
+    return files
+
+
+def write_manifest(files, manifest_filename):
+    with open(manifest_filename, 'w') as fp:
+        writer = csv.DictWriter(fp, fieldnames=MANIFEST_FIELDS, delimiter='\t')
+        writer.writeheader()
+        for doc in files:
+            writer.writerow({'id': doc['file_id'], 'filename': doc['file_name'], 'md5': doc['file_id'].replace('-', ''),
+                             'size': doc['file_size'], 'state': 'released'})
+
+
+def write_metadata(files, metadata_filename):
+    """Write the file metadata documents (one JSON document per line) for mock_gdc_server."""
+    with open(metadata_filename, 'w') as fp:
+        for doc in files:
+            fp.write(json.dumps(doc) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='generate a synthetic GDC manifest and matching file metadata')
+    parser.add_argument("num_files", help="approximate number of files", type=int)
+    parser.add_argument("manifest", help="manifest file to write")
+    parser.add_argument("metadata", help="file metadata (JSON lines) to write, for mock_gdc_server.py")
+    parser.add_argument("--seed", help="random seed", type=int, default=0)
+    parser.add_argument("--programs", help="programs to mix", nargs="+", choices=PROGRAMS, default=PROGRAMS)
+    parser.add_argument("--replicate_rate", help="fraction of single-sample and paired files with a replicate", type=float, default=0.05)
+    parser.add_argument("--multi_case_rate", help="fraction of files associated with multiple cases", type=float, default=0.002)
+    args = parser.parse_args()
+
+    files = generate(args.num_files, args.seed, args.programs, replicate_rate=args.replicate_rate,
+                     multi_case_rate=args.multi_case_rate)
+    write_manifest(files, args.manifest)
+    write_metadata(files, args.metadata)
+    print("wrote {0} files to {1}".format(len(files), args.manifest))
+
+
+if __name__ == '__main__':
+    main()
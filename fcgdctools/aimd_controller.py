@@ -0,0 +1,124 @@
+"""
+Self-tuning concurrency and batch size for GDC requests.
+
+An AIMD (additive increase, multiplicative decrease) controller, as used
+for TCP congestion control: after each window of completed requests it
+raises the number of requests allowed in flight and the number of uuids
+per bulk query by a fixed step if the GDC kept up, and halves them if it
+did not.  The GDC is considered to be struggling when a request was
+throttled (HTTP 429), when the error rate exceeds a threshold, or when
+the median latency rises well above the lowest median seen so far.
+"""
+
+import statistics
+import threading
+import time
+from contextlib import contextmanager
+
+
+class AimdController:
+
+    """Chooses the in-flight request limit and the bulk query batch size
+
+    Attributes:
+        concurrency (int): current limit on requests in flight
+        batch_size (int): current number of uuids per bulk query
+        min_concurrency, max_concurrency (int): bounds of concurrency
+        min_batch_size, max_batch_size (int): bounds of batch_size
+        batch_step (int): additive increase of batch_size
+        window (int): requests observed per adjustment (a throttled request ends the window early)
+        max_error_rate (float): error rate above which the settings are decreased
+        latency_factor (float): a median latency this many times the best median seen counts as congestion
+    """
+    def __init__(self, concurrency=4, min_concurrency=1, max_concurrency=16,
+                 batch_size=500, min_batch_size=50, max_batch_size=2000, batch_step=50,
+                 window=50, max_error_rate=0.05, latency_factor=2.0):
+        self.concurrency = concurrency
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.batch_size = batch_size
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.batch_step = batch_step
+        self.window = window
+        self.max_error_rate = max_error_rate
+        self.latency_factor = latency_factor
+        self._condition = threading.Condition()
+        self._in_flight = 0
+        self._latencies = []
+        self._errors = 0
+        self._throttled = 0
+        self._best_median = None
+        self.increases = 0
+        self.decreases = 0
+        self.history = []
+        self._start = time.time()
+
+    @contextmanager
+    def slot(self):
+        """Context manager holding one of the concurrency slots for the duration of a request."""
+        with self._condition:
+            while self._in_flight >= self.concurrency:
+                self._condition.wait()
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._in_flight -= 1
+                self._condition.notify()
+
+    def record(self, seconds, ok=True, throttled=False):
+        """Observe a completed request; adjusts the settings at the end of each window."""
+        with self._condition:
+            self._latencies.append(seconds)
+            if not ok:
+                self._errors += 1
+            if throttled:
+                self._throttled += 1
+            # like a lost packet in TCP, throttling halves the settings right away
+            if throttled or len(self._latencies) >= self.window:
+                self._adjust()
+
+    def _adjust(self):
+        median = statistics.median(self._latencies)
+        error_rate = self._errors / len(self._latencies)
+        if self._throttled > 0:
+            reason = 'throttled'
+        elif error_rate > self.max_error_rate:
+            reason = 'errors'
+        elif self._best_median is not None and median > self.latency_factor * self._best_median:
+            reason = 'latency'
+        else:
+            reason = None
+
+        if reason is None:
+            concurrency = min(self.max_concurrency, self.concurrency + 1)
+            batch_size = min(self.max_batch_size, self.batch_size + self.batch_step)
+            self.increases += 1
+        else:
+            concurrency = max(self.min_concurrency, self.concurrency // 2)
+            batch_size = max(self.min_batch_size, self.batch_size // 2)
+            self.decreases += 1
+        if reason != 'errors' and reason != 'throttled':
+            self._best_median = median if self._best_median is None else min(self._best_median, median)
+
+        if (concurrency, batch_size) != (self.concurrency, self.batch_size):
+            self.history.append({'seconds': round(time.time() - self._start, 3), 'concurrency': concurrency,
+                                 'batch_size': batch_size, 'reason': reason or 'increase',
+                                 'median_latency': median, 'error_rate': error_rate})
+            # the history goes into the run statistics; keep it small on very long runs
+            del self.history[:-200]
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self._latencies = []
+        self._errors = 0
+        self._throttled = 0
+        self._condition.notify_all()
+
+    def summary(self):
+        """The chosen settings, for the run statistics."""
+        with self._condition:
+            return {'concurrency': self.concurrency, 'batch_size': self.batch_size,
+                    'increases': self.increases, 'decreases': self.decreases,
+                    'best_median_latency': self._best_median, 'history': list(self.history)}
@@ -0,0 +1,136 @@
+"""
+The registry of file attribute names used in the load files.
+
+A file is attached to its entity as a pair of attributes named after the
+kind of file: <basename>uuid_and_filename and <basename>url, where the
+basename abbreviates the experimental strategy, workflow type, data type
+and data format (and, for slide images, the image code from the
+filename), and the set of entities having such a file is named after the
+basename without its trailing '__'.  A cohort has a handful of kinds of
+files, so AttributeSchema derives these names once per kind, as an
+interned FileAttribute, and every later file of that kind costs a dict
+lookup.  The load file writers, the URL resolution and the merge of
+shards look attribute names up in the same registry instead of slicing
+suffixes off them.
+"""
+
+import sys
+import threading
+
+UUID_ATTRIBUTE_SUFFIX = "uuid_and_filename"
+URL_ATTRIBUTE_SUFFIX = "url"
+
+
+class FileAttribute:
+
+    """The names of the attributes holding one kind of file
+
+    Attributes:
+        id (int): stable within a run; numbered in order of registration
+        basename (str): common prefix of the attribute names, ending in '__'
+        uuid_name (str): name of the attribute holding "<file uuid>/<filename>"
+        url_name (str): name of the attribute holding the file's URL
+        set_name (str): name of the entity set of the entities having such a file
+    """
+    __slots__ = ['id', 'basename', 'uuid_name', 'url_name', 'set_name']
+
+    def __init__(self, id, basename):
+        self.id = id
+        self.basename = sys.intern(basename)
+        self.uuid_name = sys.intern(basename + UUID_ATTRIBUTE_SUFFIX)
+        self.url_name = sys.intern(basename + URL_ATTRIBUTE_SUFFIX)
+        self.set_name = sys.intern(basename[:-2])
+
+    def __repr__(self):
+        return "FileAttribute({0}, {1!r})".format(self.id, self.basename)
+
+
+class AttributeSchema:
+
+    """Memoized naming of file attributes
+
+    Attributes:
+        exp_strategy (DataSource): abbreviates experimental strategies
+        workflow (DataSource): abbreviates workflow types
+        attributes (list of FileAttribute): in order of registration
+    """
+    def __init__(self, exp_strategy, workflow):
+        self.exp_strategy = exp_strategy
+        self.workflow = workflow
+        self.attributes = []
+        # (experimental_strategy, workflow_type, data_type, data_format, image_code) -> FileAttribute
+        self._by_kind = dict()
+        # attribute name -> FileAttribute if the name is a uuid attribute's, else None
+        self._by_uuid_name = dict()
+        self._lock = threading.Lock()
+
+    def _register(self, basename):
+        # callers hold _lock
+        attribute = self._by_uuid_name.get(basename + UUID_ATTRIBUTE_SUFFIX)
+        if attribute is None:
+            attribute = FileAttribute(len(self.attributes), basename)
+            self.attributes.append(attribute)
+            self._by_uuid_name[attribute.uuid_name] = attribute
+        return attribute
+
+    def _basename(self, experimental_strategy, workflow_type, data_type, data_format, image_code):
+        if experimental_strategy is not None:
+            experimental_strategy_abbrev = self.exp_strategy.getAbbreviation(experimental_strategy) + '__'
+        else:
+            experimental_strategy_abbrev = ''
+
+        if workflow_type is not None:
+            workflow_type_abbrev = self.workflow.getAbbreviation(workflow_type) + '__'
+        else:
+            workflow_type_abbrev = ''
+
+        data_type_lc = data_type.lower().replace(" ", "_") + '__'
+
+        if image_code is not None:
+            # slide images are named after their image code instead of their data format
+            return experimental_strategy_abbrev + workflow_type_abbrev + image_code.lower() + '__' + data_type_lc
+        data_format_lc = data_format.lower().replace(" ", "_") + '__'
+        return experimental_strategy_abbrev + workflow_type_abbrev + data_type_lc + data_format_lc
+
+    def attribute(self, experimental_strategy, workflow_type, data_type, data_format, image_code=None):
+        """Return the FileAttribute of a kind of file, registering it on first use."""
+        key = (experimental_strategy, workflow_type, data_type, data_format, image_code)
+        attribute = self._by_kind.get(key)
+        if attribute is None:
+            with self._lock:
+                attribute = self._by_kind.get(key)
+                if attribute is None:
+                    basename = self._basename(experimental_strategy, workflow_type, data_type, data_format, image_code)
+                    attribute = self._by_kind[key] = self._register(basename)
+        return attribute
+
+    def file_attribute(self, attribute_name):
+        """Return the FileAttribute whose uuid attribute is attribute_name, or None for other attributes.
+
+        Names not registered yet, e.g., read back from a shard's partial state, are registered.
+        """
+        try:
+            return self._by_uuid_name[attribute_name]
+        except KeyError:
+            pass
+        with self._lock:
+            if attribute_name in self._by_uuid_name:
+                return self._by_uuid_name[attribute_name]
+            if attribute_name.endswith(UUID_ATTRIBUTE_SUFFIX):
+                return self._register(attribute_name[:-len(UUID_ATTRIBUTE_SUFFIX)])
+            self._by_uuid_name[attribute_name] = None
+            return None
+
+    def column_order(self, entities, excluded=()):
+        """Return the attribute names of the entities, in order of first appearance, less the excluded ones.
+
+        Unlike a list, the columns seen so far are checked in constant time.
+        """
+        columns = dict()
+        for entity in entities:
+            for attribute_name in entity:
+                if attribute_name not in columns:
+                    columns[attribute_name] = None
+        for attribute_name in excluded:
+            columns.pop(attribute_name, None)
+        return list(columns)
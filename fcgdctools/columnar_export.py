@@ -0,0 +1,107 @@
+"""
+Columnar export of the entity model assembled by genFcWsLoadFiles.
+
+Writes the participant (case), sample and pair tables, restricted to their
+fixed columns, plus a long-form table with one row per file attribute
+value (entity type, entity id, attribute basename, file uuid, filename,
+url).  Unlike the FireCloud load files, these tables are not sparse.
+Low-cardinality string columns are dictionary encoded.
+
+Tables are written as Arrow IPC files (which can be memory-mapped) or
+Parquet files.  Requires the optional pyarrow package.
+"""
+
+import os
+
+try:
+    import pyarrow
+    import pyarrow.feather
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+DELETE = '__DELETE__'
+SEPARATOR = '/'
+
+FORMAT_EXTENSIONS = {'arrow': '.arrow', 'parquet': '.parquet'}
+
+
+def _table(columns, dictionary_columns):
+    arrays = []
+    for name, values in columns.items():
+        array = pyarrow.array(values, type=pyarrow.string())
+        if name in dictionary_columns:
+            array = array.dictionary_encode()
+        arrays.append(array)
+    return pyarrow.Table.from_arrays(arrays, names=list(columns))
+
+
+def _write_table(table, filename, fmt):
+    if fmt == 'parquet':
+        pyarrow.parquet.write_table(table, filename)
+    else:
+        # uncompressed so that readers can memory-map the file
+        pyarrow.feather.write_feather(table, filename, compression='uncompressed')
+
+
+def _file_rows(entity_type, entity_id, entity, schema, file_columns):
+    for attribute_name, value in entity.items():
+        attribute = schema.file_attribute(attribute_name)
+        if attribute is None:
+            continue
+        file_uuid, filename = value.split(SEPARATOR, 1)
+        url = entity.get(attribute.url_name)
+        file_columns['entity_type'].append(entity_type)
+        file_columns['entity_id'].append(entity_id)
+        file_columns['attribute'].append(attribute.set_name)
+        file_columns['file_uuid'].append(file_uuid)
+        file_columns['filename'].append(filename)
+        file_columns['url'].append(url if url != DELETE else None)
+
+
+def export_entity_model(cases, samples, pairs, schema, sample_type, output_dir, basename, fmt='arrow'):
+    """Write the entity model as columnar tables to output_dir; returns the list of files written.
+
+    schema is the attribute_schema.AttributeSchema the model was built with, and
+    sample_type the DataSource of the GDC sample types.
+    """
+    if pyarrow is None:
+        raise ImportError("columnar export requires the pyarrow package (pip install fcgdctools[columnar])")
+
+    os.makedirs(output_dir, exist_ok=True)
+    file_columns = {'entity_type': [], 'entity_id': [], 'attribute': [], 'file_uuid': [], 'filename': [], 'url': []}
+
+    case_columns = {'participant_id': [], 'submitter_id': [], 'project_id': []}
+    for case_id, case in cases.items():
+        case_columns['participant_id'].append(case_id)
+        case_columns['submitter_id'].append(case['submitter_id'])
+        case_columns['project_id'].append(case['project_id'])
+        _file_rows('participant', case_id, case, schema, file_columns)
+
+    sample_columns = {'sample_id': [], 'participant_id': [], 'submitter_id': [], 'sample_type': []}
+    for sample_id, sample in samples.items():
+        sample_columns['sample_id'].append(sample_id)
+        sample_columns['participant_id'].append(sample['case_id'])
+        sample_columns['submitter_id'].append(sample['submitter_id'])
+        sample_columns['sample_type'].append(sample_type.getLetterCode(sample['sample_type_id']))
+        _file_rows('sample', sample_id, sample, schema, file_columns)
+
+    pair_columns = {'pair_id': [], 'participant_id': [], 'case_sample_id': [], 'control_sample_id': []}
+    for pair_id, pair in pairs.items():
+        pair_columns['pair_id'].append(pair_id)
+        pair_columns['participant_id'].append(samples[pair['tumor']]['case_id'])
+        pair_columns['case_sample_id'].append(pair['tumor'])
+        pair_columns['control_sample_id'].append(pair['normal'])
+        _file_rows('pair', pair_id, pair, schema, file_columns)
+
+    tables = [('participants', _table(case_columns, {'project_id'})),
+              ('samples', _table(sample_columns, {'participant_id', 'sample_type'})),
+              ('pairs', _table(pair_columns, {'participant_id'})),
+              ('files', _table(file_columns, {'entity_type', 'entity_id', 'attribute'}))]
+
+    written = []
+    for name, table in tables:
+        filename = os.path.join(output_dir, "{0}_{1}{2}".format(basename, name, FORMAT_EXTENSIONS[fmt]))
+        _write_table(table, filename, fmt)
+        written.append(filename)
+    return written
@@ -0,0 +1,48 @@
+"""
+Size-balanced batches of the files of one attribute, for downloading.
+
+The membership load files put every entity having a file attribute into
+one set named after the attribute, so a downloader workflow launched on
+that set runs as one batch of very uneven jobs: aligned reads of tens of
+gigabytes next to kilobyte-sized VCFs.  With a target batch size, the
+load file writers additionally split each attribute's entities into
+sets of roughly equal total bytes (<set name>__batch001, ...), using the
+file sizes from the manifest's size column.
+
+The entities are packed with the LPT (longest processing time first)
+rule: the number of batches is the total size divided by the target,
+rounded up, and each file, largest first, goes into the batch holding
+the fewest bytes so far.
+"""
+
+import heapq
+import math
+
+
+def batch_set_name(set_name, k):
+    """The name of batch k (counting from 1) of the entity set set_name."""
+    return "{0}__batch{1:03d}".format(set_name, k)
+
+
+def balanced_batches(sizes, batch_bytes):
+    """Split the items with sizes into batches of roughly equal total size, about batch_bytes each.
+
+    Returns lists of item indices, each in increasing order.  A size of None
+    counts as the mean of the known sizes.
+    """
+    known = [size for size in sizes if size is not None]
+    if len(known) == 0:
+        return [list(range(len(sizes)))] if sizes else []
+    mean = sum(known) / float(len(known))
+    sizes = [size if size is not None else mean for size in sizes]
+
+    num_batches = max(1, min(len(sizes), int(math.ceil(sum(sizes) / float(batch_bytes)))))
+    # (bytes so far, batch number) of every batch; the lightest batch is at the top
+    heap = [(0, k) for k in range(num_batches)]
+    batches = [[] for _ in range(num_batches)]
+    for i in sorted(range(len(sizes)), key=lambda i: -sizes[i]):
+        total, k = heapq.heappop(heap)
+        batches[k].append(i)
+        heapq.heappush(heap, (total + sizes[i], k))
+    # batches stay empty only if files have no size
+    return [sorted(batch) for batch in batches if batch]
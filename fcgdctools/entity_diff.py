@@ -0,0 +1,272 @@
+"""
+Differential uploads of FireCloud workspace load files.
+
+The load files written by genFcWsLoadFiles describe the complete
+participant, sample and pair tables (and their set memberships).  When
+refreshing an existing workspace most rows are unchanged.  The functions
+in this module compare newly generated load files with the workspace's
+current contents - taken either from a local snapshot of the files
+last uploaded or from the FireCloud entity endpoints - and produce delta
+load files containing only added or changed rows and columns, plus the
+list of entities that must be deleted.
+"""
+
+import csv
+import os
+
+import loadfile_io
+
+DELETE = '__DELETE__'
+SNAPSHOT_DIRNAME = 'last_upload'
+
+# upload order; deletions happen in reverse so that referencing entities go first
+ENTITY_TYPES = ['participant', 'sample', 'pair']
+
+
+def _is_absent(value):
+    return value is None or value == '' or value == DELETE
+
+
+class EntityTable:
+
+    """The contents of an entity load file
+
+    Attributes:
+        entity_type (str): e.g. 'sample'
+        columns (list): attribute columns, excluding the entity id column
+        rows (dict): maps entity id to a dict of attribute column values
+    """
+    def __init__(self, entity_type, columns, rows):
+        self.entity_type = entity_type
+        self.columns = columns
+        self.rows = rows
+
+
+class MembershipTable:
+
+    """The contents of a set membership load file
+
+    Attributes:
+        entity_type (str): the member entity type, e.g. 'sample'
+        sets (dict): maps set id to the set of member entity ids
+    """
+    def __init__(self, entity_type, sets):
+        self.entity_type = entity_type
+        self.sets = sets
+
+
+def read_entity_file(filenames, entity_type):
+    """Read an entity load file given as the list of its chunks; no files yield an empty table."""
+    header = loadfile_io.read_header(filenames)
+    if header is None:
+        return EntityTable(entity_type, [], dict())
+    id_column = header[0]
+    rows = dict()
+    for row in loadfile_io.read_rows(filenames):
+        entity_id = row.pop(id_column)
+        rows[entity_id] = row
+    return EntityTable(entity_type, header[1:], rows)
+
+
+def read_membership_file(filenames, entity_type):
+    """Read a set membership load file given as the list of its chunks."""
+    sets = dict()
+    header = loadfile_io.read_header(filenames)
+    if header is not None:
+        set_column, member_column = header
+        for row in loadfile_io.read_rows(filenames):
+            sets.setdefault(row[set_column], set()).add(row[member_column])
+    return MembershipTable(entity_type, sets)
+
+
+def _attribute_value(attributes, column):
+    # reference attributes (e.g., a sample's participant) appear in load files as <name>_id columns
+    if column in attributes:
+        value = attributes[column]
+    elif column.endswith('_id') and isinstance(attributes.get(column[:-3]), dict):
+        value = attributes[column[:-3]]
+    else:
+        return None
+    if isinstance(value, dict):
+        return value.get('entityName')
+    return str(value)
+
+
+def fetch_entity_table(api, billing_project, workspace_name, entity_type, columns):
+    """Build an EntityTable from the workspace's current entities of entity_type.
+
+    api is firecloud.api, or any object providing get_entities().  Attributes are
+    mapped onto the load file columns given in columns; attributes not among them
+    are added as extra columns so that they can be deleted.
+    """
+    response = api.get_entities(billing_project, workspace_name, entity_type)
+    response.raise_for_status()
+    columns = list(columns)
+    rows = dict()
+    for entity in response.json():
+        attributes = entity['attributes']
+        for name, value in attributes.items():
+            if not isinstance(value, dict) and name not in columns:
+                columns.append(name)
+        rows[entity['name']] = {column: _attribute_value(attributes, column) for column in columns}
+    return EntityTable(entity_type, columns, rows)
+
+
+def fetch_membership_table(api, billing_project, workspace_name, entity_type):
+    response = api.get_entities(billing_project, workspace_name, entity_type + '_set')
+    response.raise_for_status()
+    sets = dict()
+    for entity in response.json():
+        members = entity['attributes'].get(entity_type + 's', dict()).get('items', [])
+        sets[entity['name']] = set(member['entityName'] for member in members)
+    return MembershipTable(entity_type, sets)
+
+
+def diff_entity_tables(old, new):
+    """Compare two EntityTables.
+
+    Returns (columns, changed_rows, deleted_ids), where changed_rows maps the id of
+    each added or changed entity to its row restricted to columns, the union of the
+    columns that changed in any row.  Attributes that disappeared are set to __DELETE__.
+    """
+    changed = dict()
+    changed_columns = []
+    for entity_id, new_row in new.rows.items():
+        old_row = old.rows.get(entity_id)
+        if old_row is None:
+            # new entity: every attribute with a value must be sent
+            row_changes = [c for c in new.columns if not _is_absent(new_row.get(c))]
+        else:
+            row_changes = []
+            for column in new.columns:
+                new_value, old_value = new_row.get(column), old_row.get(column)
+                if _is_absent(new_value) and _is_absent(old_value):
+                    continue
+                if new_value != old_value:
+                    row_changes.append(column)
+            row_changes += [c for c in old.columns if c not in new.columns and not _is_absent(old_row.get(c))]
+        if len(row_changes) > 0 or old_row is None:
+            changed[entity_id] = row_changes
+            changed_columns += [c for c in row_changes if c not in changed_columns]
+
+    # keep the original column order
+    columns = [c for c in new.columns if c in changed_columns] + [c for c in changed_columns if c not in new.columns]
+    changed_rows = dict()
+    for entity_id in changed:
+        new_row = new.rows[entity_id]
+        changed_rows[entity_id] = {c: new_row[c] if c in new.columns and not _is_absent(new_row.get(c)) else DELETE
+                                   for c in columns}
+
+    deleted_ids = [entity_id for entity_id in old.rows if entity_id not in new.rows]
+    return columns, changed_rows, deleted_ids
+
+
+def diff_membership_tables(old, new):
+    """Compare two MembershipTables.
+
+    Returns (changed_sets, deleted_set_ids); changed_sets maps each new or modified
+    set to its complete member list, since a membership upload defines a set's members.
+    """
+    changed_sets = {set_id: members for set_id, members in new.sets.items()
+                    if old.sets.get(set_id) != members}
+    deleted_set_ids = [set_id for set_id in old.sets if set_id not in new.sets]
+    return changed_sets, deleted_set_ids
+
+
+def write_entity_delta(filename, entity_type, columns, changed_rows):
+    id_column = 'entity:{0}_id'.format(entity_type)
+    with open(filename, 'w') as fp:
+        writer = csv.DictWriter(fp, fieldnames=[id_column] + columns, delimiter='\t')
+        writer.writeheader()
+        for entity_id, row in changed_rows.items():
+            entity_row = {id_column: entity_id}
+            entity_row.update(row)
+            writer.writerow(entity_row)
+
+
+def write_membership_delta(filename, entity_type, changed_sets):
+    with open(filename, 'w') as fp:
+        writer = csv.writer(fp, delimiter='\t')
+        writer.writerow(['membership:{0}_set_id'.format(entity_type), '{0}_id'.format(entity_type)])
+        for set_id, members in changed_sets.items():
+            for member_id in sorted(members):
+                writer.writerow([set_id, member_id])
+
+
+def snapshot_files(snapshot_dir, filetype):
+    return loadfile_io.find_load_files(os.path.join(snapshot_dir, filetype))
+
+
+def save_snapshot(snapshot_dir, load_files):
+    """Record the load files that were uploaded.
+
+    load_files maps file type to the list of files (chunks) holding it; the
+    snapshot keeps a single uncompressed file per file type.
+    """
+    os.makedirs(snapshot_dir, exist_ok=True)
+    for filetype, filenames in load_files.items():
+        target = os.path.join(snapshot_dir, filetype + '.txt')
+        header = loadfile_io.read_header(filenames)
+        if header is not None:
+            with open(target, 'w', newline='') as fp:
+                writer = csv.DictWriter(fp, fieldnames=header, delimiter='\t')
+                writer.writeheader()
+                writer.writerows(loadfile_io.read_rows(filenames))
+        elif os.path.exists(target):
+            os.remove(target)
+
+
+def upload_differences(api, billing_project, workspace_name, load_files, delta_prefix, snapshot_dir=None):
+    """Upload only what changed between the workspace and the given load files.
+
+    load_files maps file type (e.g., 'samples', 'sample_sets_membership') to the
+    list of files (chunks) holding the newly generated load file.  The current
+    workspace contents are read from snapshot_dir if given, otherwise they are
+    fetched from FireCloud.  Delta load files are written with delta_prefix.
+    Returns the list of delta files uploaded.
+    """
+    uploaded = []
+    deletions = []
+    for entity_type in ENTITY_TYPES:
+        entity_filetype = entity_type + 's'
+        membership_filetype = entity_type + '_sets_membership'
+
+        new_entities = read_entity_file(load_files.get(entity_filetype, []), entity_type)
+        new_sets = read_membership_file(load_files.get(membership_filetype, []), entity_type)
+        if snapshot_dir is not None:
+            old_entities = read_entity_file(snapshot_files(snapshot_dir, entity_filetype), entity_type)
+            old_sets = read_membership_file(snapshot_files(snapshot_dir, membership_filetype), entity_type)
+        else:
+            old_entities = fetch_entity_table(api, billing_project, workspace_name, entity_type, new_entities.columns)
+            old_sets = fetch_membership_table(api, billing_project, workspace_name, entity_type)
+
+        columns, changed_rows, deleted_ids = diff_entity_tables(old_entities, new_entities)
+        changed_sets, deleted_set_ids = diff_membership_tables(old_sets, new_sets)
+        print("{0}: {1} added or changed, {2} deleted; {3} sets added or changed, {4} sets deleted".format(
+            entity_type, len(changed_rows), len(deleted_ids), len(changed_sets), len(deleted_set_ids)))
+
+        if len(changed_rows) > 0:
+            filename = delta_prefix + "_" + entity_filetype + ".delta.txt"
+            write_entity_delta(filename, entity_type, columns, changed_rows)
+            print("Uploading file {0}".format(filename))
+            response = api.upload_entities_tsv(billing_project, workspace_name, filename)
+            response.raise_for_status()
+            uploaded.append(filename)
+        if len(changed_sets) > 0:
+            filename = delta_prefix + "_" + membership_filetype + ".delta.txt"
+            write_membership_delta(filename, entity_type, changed_sets)
+            print("Uploading file {0}".format(filename))
+            response = api.upload_entities_tsv(billing_project, workspace_name, filename)
+            response.raise_for_status()
+            uploaded.append(filename)
+
+        deletions.append([{'entityType': entity_type + '_set', 'entityName': set_id} for set_id in deleted_set_ids] +
+                         [{'entityType': entity_type, 'entityName': entity_id} for entity_id in deleted_ids])
+
+    for entities in reversed(deletions):
+        if len(entities) > 0:
+            print("Deleting {0} entities".format(len(entities)))
+            response = api.delete_entities(billing_project, workspace_name, entities)
+            response.raise_for_status()
+
+    return uploaded
@@ -0,0 +1,209 @@
+"""
+A disk-backed store for the entity model, bounding memory use on large manifests.
+
+The entity model (participants, samples and pairs) is built as dicts of
+entity id -> attribute dict.  An EntityStore behaves like such a dict.
+It starts out in memory; once the process's resident set size passes the
+threshold of its SpillFile, all stores move their entities to a shared
+SQLite file and from then on keep only the most recently used entities in
+memory, writing them back when they are evicted.  Iteration streams the
+entities from the file in insertion order, so the load file writers see
+the entities in the same order as with plain dicts.
+
+Callers must not keep an entity obtained from a store across accesses
+to other entities of that store: once evicted, changes to it are lost.
+The model-building code only ever modifies an entity right after
+looking it up.
+"""
+
+import json
+import os
+import sqlite3
+import tempfile
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+from fcgdctools import run_stats
+
+
+def current_rss_bytes():
+    """Return the current resident set size (the peak, where the current size is not available)."""
+    try:
+        with open('/proc/self/statm') as fp:
+            return int(fp.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return run_stats.peak_rss_bytes()
+
+
+class SpillFile:
+
+    """The SQLite file the EntityStores of one run spill to
+
+    Attributes:
+        threshold_bytes (int): resident set size above which the stores spill
+        directory (str): directory for the SQLite file (default: the system temporary directory)
+        cache_size (int): entities per store kept in memory once spilled
+        check_interval (int): number of inserted entities between checks of the resident set size
+    """
+    def __init__(self, threshold_bytes, directory=None, cache_size=10000, check_interval=1000):
+        self.threshold_bytes = threshold_bytes
+        self.cache_size = cache_size
+        self.check_interval = check_interval
+        fd, self.filename = tempfile.mkstemp(prefix='fcgdctools_entities_', suffix='.sqlite', dir=directory)
+        os.close(fd)
+        self.conn = sqlite3.connect(self.filename)
+        # the file is scratch space: durability is not needed, and WAL lets iteration read a stable snapshot
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=OFF")
+        self.conn.execute("CREATE TABLE entities (store TEXT NOT NULL, entity_id TEXT NOT NULL, seq INTEGER NOT NULL, "
+                          "data TEXT NOT NULL, PRIMARY KEY (store, entity_id))")
+        self.conn.execute("CREATE INDEX entities_order ON entities (store, seq)")
+        self.conn.commit()
+        self.spilled = False
+        self.stores = []
+        self._inserts = 0
+
+    def store(self, name):
+        """Create an empty EntityStore backed by this file."""
+        store = EntityStore(name, self)
+        self.stores.append(store)
+        return store
+
+    def note_insert(self):
+        self._inserts += 1
+        if self.spilled or self._inserts % self.check_interval != 0:
+            return
+        rss = current_rss_bytes()
+        if rss > self.threshold_bytes:
+            print("resident set size {0:.0f} MB is above {1:.0f} MB; moving the entity model to {2}".format(
+                rss / 2**20, self.threshold_bytes / 2**20, self.filename))
+            self.spilled = True
+            for store in self.stores:
+                store._spill()
+
+    def reader(self):
+        """A separate connection, for iterating while entities are written back."""
+        return sqlite3.connect(self.filename)
+
+    def close(self):
+        """Close and delete the file."""
+        self.conn.close()
+        for suffix in ['', '-wal', '-shm']:
+            if os.path.exists(self.filename + suffix):
+                os.remove(self.filename + suffix)
+
+
+class EntityStore(MutableMapping):
+
+    """A dict of entity id -> entity (a dict of attributes) that can spill to a SpillFile
+
+    Attributes:
+        name (str): distinguishes this store's entities in the file
+        spill_file (SpillFile): the file shared by the stores of a run
+    """
+    def __init__(self, name, spill_file):
+        self.name = name
+        self.spill_file = spill_file
+        # entity id -> [insertion sequence number, entity]; all entities until
+        # spilled, afterwards the most recently used ones
+        self._cache = OrderedDict()
+        self._next_seq = 0
+
+    def _write(self, entries):
+        self.spill_file.conn.executemany(
+            "INSERT INTO entities (store, entity_id, seq, data) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (store, entity_id) DO UPDATE SET data = excluded.data",
+            ((self.name, entity_id, seq, json.dumps(entity)) for entity_id, (seq, entity) in entries))
+
+    def _flush(self):
+        """Write all cached entities back to the file."""
+        self._write(self._cache.items())
+        self.spill_file.conn.commit()
+
+    def _evict(self):
+        evicted = []
+        while len(self._cache) > self.spill_file.cache_size:
+            evicted.append(self._cache.popitem(last=False))
+        if evicted:
+            self._write(evicted)
+
+    def _spill(self):
+        self._flush()
+        self._evict()
+        self.spill_file.conn.commit()
+
+    def __getitem__(self, entity_id):
+        entry = self._cache.get(entity_id)
+        if entry is not None:
+            if self.spill_file.spilled:
+                self._cache.move_to_end(entity_id)
+            return entry[1]
+        if not self.spill_file.spilled:
+            raise KeyError(entity_id)
+        row = self.spill_file.conn.execute("SELECT seq, data FROM entities WHERE store = ? AND entity_id = ?",
+                                           (self.name, entity_id)).fetchone()
+        if row is None:
+            raise KeyError(entity_id)
+        entry = [row[0], json.loads(row[1])]
+        self._cache[entity_id] = entry
+        self._evict()
+        return entry[1]
+
+    def __contains__(self, entity_id):
+        if entity_id in self._cache:
+            return True
+        if not self.spill_file.spilled:
+            return False
+        return self.spill_file.conn.execute("SELECT 1 FROM entities WHERE store = ? AND entity_id = ?",
+                                            (self.name, entity_id)).fetchone() is not None
+
+    def __setitem__(self, entity_id, entity):
+        if entity_id in self._cache:
+            self._cache[entity_id][1] = entity
+            self._cache.move_to_end(entity_id)
+            return
+        # an entity already in the file keeps its sequence number (see _write)
+        self._cache[entity_id] = [self._next_seq, entity]
+        self._next_seq += 1
+        if self.spill_file.spilled:
+            self._evict()
+        self.spill_file.note_insert()
+
+    def __delitem__(self, entity_id):
+        found = self._cache.pop(entity_id, None) is not None
+        if self.spill_file.spilled:
+            cursor = self.spill_file.conn.execute("DELETE FROM entities WHERE store = ? AND entity_id = ?", (self.name, entity_id))
+            found = found or cursor.rowcount > 0
+        if not found:
+            raise KeyError(entity_id)
+
+    def __len__(self):
+        if not self.spill_file.spilled:
+            return len(self._cache)
+        self._flush()
+        return self.spill_file.conn.execute("SELECT COUNT(*) FROM entities WHERE store = ?", (self.name,)).fetchone()[0]
+
+    def _rows(self, columns):
+        self._flush()
+        conn = self.spill_file.reader()
+        try:
+            cursor = conn.execute("SELECT {0} FROM entities WHERE store = ? ORDER BY seq".format(columns), (self.name,))
+            for row in cursor:
+                yield row
+        finally:
+            conn.close()
+
+    def __iter__(self):
+        if not self.spill_file.spilled:
+            return iter(list(self._cache))
+        return (row[0] for row in self._rows("entity_id"))
+
+    def items(self):
+        """Iterate over (entity id, entity) in insertion order; once spilled, the entities are
+        read from the file, and changing them has no effect on the store."""
+        if not self.spill_file.spilled:
+            return ((entity_id, entry[1]) for entity_id, entry in self._cache.items())
+        return ((row[0], json.loads(row[1])) for row in self._rows("entity_id, data"))
+
+    def values(self):
+        return (entity for _, entity in self.items())
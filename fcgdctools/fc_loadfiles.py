@@ -1,6 +1,9 @@
 import csv
+import functools
 import requests
 import argparse
+import glob
+import json
 import pprint
 import os.path
 import sys
@@ -8,10 +11,31 @@ import time
 import traceback
 
 from fcgdctools import gdc_uuidresolver 
+from fcgdctools import gdc_metadatacache
+from fcgdctools import loadfile_io
+from fcgdctools import run_stats
+from fcgdctools import phase_profiler
+from fcgdctools import progress_metrics
+from fcgdctools import http_cassette
+from fcgdctools import manifest_pipeline
+from fcgdctools import sharding
+from fcgdctools import entity_store
+from fcgdctools import request_hedging
+from fcgdctools import aimd_controller
+from fcgdctools import gdc_bulk
+from fcgdctools import table_assembly
+from fcgdctools import attribute_schema
+from fcgdctools import download_batches
 
 
 DEFERRED_FILE_NUM_OF_CASES = dict()
 
+# performance statistics for the current run; written out by main() if --stats is given
+RUN_STATS = run_stats.RunStats()
+
+# phases that --profile writes a profile for
+PROFILED_PHASES = ['manifest_read', 'main_pass', 'deferred_pass', 'write_load_files']
+
 GDC_API_ROOT = "https://api.gdc.cancer.gov"
 
 #program
@@ -119,6 +143,9 @@ WORKFLOW_ABBREVIATIONS = {
 
 WORKFLOW = DataSource(WORKFLOW_ABBREVIATIONS)
 
+# names of the file attributes, derived once per kind of file
+ATTRIBUTE_SCHEMA = attribute_schema.AttributeSchema(EXP_STRATEGY, WORKFLOW)
+
 PLATFORM_ABBREVIATIONS = {
         'Affymetrix SNP 6.0' : 'AffySNP6',
         'Illumina' : 'Illum',
@@ -178,16 +205,83 @@ class SampleType:
 SAMPLE_TYPE = SampleType()
 
 class MetadataRetriever():
-    def __init__(self, gdc_api_root, fields):
+    # optional gdc_metadatacache.MetadataCache shared by the retrievers without a cache of their own; set by main()
+    cache = None
+    # optional http_cassette.Cassette recording or replaying all responses; set by main()
+    cassette = None
+    # optional request_hedging.HedgedRequester issuing the GDC requests; set by main()
+    requester = None
+    # optional aimd_controller.AimdController limiting the requests in flight; set by main()
+    controller = None
+    # optional requests.Session reusing connections across requests; set by loadfile_service
+    session = None
+
+    def __init__(self, gdc_api_root, fields, cache=None):
         self.gdc_api_root = gdc_api_root
         self.fields = fields
+        if cache is not None:
+            # this retriever's own cache, in place of the shared one
+            self.cache = cache
 
     def get_metadata(self, file_uuid):
+        cassette = MetadataRetriever.cassette
+        if cassette is not None and cassette.mode == http_cassette.REPLAY:
+            RUN_STATS.count('cassette_replays')
+            return cassette.replay(self.fields, file_uuid)
+        data = self._fetch_metadata(file_uuid)
+        if cassette is not None:
+            # cache hits are recorded too, so that the cassette alone can replay the run
+            cassette.record(self.fields, file_uuid, data)
+        return data
+
+    def _fetch_metadata(self, file_uuid):
+        cache = self.cache
+        if cache is not None:
+            data = cache.get(self.fields, file_uuid)
+            if data is not None:
+                RUN_STATS.count('metadata_cache_hits')
+                return data
+            RUN_STATS.count('metadata_cache_misses')
         url = "{0}/files/{1}?fields={2}".format(self.gdc_api_root, file_uuid, self.fields)
-        response = requests.get(url, headers=None, timeout=5)
-        responseDict = response.json()
+        controller = MetadataRetriever.controller
+        if controller is None:
+            responseDict = self._request(url)
+        else:
+            with controller.slot():
+                responseDict = self._request(url)
+        if cache is not None:
+            cache.put(self.fields, file_uuid, responseDict['data'])
         return responseDict['data']
 
+    def _request(self, url):
+        RUN_STATS.request_started()
+        start = time.time()
+        status = None
+        try:
+            if MetadataRetriever.requester is not None:
+                response = MetadataRetriever.requester.get(url, self.fields)
+            elif MetadataRetriever.session is not None:
+                response = MetadataRetriever.session.get(url, headers=None, timeout=5)
+            else:
+                response = requests.get(url, headers=None, timeout=5)
+            status = response.status_code
+            responseDict = response.json()
+            if 'data' not in responseDict:
+                raise KeyError('data')
+        except Exception as x:
+            seconds = time.time() - start
+            RUN_STATS.record_request(self.fields, seconds, ok=False)
+            if MetadataRetriever.controller is not None:
+                if isinstance(x, requests.HTTPError) and x.response is not None:
+                    status = x.response.status_code
+                MetadataRetriever.controller.record(seconds, ok=False, throttled=status == 429)
+            raise
+        seconds = time.time() - start
+        RUN_STATS.record_request(self.fields, seconds)
+        if MetadataRetriever.controller is not None:
+            MetadataRetriever.controller.record(seconds)
+        return responseDict
+
 class CaseMetadataRetriever(MetadataRetriever):
     def __init__(self, gdc_api_root):
         fields = "cases.case_id,cases.submitter_id,cases.project.project_id"
@@ -205,8 +299,40 @@ class FileMetadataRetriever(MetadataRetriever):
         MetadataRetriever.__init__(self, gdc_api_root, fields)
         
 SEPARATOR = '/'
-UUID_ATTRIBUTE_SUFFIX = "uuid_and_filename"
-URL_ATTRIBUTE_SUFFIX = "url"
+UUID_ATTRIBUTE_SUFFIX = attribute_schema.UUID_ATTRIBUTE_SUFFIX
+URL_ATTRIBUTE_SUFFIX = attribute_schema.URL_ATTRIBUTE_SUFFIX
+
+def _expand_manifests(patterns):
+    """Expand glob patterns (quoted, or from shells that do not expand them) into manifest files, in order and without repeats.
+
+    Raises ValueError if a pattern matches no file.
+    """
+    manifestFiles = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern] if os.path.isfile(pattern) else []
+        if len(matches) == 0:
+            raise ValueError("no manifest file matches {0}".format(pattern))
+        for manifestFile in matches:
+            if manifestFile not in manifestFiles:
+                manifestFiles.append(manifestFile)
+    return manifestFiles
+
+def _read_manifestFiles(manifestFiles):
+    """Read and concatenate manifests, keeping only the first row of each file uuid.
+
+    Returns the rows and the number of duplicate rows dropped.
+    """
+    manifestFileList = []
+    seen = set()
+    duplicates = 0
+    for manifestFile in manifestFiles:
+        for row in _read_manifestFile(manifestFile):
+            if row['id'] in seen:
+                duplicates += 1
+                continue
+            seen.add(row['id'])
+            manifestFileList.append(row)
+    return manifestFileList, duplicates
 
 def _read_manifestFile(manifestFile):
 
@@ -219,6 +345,15 @@ def _read_manifestFile(manifestFile):
 
     return manifestFileList
 
+def _manifest_file_sizes(manifestFileList):
+    """Return a dict of file uuid -> size in bytes, from the manifest's size column where present."""
+    file_sizes = dict()
+    for row in manifestFileList:
+        size = row.get('size')
+        if size:
+            file_sizes[row['id']] = int(size)
+    return file_sizes
+
 def _add_to_knowncases(case_metadata, known_cases):
     case_id = case_metadata['case_id']
     if case_id not in known_cases:
@@ -249,24 +384,7 @@ def _add_to_knownpairs(tumor_sample_id, normal_sample_id, known_pairs):
     return pair_id
 
 def _constructAttributeName_base(experimental_strategy, workflow_type, data_category, data_type, data_format):
-
-    if experimental_strategy is not None:
-        experimental_strategy_abbrev = EXP_STRATEGY.getAbbreviation(experimental_strategy) + '__'
-    else:
-        experimental_strategy_abbrev = ''
-
-    if workflow_type is not None:
-        workflow_type_abbrev = WORKFLOW.getAbbreviation(workflow_type) + '__'
-    else:
-        workflow_type_abbrev = ''
-
-    data_type_lc = data_type.lower().replace(" ", "_") + '__'
-    
-    data_format_lc = data_format.lower().replace(" ", "_") + '__'
-
-    attribute_name_base = experimental_strategy_abbrev + workflow_type_abbrev + data_type_lc + data_format_lc
-
-    return (attribute_name_base)
+    return ATTRIBUTE_SCHEMA.attribute(experimental_strategy, workflow_type, data_type, data_format).basename
 
 def _getImageCodeAndPortionFromImageFilename(filename):
     image_code = filename.split('.')[0].split('-')[-1]
@@ -274,28 +392,11 @@ def _getImageCodeAndPortionFromImageFilename(filename):
     return image_code, portion
 
 def _constructImageAttributeName_base(experimental_strategy, workflow_type, data_category, data_type, data_format, filename=None):
-
-    if experimental_strategy is not None:
-        experimental_strategy_abbrev = EXP_STRATEGY.getAbbreviation(experimental_strategy) + '__'
-    else:
-        experimental_strategy_abbrev = ''
-
-    if workflow_type is not None:
-        workflow_type_abbrev = WORKFLOW.getAbbreviation(workflow_type) + '__'
-    else:
-        workflow_type_abbrev = ''
-
-    data_type_lc = data_type.lower().replace(" ", "_") + '__' 
-    data_format_lc = data_format.lower().replace(" ", "_") + '__'
-    
     # see https://wiki.nci.nih.gov/display/TCGA/TCGA+barcode# for interpretation of TCGA bar code
     # that is incorporated into image filename
     image_code, portion = _getImageCodeAndPortionFromImageFilename(filename)
-    image_code_lc = image_code.lower() + '__'
-
-    attribute_name_base = experimental_strategy_abbrev + workflow_type_abbrev + image_code_lc + data_type_lc
-
-    return attribute_name_base, portion
+    attribute = ATTRIBUTE_SCHEMA.attribute(experimental_strategy, workflow_type, data_type, data_format, image_code)
+    return attribute.basename, portion
 
 def _pick_tcga_submitter(a, b):
     '''Comparator function for barcodes, using the rules described in the GDAC                                                     
@@ -461,7 +562,18 @@ def _pick_target_aliquot_pair(aliquot_pair_1, aliquot_pair_2):
         print("WARNING: aliquot ids are identical, unable to make rational choice")
         return aliquot_pair_1
 
-def _resolve_collision(gdc_api_root, data_category, data_type, program, uuid1, name1, uuid2, name2):
+# fields _resolve_collision retrieves to choose between replicates of a file with a tumor/normal pair of samples,
+# and of a file with a single sample
+PAIRED_ALIQUOT_FIELDS = "cases.samples.sample_type,cases.samples.portions.analytes.aliquots.submitter_id,cases.samples.sample_type_id"
+ALIQUOT_FIELDS = "cases.project.program.name,cases.samples.portions.analytes.aliquots.submitter_id"
+
+def _is_paired_data(data_category, data_type):
+    """True if files of this category and type are associated with a tumor and a normal sample."""
+    return ((data_category in GDC_DataCategory.SNV and
+             data_type not in set([GDC_DataType.AGGREGATED_SOMATIC_MUTATION, GDC_DataType.MASKED_SOMATIC_MUTATION])) or
+            (data_category in GDC_DataCategory.COMBINED_NUCLEOTIDE_VARIATION))
+
+def _resolve_collision(gdc_api_root, data_category, data_type, program, uuid1, name1, uuid2, name2, cache=None):
 
     # NOTE: we chose not to employ the created_datetime or updated_datetime fields in 
     # our decision logic.  From what we can tell, neither should be used to make a selection between 
@@ -510,12 +622,9 @@ def _resolve_collision(gdc_api_root, data_category, data_type, program, uuid1, n
     normal_aliquot_submitter_id2 = None
 
     # SNV and Combined Nucleotide Variation (TARGET only) files are associated with two samples: tumor and normal. 
-    if ((data_category in GDC_DataCategory.SNV and 
-         data_type not in set([GDC_DataType.AGGREGATED_SOMATIC_MUTATION, GDC_DataType.MASKED_SOMATIC_MUTATION])) or
-        (data_category in GDC_DataCategory.COMBINED_NUCLEOTIDE_VARIATION)):
+    if _is_paired_data(data_category, data_type):
 
-        file_fields = "cases.samples.sample_type,cases.samples.portions.analytes.aliquots.submitter_id,cases.samples.sample_type_id"
-        meta_retriever = MetadataRetriever(gdc_api_root, file_fields)
+        meta_retriever = MetadataRetriever(gdc_api_root, PAIRED_ALIQUOT_FIELDS, cache)
 
         data1 = meta_retriever.get_metadata(uuid1)
         samples_list1 = data1['cases'][0]['samples']
@@ -561,8 +670,7 @@ def _resolve_collision(gdc_api_root, data_category, data_type, program, uuid1, n
 
     # Here we handle other file types that are associated with single sample.
     else:
-        file_fields = "cases.project.program.name,cases.samples.portions.analytes.aliquots.submitter_id"
-        meta_retriever = MetadataRetriever(gdc_api_root, file_fields)
+        meta_retriever = MetadataRetriever(gdc_api_root, ALIQUOT_FIELDS, cache)
 
         data1 = meta_retriever.get_metadata(uuid1)
         data2 = meta_retriever.get_metadata(uuid2)
@@ -596,13 +704,14 @@ def _resolve_collision(gdc_api_root, data_category, data_type, program, uuid1, n
 
 
 def _add_file_attribute(gdc_api_root, entity_id, entity, file_uuid, filename, file_url,
-                        data_category, data_type, data_format, experimental_strategy, workflow_type, access, program):
+                        data_category, data_type, data_format, experimental_strategy, workflow_type, access, program,
+                        cache=None):
     # I needed to insert some special-case processing for image data files
     # this probably isn't the cleanest way to handle it, but good enough for now
     if data_type in set([GDC_DataType.SLIDE_IMAGE]):
-        basename, portion = _constructImageAttributeName_base(experimental_strategy, workflow_type,
-                                                              data_category, data_type, data_format, filename)
-        attribute_name = basename + UUID_ATTRIBUTE_SUFFIX
+        image_code, portion = _getImageCodeAndPortionFromImageFilename(filename)
+        attribute = ATTRIBUTE_SCHEMA.attribute(experimental_strategy, workflow_type, data_type, data_format, image_code)
+        attribute_name = attribute.uuid_name
 
         if attribute_name in entity:
             existing_file = entity[attribute_name]
@@ -614,24 +723,24 @@ def _add_file_attribute(gdc_api_root, entity_id, entity, file_uuid, filename, fi
             print("new file: {0}/{1}".format(file_uuid, filename))
             print("existing file: {0}".format(entity[attribute_name]))
 
+            RUN_STATS.record_collision(attribute_name)
             filename_present = entity[attribute_name]
             _, portion_present = _getImageCodeAndPortionFromImageFilename(filename_present)
             if portion > portion_present:
                 print("newer file has larger portion ID; use newer file")
-                entity[basename + UUID_ATTRIBUTE_SUFFIX] = file_uuid + SEPARATOR + filename
-                entity[basename + URL_ATTRIBUTE_SUFFIX] = file_url            
+                entity[attribute.uuid_name] = file_uuid + SEPARATOR + filename
+                entity[attribute.url_name] = file_url            
             elif portion < portion_present:
                 print("newer file has smaller portion ID; retain existing file")
             else:
                 print("Both files have samer portion ID: retain existing file")
 
         else:
-            entity[basename + UUID_ATTRIBUTE_SUFFIX] = file_uuid + SEPARATOR + filename
-            entity[basename + URL_ATTRIBUTE_SUFFIX] = file_url            
+            entity[attribute.uuid_name] = file_uuid + SEPARATOR + filename
+            entity[attribute.url_name] = file_url            
     else:
-        basename = _constructAttributeName_base(experimental_strategy, workflow_type,
-                                                data_category, data_type, data_format)
-        attribute_name = basename + UUID_ATTRIBUTE_SUFFIX
+        attribute = ATTRIBUTE_SCHEMA.attribute(experimental_strategy, workflow_type, data_type, data_format)
+        attribute_name = attribute.uuid_name
         
         # see if attribute already defined for entity
         if attribute_name in entity:
@@ -644,39 +753,30 @@ def _add_file_attribute(gdc_api_root, entity_id, entity, file_uuid, filename, fi
             print("new file: {0}/{1}".format(file_uuid, filename))
             print("existing file: {0}".format(entity[attribute_name]))
             
-            chosen_uuid, chosen_filename = _resolve_collision(gdc_api_root, data_category, data_type, program,
-                                                              file_uuid, filename, existing_uuid, existing_filename)
+            RUN_STATS.record_collision(attribute_name)
+            with RUN_STATS.phase('collision_resolution'):
+                chosen_uuid, chosen_filename = _resolve_collision(gdc_api_root, data_category, data_type, program,
+                                                                  file_uuid, filename, existing_uuid, existing_filename, cache)
             print("chosen file is: {0}/{1}".format(chosen_uuid, chosen_filename))
 
             if chosen_uuid == file_uuid:
-                entity[basename + UUID_ATTRIBUTE_SUFFIX] = file_uuid + SEPARATOR + filename
-                entity[basename + URL_ATTRIBUTE_SUFFIX] = file_url
+                entity[attribute.uuid_name] = file_uuid + SEPARATOR + filename
+                entity[attribute.url_name] = file_url
             else:
                 return
         else:
-            entity[basename + UUID_ATTRIBUTE_SUFFIX] = file_uuid + SEPARATOR + filename
-            entity[basename + URL_ATTRIBUTE_SUFFIX] = file_url
+            entity[attribute.uuid_name] = file_uuid + SEPARATOR + filename
+            entity[attribute.url_name] = file_url
+
+def _file_properties(responseDict):
+    """Return (data_category, data_type, data_format, access, program, experimental_strategy, workflow_type)
+    from a FileMetadataRetriever response; raises KeyError if one of the first five is missing."""
+    data_category = responseDict['data_category']
+    data_type = responseDict['data_type']
+    data_format = responseDict['data_format']
+    access = responseDict['access']
+    program = responseDict['cases'][0]['project']['program']['name']
 
-def get_file_metadata(gdc_api_root, file_uuid, filename, file_url, known_cases, known_samples, known_pairs, deferred_file_uuids):
-    
-    # get from GDC the data file's category, type, access type, format, experimental strategy,
-    # analysis workflow type
-    fileMetadataRetriever = FileMetadataRetriever(gdc_api_root)
-    responseDict = fileMetadataRetriever.get_metadata(file_uuid)
-    
-    try:
-        data_category = responseDict['data_category']
-        data_type = responseDict['data_type']
-        data_format = responseDict['data_format']
-        access = responseDict['access']
-        program = responseDict['cases'][0]['project']['program']['name']
-    except KeyError as x:
-        # we expect all files to have at least a data_category, data_type, access type and program assigned to them
-        print("KeyError = ", x)
-        print("SKIPPING FILE: file uuid = {0}, file name = {1}".format(file_uuid, filename))
-        return
-    
-          
     if 'experimental_strategy' in responseDict:
         experimental_strategy = responseDict['experimental_strategy']
     else: 
@@ -685,17 +785,56 @@ def get_file_metadata(gdc_api_root, file_uuid, filename, file_url, known_cases,
         workflow_type = responseDict['analysis']['workflow_type']
     else:
         workflow_type = None
-    
+    return data_category, data_type, data_format, access, program, experimental_strategy, workflow_type
+
+def fetch_file_metadata(gdc_api_root, file_uuid, deferred=False):
+    """Retrieve a file's properties and the cases (and samples) it is associated with.
+
+    Returns the two responses; the second is None if the file lacks one of the
+    properties we require.  With deferred=True the cases are retrieved the way
+    files associated with multiple cases need them.
+    """
+    # get from GDC the data file's category, type, access type, format, experimental strategy,
+    # analysis workflow type
+    fileMetadataRetriever = FileMetadataRetriever(gdc_api_root)
+    responseDict = fileMetadataRetriever.get_metadata(file_uuid)
+
+    try:
+        data_category, data_type = _file_properties(responseDict)[0:2]
+    except KeyError:
+        return responseDict, None
 
     if data_category in set([GDC_DataCategory.CLINICAL, GDC_DataCategory.BIOSPECIMEN]): 
-        if data_type == GDC_DataType.SLIDE_IMAGE:
+        if data_type == GDC_DataType.SLIDE_IMAGE and not deferred:
             metadataRetriever = CaseSampleMetadataRetriever(gdc_api_root)            
         else:
             metadataRetriever = CaseMetadataRetriever(gdc_api_root)
     else:
         metadataRetriever = CaseSampleMetadataRetriever(gdc_api_root)
 
-    metadata = metadataRetriever.get_metadata(file_uuid)
+    return responseDict, metadataRetriever.get_metadata(file_uuid)
+
+def is_multi_case_file(metadata):
+    """True if the file (given its case metadata) is associated with several cases, and so is deferred."""
+    return metadata is not None and len(metadata['cases']) > 1
+
+def get_file_metadata(gdc_api_root, file_uuid, filename, file_url, known_cases, known_samples, known_pairs, deferred_file_uuids):
+    responseDict, metadata = fetch_file_metadata(gdc_api_root, file_uuid)
+    add_file_to_model(gdc_api_root, file_uuid, filename, file_url, responseDict, metadata,
+                      known_cases, known_samples, known_pairs, deferred_file_uuids)
+
+def add_file_to_model(gdc_api_root, file_uuid, filename, file_url, responseDict, metadata,
+                      known_cases, known_samples, known_pairs, deferred_file_uuids):
+    """Attach a file (given its fetch_file_metadata responses) to the entities it belongs to,
+    or record it in deferred_file_uuids if it is associated with multiple cases."""
+    try:
+        (data_category, data_type, data_format, access, program,
+         experimental_strategy, workflow_type) = _file_properties(responseDict)
+    except KeyError as x:
+        # we expect all files to have at least a data_category, data_type, access type and program assigned to them
+        print("KeyError = ", x)
+        print("SKIPPING FILE: file uuid = {0}, file name = {1}".format(file_uuid, filename))
+        return
 
     cases = metadata['cases']
     num_associated_cases = len(cases)
@@ -752,16 +891,15 @@ def get_file_metadata(gdc_api_root, file_uuid, filename, file_url, known_cases,
 # case a file is associated with.
 
 def process_deferred_file_uuid(gdc_api_root, file_uuid, filename, file_url, known_cases, known_samples, all_cases):
-    
-    # get data file's name, category, type, access, format experimental strategy, workflow type
-    fileMetadataRetriever = FileMetadataRetriever(gdc_api_root)
-    responseDict = fileMetadataRetriever.get_metadata(file_uuid)
+    responseDict, metadata = fetch_file_metadata(gdc_api_root, file_uuid, deferred=True)
+    add_deferred_file_to_model(gdc_api_root, file_uuid, filename, file_url, responseDict, metadata,
+                               known_cases, known_samples, all_cases)
 
-    data_category = responseDict['data_category']
-    data_type = responseDict['data_type']
-    data_format = responseDict['data_format']
-    access = responseDict['access']
-    program = responseDict['cases'][0]['project']['program']['name']
+def add_deferred_file_to_model(gdc_api_root, file_uuid, filename, file_url, responseDict, metadata,
+                               known_cases, known_samples, all_cases):
+    """Attach a file associated with multiple cases (given its fetch_file_metadata(deferred=True) responses)."""
+    (data_category, data_type, data_format, access, program,
+     experimental_strategy, workflow_type) = _file_properties(responseDict)
 
     # I have decided to ignore (i.e., not incorporate into workspace) Clinical and Biospecimen files of data 
     # format "BCR Biotab"; these files are typically associated with multple cases, and there can be
@@ -777,22 +915,6 @@ def process_deferred_file_uuid(gdc_api_root, file_uuid, filename, file_url, know
             print('skipping {0} file {1}'.format(data_format, file_uuid))
             return
 
-    if 'experimental_strategy' in responseDict:
-        experimental_strategy = responseDict['experimental_strategy']
-    else: 
-        experimental_strategy = None
-    if 'analysis' in responseDict and 'workflow_type' in responseDict['analysis']:
-        workflow_type = responseDict['analysis']['workflow_type']
-    else:
-        workflow_type = None
-        
-    if data_category == GDC_DataCategory.CLINICAL or data_category == GDC_DataCategory.BIOSPECIMEN:
-        metadataRetriever = CaseMetadataRetriever(gdc_api_root)
-    else:
-        metadataRetriever = CaseSampleMetadataRetriever(gdc_api_root)
-
-    metadata = metadataRetriever.get_metadata(file_uuid)
-
     cases = metadata['cases']
     num_associated_cases = len(cases)
     assert num_associated_cases > 1, file_uuid
@@ -815,34 +937,89 @@ def process_deferred_file_uuid(gdc_api_root, file_uuid, filename, file_url, know
                                     data_category, data_type, data_format,experimental_strategy, workflow_type, access, program)
 
 
-def create_participants_file(cases, manifestFileBasename):
+def table_assembly_rules():
+    """The table_assembly.ModelRules of the file-by-file assembly above, with its state."""
+    cache = MetadataRetriever.cache
+    if cache is None:
+        # the engine prefetches the aliquot metadata of replicates into a cache for _resolve_collision;
+        # without a --metadata_cache, one of this run's own
+        cache = gdc_metadatacache.MetadataCache(':memory:')
+    return table_assembly.ModelRules(
+        schema=ATTRIBUTE_SCHEMA, deferred_num_of_cases=DEFERRED_FILE_NUM_OF_CASES, cache=cache,
+        sample_type=SAMPLE_TYPE, data_category=GDC_DataCategory, data_type=GDC_DataType,
+        aliquot_fields=ALIQUOT_FIELDS, paired_aliquot_fields=PAIRED_ALIQUOT_FIELDS, separator=SEPARATOR,
+        is_paired_data=_is_paired_data, image_code_and_portion=_getImageCodeAndPortionFromImageFilename,
+        add_to_known_cases=_add_to_knowncases, add_to_known_pairs=_add_to_knownpairs,
+        add_file_attribute=functools.partial(_add_file_attribute, cache=cache))
+
+
+def resolve_file_urls(uuid_resolver, entity_stores, unknownResponse="__DELETE__"):
+    """Fill in the URL attributes of the files in the finished entity model.
+
+    The files are assembled with a file url of None; once replicate selection
+    and skipping are done, the URLs of only the files that remain are looked
+    up, with one batched lookup.  Without a uuid_resolver, the URLs are set to
+    unknownResponse.  Returns the number of files.
+    """
+    file_uuids = set()
+    for store in entity_stores:
+        for _, entity in store.items():
+            for attribute_name, value in entity.items():
+                if ATTRIBUTE_SCHEMA.file_attribute(attribute_name) is not None:
+                    file_uuids.add(value.split(SEPARATOR, 1)[0])
+    if uuid_resolver is not None:
+        urls = uuid_resolver.getURLs(sorted(file_uuids))
+    else:
+        urls = dict.fromkeys(file_uuids, unknownResponse)
+
+    for store in entity_stores:
+        # entities looked up from an EntityStore are changed in place, as while assembling the model
+        for entity_id in list(store):
+            entity = store[entity_id]
+            for attribute in [ATTRIBUTE_SCHEMA.file_attribute(name) for name in entity]:
+                if attribute is not None:
+                    entity[attribute.url_name] = urls[entity[attribute.uuid_name].split(SEPARATOR, 1)[0]]
+    return len(file_uuids)
+
+
+def _write_download_batches(membership_writer, set_field, member_field, members, file_sizes, batch_bytes):
+    """Write the size-balanced download batch sets (see download_batches) of the entities of each file attribute.
+
+    members maps each FileAttribute to the (entity id, file uuid) pairs of its entities.
+    """
+    for attribute, entity_files in members.items():
+        # files of equal size go to batches by entity id, not by the order the entities were built in
+        entity_files = sorted(entity_files)
+        sizes = [file_sizes.get(file_uuid) for _, file_uuid in entity_files]
+        for k, batch in enumerate(download_batches.balanced_batches(sizes, batch_bytes), 1):
+            set_id = download_batches.batch_set_name(attribute.set_name, k)
+            for i in batch:
+                membership_writer.writerow({set_field: set_id, member_field: entity_files[i][0]})
+
+def create_participants_file(cases, manifestFileBasename, chunk_size=None, compress=False, file_sizes=None, batch_bytes=None):
     
-    attribute_names = []
-    for case_id, case in cases.items():
-        for attribute_name in case:
-            if attribute_name not in attribute_names:
-                attribute_names.append(attribute_name)
+    attribute_names = ATTRIBUTE_SCHEMA.column_order(cases.values())
+    columns = [(attribute_name, ATTRIBUTE_SCHEMA.file_attribute(attribute_name)) for attribute_name in attribute_names]
     
-    participants_filename = manifestFileBasename + '_participants.txt'
-    participant_sets_membership_filename = manifestFileBasename + '_participant_sets_membership.txt'
+    participants_basename = manifestFileBasename + '_participants'
+    participant_sets_membership_basename = manifestFileBasename + '_participant_sets_membership'
     
-    with open(participants_filename, 'w') as participantsFile, open(participant_sets_membership_filename, 'w') as membershipFile:
-        fieldnames = ['entity:participant_id'] + attribute_names
-        participants_writer = csv.DictWriter(participantsFile, fieldnames=fieldnames, delimiter='\t')
-        participants_writer.writeheader()
-
-        fieldnames = ['membership:participant_set_id', 'participant_id']
-        membership_writer = csv.DictWriter(membershipFile, fieldnames=fieldnames, delimiter='\t')
-        membership_writer.writeheader()
+    fieldnames = ['entity:participant_id'] + attribute_names
+    membership_fieldnames = ['membership:participant_set_id', 'participant_id']
+    with loadfile_io.ChunkedTsvWriter(participants_basename, fieldnames, chunk_size, compress) as participants_writer, \
+         loadfile_io.ChunkedTsvWriter(participant_sets_membership_basename, membership_fieldnames, chunk_size, compress,
+                                      keep_together='membership:participant_set_id') as membership_writer:
         
+        members = dict()
         for case_id, case in cases.items():
             entity_row = {'entity:participant_id': case_id}
-            for attribute_name in attribute_names:
+            for attribute_name, attribute in columns:
                 if attribute_name in case:
                     entity_row[attribute_name] = case[attribute_name]
-                    if attribute_name.endswith(UUID_ATTRIBUTE_SUFFIX):
-                        basename = attribute_name[0:-(len(UUID_ATTRIBUTE_SUFFIX)+2)]
-                        membership_row = {'membership:participant_set_id' : basename,
+                    if attribute is not None:
+                        if batch_bytes is not None:
+                            members.setdefault(attribute, []).append((case_id, case[attribute_name].split(SEPARATOR, 1)[0]))
+                        membership_row = {'membership:participant_set_id' : attribute.set_name,
                                           'participant_id' : case_id}
                         membership_writer.writerow(membership_row)
                 else:
@@ -854,35 +1031,34 @@ def create_participants_file(cases, manifestFileBasename):
                               'participant_id' : case_id}
             membership_writer.writerow(membership_row)            
 
-def create_samples_file(samples, manifestFileBasename):
-    attribute_names = []
-    for sample_id, sample in samples.items():
-        for attribute_name in sample:
-            if attribute_name not in {'submitter_id', 'case_id', 'sample_type_id'} and attribute_name not in attribute_names:
-                attribute_names.append(attribute_name)
-
-    samples_filename = manifestFileBasename + '_samples.txt'
-    sample_sets_membership_filename = manifestFileBasename + '_sample_sets_membership.txt'
-    with open(samples_filename, 'w') as samplesFile, open(sample_sets_membership_filename, 'w') as membershipFile:
-        
-        fieldnames = ['entity:sample_id', 'participant_id', 'submitter_id', 'sample_type'] + attribute_names
-        sample_writer = csv.DictWriter(samplesFile, fieldnames=fieldnames, delimiter='\t')
-        sample_writer.writeheader()
-
-        fieldnames = ['membership:sample_set_id', 'sample_id']
-        membership_writer = csv.DictWriter(membershipFile, fieldnames=fieldnames, delimiter='\t')
-        membership_writer.writeheader()
+        if batch_bytes is not None:
+            _write_download_batches(membership_writer, 'membership:participant_set_id', 'participant_id',
+                                    members, file_sizes, batch_bytes)
+
+def create_samples_file(samples, manifestFileBasename, chunk_size=None, compress=False, file_sizes=None, batch_bytes=None):
+    attribute_names = ATTRIBUTE_SCHEMA.column_order(samples.values(), excluded=['submitter_id', 'case_id', 'sample_type_id'])
+    columns = [(attribute_name, ATTRIBUTE_SCHEMA.file_attribute(attribute_name)) for attribute_name in attribute_names]
+
+    samples_basename = manifestFileBasename + '_samples'
+    sample_sets_membership_basename = manifestFileBasename + '_sample_sets_membership'
+    fieldnames = ['entity:sample_id', 'participant_id', 'submitter_id', 'sample_type'] + attribute_names
+    membership_fieldnames = ['membership:sample_set_id', 'sample_id']
+    with loadfile_io.ChunkedTsvWriter(samples_basename, fieldnames, chunk_size, compress) as sample_writer, \
+         loadfile_io.ChunkedTsvWriter(sample_sets_membership_basename, membership_fieldnames, chunk_size, compress,
+                                      keep_together='membership:sample_set_id') as membership_writer:
         
+        members = dict()
         for sample_id, sample in samples.items():
             entity_row = {'entity:sample_id' : sample_id, 'participant_id': sample['case_id'],
                           'submitter_id' : sample['submitter_id'],
                           'sample_type' : SAMPLE_TYPE.getLetterCode(sample['sample_type_id']) if sample['sample_type_id'] is not None else '__DELETE__'}
-            for attribute_name in attribute_names:
+            for attribute_name, attribute in columns:
                 if attribute_name in sample:
                     entity_row[attribute_name] = sample[attribute_name]
-                    if attribute_name.endswith(UUID_ATTRIBUTE_SUFFIX):
-                        basename = attribute_name[0:-(len(UUID_ATTRIBUTE_SUFFIX)+2)]
-                        membership_row = {'membership:sample_set_id' : basename,
+                    if attribute is not None:
+                        if batch_bytes is not None:
+                            members.setdefault(attribute, []).append((sample_id, sample[attribute_name].split(SEPARATOR, 1)[0]))
+                        membership_row = {'membership:sample_set_id' : attribute.set_name,
                                           'sample_id' : sample_id}
                         membership_writer.writerow(membership_row)
                 else:
@@ -892,27 +1068,26 @@ def create_samples_file(samples, manifestFileBasename):
             membership_row = {'membership:sample_set_id' : 'ALL',
                               'sample_id': sample_id}
             membership_writer.writerow(membership_row)
+
+        if batch_bytes is not None:
+            _write_download_batches(membership_writer, 'membership:sample_set_id', 'sample_id',
+                                    members, file_sizes, batch_bytes)
                         
-def create_pairs_file(pairs, samples, manifestFileBasename):
-    attribute_names = []
-    for pair_id, pair in pairs.items():
-        for attribute_name in pair:
-            if attribute_name not in {'tumor', 'normal'} and attribute_name not in attribute_names:
-                attribute_names.append(attribute_name)
-
-    pairs_filename = manifestFileBasename + '_pairs.txt'
-    pair_sets_membership_filename = manifestFileBasename + '_pair_sets_membership.txt'
-    with open(pairs_filename, 'w') as pairsFile, open(pair_sets_membership_filename, 'w') as membershipFile:
-        fieldnames = ['entity:pair_id', 'participant_id', 'case_sample_id', 'control_sample_id',
-                    'tumor_submitter_id', 'normal_submitter_id',
-                    'tumor_type', 'normal_type'] + attribute_names
-        pairs_writer = csv.DictWriter(pairsFile, fieldnames=fieldnames, delimiter='\t')
-        pairs_writer.writeheader()
-
-        fieldnames = ['membership:pair_set_id', 'pair_id']
-        membership_writer = csv.DictWriter(membershipFile, fieldnames=fieldnames, delimiter='\t')
-        membership_writer.writeheader()
+def create_pairs_file(pairs, samples, manifestFileBasename, chunk_size=None, compress=False, file_sizes=None, batch_bytes=None):
+    attribute_names = ATTRIBUTE_SCHEMA.column_order(pairs.values(), excluded=['tumor', 'normal'])
+    columns = [(attribute_name, ATTRIBUTE_SCHEMA.file_attribute(attribute_name)) for attribute_name in attribute_names]
+
+    pairs_basename = manifestFileBasename + '_pairs'
+    pair_sets_membership_basename = manifestFileBasename + '_pair_sets_membership'
+    fieldnames = ['entity:pair_id', 'participant_id', 'case_sample_id', 'control_sample_id',
+                'tumor_submitter_id', 'normal_submitter_id',
+                'tumor_type', 'normal_type'] + attribute_names
+    membership_fieldnames = ['membership:pair_set_id', 'pair_id']
+    with loadfile_io.ChunkedTsvWriter(pairs_basename, fieldnames, chunk_size, compress) as pairs_writer, \
+         loadfile_io.ChunkedTsvWriter(pair_sets_membership_basename, membership_fieldnames, chunk_size, compress,
+                                      keep_together='membership:pair_set_id') as membership_writer:
         
+        members = dict()
         for pair_id, pair in pairs.items():
 
             tumor_submitter_id = samples[pair['tumor']]['submitter_id']
@@ -925,12 +1100,13 @@ def create_pairs_file(pairs, samples, manifestFileBasename):
                           'normal_submitter_id' : normal_submitter_id,
                           'tumor_type' : SAMPLE_TYPE.getLetterCode(samples[pair['tumor']]['sample_type_id']),
                           'normal_type' : SAMPLE_TYPE.getLetterCode(samples[pair['normal']]['sample_type_id'])}
-            for attribute_name in attribute_names:
+            for attribute_name, attribute in columns:
                 if attribute_name in pair:
                     entity_row[attribute_name] = pair[attribute_name]
-                    if attribute_name.endswith(UUID_ATTRIBUTE_SUFFIX):
-                        basename = attribute_name[0:-(len(UUID_ATTRIBUTE_SUFFIX)+2)]
-                        membership_row = {'membership:pair_set_id' : basename,
+                    if attribute is not None:
+                        if batch_bytes is not None:
+                            members.setdefault(attribute, []).append((pair_id, pair[attribute_name].split(SEPARATOR, 1)[0]))
+                        membership_row = {'membership:pair_set_id' : attribute.set_name,
                                           'pair_id': pair_id}
                         membership_writer.writerow(membership_row)
                 else:
@@ -941,6 +1117,10 @@ def create_pairs_file(pairs, samples, manifestFileBasename):
                    'pair_id': pair_id}
             membership_writer.writerow(row)
 
+        if batch_bytes is not None:
+            _write_download_batches(membership_writer, 'membership:pair_set_id', 'pair_id',
+                                    members, file_sizes, batch_bytes)
+
 
 def create_workspace_attributes_file(manifestFileBasename, is_legacy):
     #This part is hardcoded due to the small number of attributes we need to specify.
@@ -955,94 +1135,348 @@ def create_workspace_attributes_file(manifestFileBasename, is_legacy):
         workspaceColumnOrderFile.write("workspace:legacy_flag\tworkspace-column-defaults\n")
         workspaceColumnOrderFile.write(legacy_flag + "\t" + "{\"participant\": {\"shown\": [\"submitter_id\", \"project_id\", \"participant_id\"]}, \"sample\":{\"shown\":[\"submitter_id\", \"sample_id\", \"participant\", \"sample_type\"]}, \"pair\":{\"shown\":[\"tumor_submitter_id\", \"normal_submitter_id\", \"pair_id\"]}}")
 
-def main():
+def main(argv=None, uuid_resolver=None):
+    """Run genFcWsLoadFiles with the command line arguments argv (default: sys.argv[1:]).
+
+    uuid_resolver, if given, is a prebuilt gdc_uuidresolver.UuidResolver used
+    instead of building one from --resolve_uuids (see loadfile_service).
+    """
     parser = argparse.ArgumentParser(description='create FireCloud workspace load files from GDC manifest')
-    parser.add_argument("manifest", help="manifest file from the GDC Data Portal")
+    parser.add_argument("manifest", help="manifest files from the GDC Data Portal, or glob patterns matching them; they are processed as one, and a file listed more than once is processed once",
+                        nargs="+")
     parser.add_argument("-r", "--resolve_uuids", help="TSV file mapping GDC UUIDs to URLs")
     parser.add_argument("-c", "--all_cases", help="create participant entities for all referenced cases", action="store_true")
-    args = parser.parse_args()
+    parser.add_argument("-m", "--metadata_cache", help="SQLite file caching GDC metadata responses; may be shared between runs")
+    parser.add_argument("-k", "--chunk_size", help="split each load file into chunks of at most this many rows", type=int)
+    parser.add_argument("-z", "--gzip", help="gzip-compress the entity and membership load files", action="store_true")
+    parser.add_argument("-s", "--stats", help="write run performance statistics (JSON) to this file")
+    parser.add_argument("-o", "--output", help="basename of the load files (default: the first manifest's basename)")
+    parser.add_argument("-p", "--profile", help="profile the main phases; one profile artifact is written per phase", choices=phase_profiler.MODES)
+    parser.add_argument("--profile_prefix", help="path prefix of the profile artifacts (default: <manifest basename>_profile)")
+    parser.add_argument("--gdc_api_root", help="root URL of the GDC API (e.g., a local mock server for benchmarking)", default=GDC_API_ROOT)
+    cassette_group = parser.add_mutually_exclusive_group()
+    cassette_group.add_argument("--record", help="save every GDC metadata response to this archive, for --replay", metavar="ARCHIVE")
+    cassette_group.add_argument("--replay", help="serve GDC metadata responses from an archive written by --record, without network access",
+                                metavar="ARCHIVE")
+    parser.add_argument("--case_centric", help="retrieve the metadata of all files, and of their distinct cases, with bulk queries up front instead of per-file requests (without the metadata cache)", action="store_true")
+    parser.add_argument("--assembly", help="how the entity model is assembled: file by file, or a column at a time from a table of all files (requires --case_centric)",
+                        choices=['files', 'table'], default='files')
+    parser.add_argument("--pipeline", help="process the manifest as a staged pipeline, fetching metadata concurrently", action="store_true")
+    parser.add_argument("--fetch_workers", help="concurrent metadata fetchers in --pipeline mode", type=int, default=4)
+    parser.add_argument("--queue_size", help="capacity of each queue between --pipeline stages", type=int, default=1000)
+    parser.add_argument("--shard", help="process only partition k of N of the manifest (files of one case share a partition) and write its partial state for mergeFcWsLoadFiles", metavar="k/N")
+    parser.add_argument("--spill_mb", help="move the entity model to a disk-backed store once the resident set size exceeds this many MB", type=float)
+    parser.add_argument("--spill_dir", help="directory for the disk-backed entity store (default: the system temporary directory)")
+    parser.add_argument("--adaptive_timeout", help="derive GDC request timeouts from the observed latencies instead of a fixed 5 seconds", action="store_true")
+    parser.add_argument("--hedge", help="duplicate GDC requests outstanding longer than the observed p95 latency, using the first response (implies --adaptive_timeout)", action="store_true")
+    parser.add_argument("--hedge_budget", help="the most duplicate requests --hedge may issue, as a fraction of all requests", type=float, default=0.05)
+    parser.add_argument("--auto_tune", help="adjust the GDC requests in flight (up to --max_concurrency) and the bulk query batch size to the observed latency, errors and throttling", action="store_true")
+    parser.add_argument("--max_concurrency", help="the most GDC requests --auto_tune lets be in flight", type=int, default=16)
+    parser.add_argument("--plan", help="report the GDC requests, metadata cache hit rate, resolver coverage and runtime to expect, without retrieving metadata or writing load files", action="store_true")
+    parser.add_argument("--plan_history", help="--stats file of an earlier run, from which --plan estimates what depends on metadata not yet retrieved, and the runtime (may be repeated)",
+                        action="append", metavar="STATS", default=[])
+    parser.add_argument("-q", "--quiet", help="do not print a line per processed file", action="store_true")
+    parser.add_argument("--metrics_file", help="periodically write progress metrics in Prometheus text format to this file (e.g., for a node exporter textfile collector)")
+    parser.add_argument("--metrics_interval", help="seconds between metrics file updates", type=float, default=15)
+    parser.add_argument("--download_batch_gb", help="also split the entities of each file attribute into membership sets <set>__batchNNN of about this many GB of files each (from the manifest's size column), for downloading in balanced batches",
+                        type=float)
+    parser.add_argument("--columnar_dir", help="also export the entity model as columnar tables to this directory (requires pyarrow)")
+    parser.add_argument("--columnar_format", help="format of the columnar tables", choices=['arrow', 'parquet'], default='arrow')
+    args = parser.parse_args(argv)
+    if args.chunk_size is not None and args.chunk_size < 1:
+        parser.error("--chunk_size must be at least 1")
 
-    print("manifestFile = {0}".format(args.manifest))
+    try:
+        manifestFiles = _expand_manifests(args.manifest)
+    except ValueError as x:
+        parser.error(str(x))
+    for manifestFile in manifestFiles:
+        print("manifestFile = {0}".format(manifestFile))
     print("resolverTsvFile = {0}".format(args.resolve_uuids))
 
-    manifestFile = args.manifest
-    uuidResolver = None
-    if args.resolve_uuids is not None:
-        uuidResolver = gdc_uuidresolver.UuidResolver(args.resolve_uuids, '__DELETE__')
+    manifestFileBasename = args.output
+    if manifestFileBasename is None:
+        manifestFileBasename = os.path.splitext(os.path.basename(manifestFiles[0]))[0]
+    uuidResolver = uuid_resolver
+    if uuidResolver is None and args.resolve_uuids is not None and not args.plan:
+        with RUN_STATS.phase('resolver_build'):
+            uuidResolver = gdc_uuidresolver.UuidResolver(args.resolve_uuids, '__DELETE__')
+    if args.columnar_dir is not None:
+        # optional dependency; imported up front so a missing pyarrow fails before any work is done
+        from fcgdctools import columnar_export
+        if columnar_export.pyarrow is None:
+            parser.error("--columnar_dir requires the pyarrow package")
+    if args.profile is not None:
+        profile_prefix = args.profile_prefix
+        if profile_prefix is None:
+            profile_prefix = manifestFileBasename + "_profile"
+        RUN_STATS.profiler = phase_profiler.PhaseProfiler(args.profile, profile_prefix, PROFILED_PHASES)
+    if args.case_centric and (args.record is not None or args.replay is not None):
+        parser.error("--case_centric cannot be combined with --record or --replay")
+    if args.assembly == 'table' and (not args.case_centric or args.pipeline):
+        parser.error("--assembly table requires --case_centric, and cannot be combined with --pipeline")
+    if args.download_batch_gb is not None and args.download_batch_gb <= 0:
+        parser.error("--download_batch_gb must be positive")
+    batch_bytes = int(args.download_batch_gb * 2**30) if args.download_batch_gb is not None else None
+    if args.plan and (args.shard is not None or args.record is not None or args.replay is not None):
+        parser.error("--plan cannot be combined with --shard, --record or --replay")
+    shard = None
+    if args.shard is not None:
+        try:
+            shard = sharding.parse_shard(args.shard)
+        except ValueError as x:
+            parser.error(str(x))
+    if args.metadata_cache is not None:
+        MetadataRetriever.cache = gdc_metadatacache.MetadataCache(args.metadata_cache)
+    if args.adaptive_timeout or args.hedge:
+        MetadataRetriever.requester = request_hedging.HedgedRequester(args.hedge, args.hedge_budget, RUN_STATS,
+                                                                      session=MetadataRetriever.session)
+        RUN_STATS.add_report('request_hedging', MetadataRetriever.requester.summary)
+    fetch_workers = args.fetch_workers
+    if args.auto_tune:
+        # in --pipeline mode, --fetch_workers is the starting point; enough fetchers run for the controller's maximum
+        MetadataRetriever.controller = aimd_controller.AimdController(
+            concurrency=min(fetch_workers, args.max_concurrency), max_concurrency=args.max_concurrency)
+        RUN_STATS.add_report('aimd_controller', MetadataRetriever.controller.summary)
+        fetch_workers = max(fetch_workers, args.max_concurrency)
+    if args.record is not None:
+        MetadataRetriever.cassette = http_cassette.Cassette(args.record, http_cassette.RECORD, args.gdc_api_root)
+    elif args.replay is not None:
+        MetadataRetriever.cassette = http_cassette.Cassette(args.replay, http_cassette.REPLAY)
 
     pp = pprint.PrettyPrinter()
 
-    cases = dict()
-    samples = dict()
-    pairs = dict()
+    spill_file = None
+    if args.spill_mb is not None:
+        spill_file = entity_store.SpillFile(int(args.spill_mb * 2**20), args.spill_dir)
+        cases = spill_file.store('participant')
+        samples = spill_file.store('sample')
+        pairs = spill_file.store('pair')
+    else:
+        cases = dict()
+        samples = dict()
+        pairs = dict()
     deferred_file_uuids = []
 
-    manifestFileList = _read_manifestFile(manifestFile)
+    try:
+        with RUN_STATS.phase('manifest_read'):
+            manifestFileList, duplicates = _read_manifestFiles(manifestFiles)
+        if duplicates > 0:
+            print("dropped {0} duplicate manifest rows (files listed more than once)".format(duplicates))
+        RUN_STATS.count('duplicate_manifest_rows', duplicates)
+        if shard is not None:
+            with RUN_STATS.phase('shard_selection'):
+                selected = sharding.select_shard(manifestFileList, shard[0], shard[1], args.gdc_api_root,
+                                                  MetadataRetriever.controller, MetadataRetriever.cassette)
+            print("shard {0}/{1}: {2} of {3} files".format(shard[0], shard[1], len(selected), len(manifestFileList)))
+            # positions in the whole manifest, so that the merge processes deferred files in manifest order
+            manifest_index = {item['id']: i for i, item in selected}
+            manifestFileList = [item for _, item in selected]
+        RUN_STATS.count('manifest_files', len(manifestFileList))
+        file_sizes = _manifest_file_sizes(manifestFileList)
+
+        if args.plan:
+            # imported here: only needed for --plan
+            from fcgdctools import run_planner
+            file_uuids = [item['id'] for item in manifestFileList]
+            known_urls = None
+            if uuidResolver is not None:
+                known_urls = set(file_uuid for file_uuid, url in uuidResolver.getURLs(file_uuids).items() if url != "__DELETE__")
+            elif args.resolve_uuids is not None:
+                known_urls = run_planner.resolver_tsv_uuids(args.resolve_uuids, file_uuids)
+            concurrency = 1
+            if args.pipeline:
+                concurrency = fetch_workers if not args.auto_tune else args.max_concurrency
+            history = run_planner.RunHistory.load(args.plan_history) if args.plan_history else None
+            plan = run_planner.plan_run(manifestFileList, MetadataRetriever.cache, known_urls, args.case_centric,
+                                        concurrency=concurrency, history=history)
+            for line in run_planner.format_plan(plan):
+                print(line)
+            plan_filename = manifestFileBasename + "_plan.json"
+            with open(plan_filename, 'w') as fp:
+                json.dump(plan, fp, indent=2, sort_keys=True)
+            # no --stats: a plan's statistics would skew the history of later plans
+            print("wrote the plan to {0}".format(plan_filename))
+            return
+
+        progress = None
+        if args.metrics_file is not None:
+            progress = progress_metrics.ProgressMetrics(args.metrics_file, RUN_STATS, args.metrics_interval)
+            progress.start_phase('main', len(manifestFileList))
 
-    gdc_api_root = GDC_API_ROOT
+        gdc_api_root = args.gdc_api_root
 
-    for i, item in enumerate(manifestFileList):
+        if args.case_centric:
+            with RUN_STATS.phase('bulk_retrieval'):
+                bulk_metadata = gdc_bulk.CaseCentricMetadata.fetch(gdc_api_root, [item['id'] for item in manifestFileList],
+                                                                    GDC_DataCategory, GDC_DataType,
+                                                                    controller=MetadataRetriever.controller, run_stats=RUN_STATS)
+            fetch_metadata = bulk_metadata.responses
+        else:
+            fetch_metadata = lambda file_uuid, deferred=False: fetch_file_metadata(gdc_api_root, file_uuid, deferred)
+        # retrying cannot help: a replayed run is deterministic, and bulk metadata is retrieved only once
+        no_retry = (http_cassette.CassetteMiss, gdc_bulk.MissingMetadata)
+
+        if args.pipeline:
+            pipeline = manifest_pipeline.ManifestPipeline(
+                # URLs are resolved once the model is complete
+                resolve_url=None,
+                fetch=fetch_metadata,
+                is_deferred=lambda responses: is_multi_case_file(responses[1]),
+                fetch_deferred=lambda file_uuid: fetch_metadata(file_uuid, deferred=True),
+                assemble=lambda file_uuid, filename, file_url, responses: add_file_to_model(
+                    gdc_api_root, file_uuid, filename, file_url, responses[0], responses[1], cases, samples, pairs, deferred_file_uuids),
+                assemble_deferred=lambda file_uuid, filename, file_url, responses: add_deferred_file_to_model(
+                    gdc_api_root, file_uuid, filename, file_url, responses[0], responses[1], cases, samples, args.all_cases),
+                run_stats=RUN_STATS, fetch_workers=fetch_workers, queue_size=args.queue_size,
+                progress=progress, quiet=args.quiet, no_retry=no_retry)
+            pipeline.run(manifestFileList, deferred_file_uuids, deferred_pass=shard is None)
+        else:
+            if args.assembly == 'table':
+                with RUN_STATS.phase('main_pass'):
+                    rules = table_assembly_rules()
+                    table = table_assembly.FileTable.build(manifestFileList, bulk_metadata, rules)
+                    table_assembly.assemble(gdc_api_root, table, bulk_metadata, cases, samples, pairs, deferred_file_uuids,
+                                            rules, RUN_STATS, MetadataRetriever.controller, progress)
+            else:
+                with RUN_STATS.phase('main_pass'):
+                    for i, item in enumerate(manifestFileList):
 
-        file_uuid = item['id']
-        filename = item['filename']
-        file_url = uuidResolver.getURL(file_uuid) if uuidResolver is not None else "__DELETE__"
+                        file_uuid = item['id']
+                        filename = item['filename']
+                        file_url = None
     
-        print('{0} of {1}: {2}, {3}'.format(i+1, len(manifestFileList), file_uuid, filename))
-
-        for attempt in range(5):
-            try:
-                get_file_metadata(gdc_api_root, file_uuid, filename, file_url, cases, samples, 
-                                  pairs, deferred_file_uuids)
-                break
-            except (KeyboardInterrupt, SystemExit):
-                raise
-            except Exception as x:
-                print(''.join(traceback.format_exception(etype=type(x), value=x, tb=x.__traceback__)))
-                print("attempt=", attempt, 'file uuid = ', file_uuid)
-                time.sleep((attempt+1)**2)
-        else:
-            #failed all attempts
-            # - just move on
-            print("failed 5 attempts! SKIPPING FILE: file uuid = ", file_uuid)
-
-
-    print("Processing deferred files...")
-    for uuid_and_filename in deferred_file_uuids:
-        file_uuid = uuid_and_filename[0]
-        filename = uuid_and_filename[1]
-        print("{0}, {1} ".format(file_uuid, filename))
-        file_url =  file_url = uuidResolver.getURL(file_uuid) if uuidResolver is not None else "__DELETE__"
-
-        for attempt in range(5):
-            try:
-                process_deferred_file_uuid(gdc_api_root, file_uuid, filename, file_url, cases, samples, args.all_cases)
-            except (KeyboardInterrupt, SystemExit):
-                raise
-            except Exception as x:
-                print("Exception=", x)
-                print("attempt=", attempt, 'file uuid = ', file_uuid)
-                time.sleep((attempt+1)**2)
+                        if not args.quiet:
+                            print('{0} of {1}: {2}, {3}'.format(i+1, len(manifestFileList), file_uuid, filename))
+
+                        for attempt in range(5):
+                            try:
+                                responseDict, metadata = fetch_metadata(file_uuid)
+                                add_file_to_model(gdc_api_root, file_uuid, filename, file_url, responseDict, metadata,
+                                                  cases, samples, pairs, deferred_file_uuids)
+                                failed = False
+                                break
+                            except (KeyboardInterrupt, SystemExit):
+                                raise
+                            except no_retry as x:
+                                print("{0}; SKIPPING FILE".format(x))
+                                RUN_STATS.count('failed_files')
+                                failed = True
+                                break
+                            except Exception as x:
+                                print(''.join(traceback.format_exception(type(x), x, x.__traceback__)))
+                                print("attempt=", attempt, 'file uuid = ', file_uuid)
+                                RUN_STATS.count('retries')
+                                with RUN_STATS.phase('retry_sleep'):
+                                    time.sleep((attempt+1)**2)
+                        else:
+                            #failed all attempts
+                            # - just move on
+                            print("failed 5 attempts! SKIPPING FILE: file uuid = ", file_uuid)
+                            RUN_STATS.count('failed_files')
+                            failed = True
+                        if progress is not None:
+                            progress.set_queue_depth('manifest', len(manifestFileList) - i - 1)
+                            progress.set_queue_depth('deferred', len(deferred_file_uuids))
+                            progress.file_done(failed)
+            RUN_STATS.count('deferred_files', len(deferred_file_uuids))
+            if progress is not None and shard is None:
+                progress.start_phase('deferred', len(deferred_file_uuids))
+
+            if shard is None:
+                # with --shard, files associated with multiple cases are processed by mergeFcWsLoadFiles
+                print("Processing deferred files...")
+                with RUN_STATS.phase('deferred_pass'):
+                    for i, uuid_and_filename in enumerate(deferred_file_uuids):
+                        file_uuid = uuid_and_filename[0]
+                        filename = uuid_and_filename[1]
+                        if not args.quiet:
+                            print("{0}, {1} ".format(file_uuid, filename))
+                        file_url = None
+
+                        for attempt in range(5):
+                            try:
+                                responseDict, metadata = fetch_metadata(file_uuid, deferred=True)
+                                add_deferred_file_to_model(gdc_api_root, file_uuid, filename, file_url, responseDict, metadata,
+                                                           cases, samples, args.all_cases)
+                            except (KeyboardInterrupt, SystemExit):
+                                raise
+                            except no_retry as x:
+                                print("{0}; SKIPPING FILE".format(x))
+                                RUN_STATS.count('failed_files')
+                                failed = True
+                                break
+                            except Exception as x:
+                                print("Exception=", x)
+                                print("attempt=", attempt, 'file uuid = ', file_uuid)
+                                RUN_STATS.count('retries')
+                                with RUN_STATS.phase('retry_sleep'):
+                                    time.sleep((attempt+1)**2)
+                            else:
+                                failed = False
+                                break
+                        else:
+                            #failed all attempts
+                            # - just move on
+                            print("failed 5 attempts! SKIPPING FILE: file uuid = ", file_uuid)
+                            RUN_STATS.count('failed_files')
+                            failed = True
+                        if progress is not None:
+                            progress.set_queue_depth('deferred', len(deferred_file_uuids) - i - 1)
+                            progress.file_done(failed)
+
+        with RUN_STATS.phase('resolver_lookup'):
+            num_resolved = resolve_file_urls(uuidResolver, [cases, samples, pairs])
+        RUN_STATS.count('resolved_urls', num_resolved)
+
+        if shard is not None:
+            if uuidResolver is not None:
+                with RUN_STATS.phase('resolver_lookup'):
+                    deferred_urls = uuidResolver.getURLs([file_uuid for file_uuid, _ in deferred_file_uuids])
             else:
-                break
+                deferred_urls = dict.fromkeys((file_uuid for file_uuid, _ in deferred_file_uuids), "__DELETE__")
+            partial_state_filename = "{0}.shard{1}of{2}{3}".format(manifestFileBasename, shard[0], shard[1], sharding.PARTIAL_STATE_SUFFIX)
+            with RUN_STATS.phase('write_partial_state'):
+                sharding.write_partial_state(partial_state_filename, {
+                    'manifest': manifestFileBasename, 'shard': list(shard),
+                    'cases': dict(cases.items()), 'samples': dict(samples.items()), 'pairs': dict(pairs.items()),
+                    'deferred': [[manifest_index[file_uuid], file_uuid, filename,
+                                  deferred_urls[file_uuid],
+                                  DEFERRED_FILE_NUM_OF_CASES[file_uuid]]
+                                 for file_uuid, filename in deferred_file_uuids],
+                    'file_sizes': file_sizes})
+            print("wrote partial state of shard {0}/{1} to {2}".format(shard[0], shard[1], partial_state_filename))
         else:
-            #failed all attempts
-            # - just move on
-            print("failed 5 attempts! SKIPPING FILE: file uuid = ", file_uuid)
-            continue
-
-    manifestFileBasename = os.path.splitext(os.path.basename(manifestFile))[0]
-
-    create_participants_file(cases, manifestFileBasename)
-    create_samples_file(samples, manifestFileBasename)
-    if len(pairs) != 0:
-        create_pairs_file(pairs, samples, manifestFileBasename)
-
-    #This part creates a file that specifies the workspace attributes. 
-    #The attributes are:
-    # 1.Default order of columns when shown in the workspace.
-    # 2.Whether the workspace is meant to deal with data fom the legacy site or not.
-    create_workspace_attributes_file(manifestFileBasename, False)
-    
+            with RUN_STATS.phase('write_load_files'):
+                create_participants_file(cases, manifestFileBasename, args.chunk_size, args.gzip, file_sizes, batch_bytes)
+                create_samples_file(samples, manifestFileBasename, args.chunk_size, args.gzip, file_sizes, batch_bytes)
+                if len(pairs) != 0:
+                    create_pairs_file(pairs, samples, manifestFileBasename, args.chunk_size, args.gzip, file_sizes, batch_bytes)
+            if args.columnar_dir is not None:
+                with RUN_STATS.phase('columnar_export'):
+                    columnar_export.export_entity_model(cases, samples, pairs, ATTRIBUTE_SCHEMA, SAMPLE_TYPE,
+                                                        args.columnar_dir, manifestFileBasename, args.columnar_format)
+
+            #This part creates a file that specifies the workspace attributes. 
+            #The attributes are:
+            # 1.Default order of columns when shown in the workspace.
+            # 2.Whether the workspace is meant to deal with data fom the legacy site or not.
+            create_workspace_attributes_file(manifestFileBasename, False)
+    finally:
+        # also if the run fails or is interrupted: a loadfile_service worker outlives its runs,
+        # and a recorded archive is finished with the responses recorded so far
+        if spill_file is not None:
+            spill_file.close()
+        if MetadataRetriever.cassette is not None:
+            MetadataRetriever.cassette.close()
+    if progress is not None:
+        progress.update(force=True)
+    if MetadataRetriever.controller is not None:
+        settings = MetadataRetriever.controller.summary()
+        print("auto_tune: final concurrency {0}, batch size {1} ({2} increases, {3} decreases)".format(
+            settings['concurrency'], settings['batch_size'], settings['increases'], settings['decreases']))
+    if args.stats is not None:
+        RUN_STATS.write(args.stats)
 
 if __name__ == '__main__':
     main()
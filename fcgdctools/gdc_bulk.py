@@ -0,0 +1,170 @@
+"""
+Batched queries of the GDC API, and the case-centric retrieval mode built on them.
+
+bulk_query POSTs "in" filters of up to a batch of ids to a GDC endpoint
+and yields the hits.
+
+In case-centric mode (genFcWsLoadFiles --case_centric) the per-file
+requests are replaced by two rounds of bulk queries: the files endpoint
+for the file-level fields of every file plus the ids of its cases and
+samples, and the cases endpoint for the metadata of each distinct case
+and its samples.  A cohort's files mostly share a few cases, so the
+case and sample metadata is retrieved once per case rather than once per
+file.  CaseCentricMetadata.responses() then joins the two into responses
+shaped exactly like those of fetch_file_metadata, so the entity model is
+assembled by the same code as in the file-centric mode.
+"""
+
+import time
+
+import requests
+
+# ids per bulk query
+BULK_BATCH_SIZE = 500
+
+FILE_FIELDS = ("file_id,data_category,data_type,data_format,access,experimental_strategy,analysis.workflow_type,"
+               "cases.case_id,cases.samples.sample_id")
+CASE_FIELDS = ("case_id,submitter_id,project.project_id,project.program.name,"
+               "samples.sample_id,samples.submitter_id,samples.sample_type_id")
+
+# file-level fields copied into FileMetadataRetriever-shaped responses
+_FILE_PROPERTIES = ['data_category', 'data_type', 'data_format', 'access', 'experimental_strategy', 'analysis']
+
+
+class MissingMetadata(LookupError):
+    """The bulk queries returned no metadata for a file, or for a case or sample it refers to."""
+
+
+def bulk_query(gdc_api_root, endpoint, field, ids, fields, batch_size=BULK_BATCH_SIZE, attempts=5, controller=None,
+               run_stats=None):
+    """Yield the hits of the endpoint's documents whose field is one of ids, querying a batch of ids at a time.
+
+    With an aimd_controller.AimdController, its batch size is used instead of
+    batch_size, and it observes every query.  Failed queries are retried with
+    a growing back-off; the last failure is raised.
+    """
+    start = 0
+    while start < len(ids):
+        size = controller.batch_size if controller is not None else batch_size
+        batch = ids[start:start + size]
+        query = {'filters': {'op': 'in', 'content': {'field': field, 'value': batch}},
+                 'fields': fields, 'format': 'JSON', 'size': len(batch)}
+        for attempt in range(attempts):
+            if run_stats is not None:
+                run_stats.request_started()
+            request_start = time.time()
+            status = None
+            try:
+                response = requests.post("{0}/{1}".format(gdc_api_root, endpoint), json=query, timeout=60)
+                status = response.status_code
+                response.raise_for_status()
+                hits = response.json()['data']['hits']
+            except (requests.RequestException, ValueError, KeyError) as x:
+                seconds = time.time() - request_start
+                if controller is not None:
+                    controller.record(seconds, ok=False, throttled=status == 429)
+                if run_stats is not None:
+                    run_stats.record_request(fields, seconds, ok=False)
+                print("{0} query failed: {1}; attempt = {2}".format(endpoint, x, attempt))
+                if attempt == attempts - 1:
+                    raise
+                time.sleep((attempt+1)**2)
+            else:
+                seconds = time.time() - request_start
+                if controller is not None:
+                    controller.record(seconds)
+                if run_stats is not None:
+                    run_stats.record_request(fields, seconds)
+                break
+        for hit in hits:
+            yield hit
+        start += len(batch)
+
+
+class CaseCentricMetadata:
+
+    """File and case metadata of a manifest, retrieved with bulk queries
+
+    Attributes:
+        files (dict): file uuid -> file-level fields and the ids of its cases and samples
+        cases (dict): case id -> case metadata
+        samples (dict): sample id -> sample metadata
+        data_category, data_type (class): the GDC_DataCategory and GDC_DataType enumerations of fc_loadfiles
+    """
+    def __init__(self, files, cases, data_category, data_type):
+        self.files = files
+        self.cases = cases
+        self.data_category = data_category
+        self.data_type = data_type
+        self.samples = dict()
+        for case in cases.values():
+            for sample in case.get('samples', []):
+                self.samples[sample['sample_id']] = sample
+
+    @classmethod
+    def fetch(cls, gdc_api_root, file_uuids, data_category, data_type, batch_size=BULK_BATCH_SIZE, controller=None,
+              run_stats=None):
+        """Retrieve the metadata of the files, then that of their distinct cases."""
+        files = dict()
+        for hit in bulk_query(gdc_api_root, 'files', 'file_id', file_uuids, FILE_FIELDS, batch_size,
+                              controller=controller, run_stats=run_stats):
+            files[hit['file_id']] = hit
+        case_ids = []
+        seen = set()
+        for file_uuid in file_uuids:
+            for case in files.get(file_uuid, {}).get('cases', []):
+                if case['case_id'] not in seen:
+                    seen.add(case['case_id'])
+                    case_ids.append(case['case_id'])
+        cases = dict()
+        for hit in bulk_query(gdc_api_root, 'cases', 'case_id', case_ids, CASE_FIELDS, batch_size,
+                              controller=controller, run_stats=run_stats):
+            cases[hit['case_id']] = hit
+        print("retrieved metadata of {0} files and {1} cases in bulk".format(len(files), len(cases)))
+        return cls(files, cases, data_category, data_type)
+
+    def _case(self, case_id):
+        case = self.cases.get(case_id)
+        if case is None:
+            raise MissingMetadata("no metadata for case {0}".format(case_id))
+        return case
+
+    def responses(self, file_uuid, deferred=False):
+        """Return the (responseDict, metadata) fetch_file_metadata(file_uuid, deferred) would return.
+
+        Raises MissingMetadata if the bulk queries did not return the file or one of its cases or samples.
+        """
+        hit = self.files.get(file_uuid)
+        if hit is None:
+            raise MissingMetadata("no metadata for file {0}".format(file_uuid))
+        file_cases = [self._case(case['case_id']) for case in hit.get('cases', [])]
+
+        responseDict = {name: hit[name] for name in _FILE_PROPERTIES if name in hit}
+        if file_cases:
+            responseDict['cases'] = [{'project': {'program': case['project']['program']}} for case in file_cases]
+
+        data_category = hit.get('data_category')
+        if data_category is None or 'data_type' not in hit or 'data_format' not in hit or 'access' not in hit or not file_cases:
+            # fetch_file_metadata does not retrieve the cases of files lacking a required property
+            return responseDict, None
+        # the same choice of case fields as fetch_file_metadata makes
+        if data_category in (self.data_category.CLINICAL, self.data_category.BIOSPECIMEN):
+            with_samples = hit['data_type'] == self.data_type.SLIDE_IMAGE and not deferred
+        else:
+            with_samples = True
+
+        metadata_cases = []
+        for case_link, case in zip(hit['cases'], file_cases):
+            entry = {'case_id': case['case_id'], 'submitter_id': case['submitter_id'],
+                     'project': {'project_id': case['project']['project_id']}}
+            sample_links = case_link.get('samples', [])
+            if with_samples and sample_links:
+                entry['samples'] = []
+                for link in sample_links:
+                    sample = self.samples.get(link['sample_id'])
+                    if sample is None:
+                        raise MissingMetadata("no metadata for sample {0}".format(link['sample_id']))
+                    entry['samples'].append({name: sample[name] for name in ('sample_id', 'submitter_id', 'sample_type_id')
+                                             if name in sample})
+            metadata_cases.append(entry)
+        return responseDict, {'cases': metadata_cases}
@@ -0,0 +1,60 @@
+"""
+A persistent cache of GDC file metadata responses.
+
+Responses are keyed by file uuid and the set of fields requested.
+The cache is backed by SQLite so that a single cache file can be
+shared by several concurrently running genFcWsLoadFiles processes
+(e.g., when building workspaces for many cohorts in a batch).
+"""
+
+import json
+import sqlite3
+import threading
+
+
+class MetadataCache:
+
+    """A GDC metadata cache
+
+    Attributes:
+        db_filename (str): path of the SQLite database holding the cached
+            responses; created if it does not exist.
+    """
+    def __init__(self, db_filename):
+        self.db_filename = db_filename
+        self._lock = threading.Lock()
+        # generous timeout: other processes sharing the cache may hold the write lock
+        self._conn = sqlite3.connect(db_filename, timeout=60, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS metadata ("
+                               "fields TEXT NOT NULL, uuid TEXT NOT NULL, data TEXT NOT NULL, "
+                               "PRIMARY KEY (fields, uuid))")
+
+    def get(self, fields, uuid):
+        """Return the cached response for uuid and fields, or None."""
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM metadata WHERE fields = ? AND uuid = ?",
+                                     (fields, uuid)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def get_many(self, fields, uuids, batch_size=500):
+        """Return a dict of uuid -> cached response for those of uuids that are cached for fields."""
+        found = dict()
+        for start in range(0, len(uuids), batch_size):
+            batch = list(uuids[start:start + batch_size])
+            with self._lock:
+                rows = self._conn.execute("SELECT uuid, data FROM metadata WHERE fields = ? AND uuid IN ({0})".format(
+                    ','.join('?' * len(batch))), [fields] + batch).fetchall()
+            for uuid, data in rows:
+                found[uuid] = json.loads(data)
+        return found
+
+    def put(self, fields, uuid, data):
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO metadata (fields, uuid, data) VALUES (?, ?, ?)",
+                               (fields, uuid, json.dumps(data)))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -19,10 +19,13 @@ class UuidResolver:
             large numbers of keys needed.
 
         unknownResponse (str): string to return if uuid is not recognized
+
+        db_filename (str): path of the dbm store; replaced if it exists
     """
-    def __init__(self, tsvFile, unknownResponse):
-        self.db_filename = "uuid_to_url"
+    def __init__(self, tsvFile, unknownResponse, db_filename="uuid_to_url"):
+        self.db_filename = db_filename
         self.unknownResponse = unknownResponse
+        self._db = None
         db = dbm.open(self.db_filename, 'n')
 
         with open(tsvFile) as f:
@@ -46,11 +49,43 @@ class UuidResolver:
             print("number of rows processed = {0}".format(i))
         db.close()
 
+    @classmethod
+    def from_store(cls, db_filename, unknownResponse):
+        """Return a resolver using a dbm store built earlier, e.g., by another process.
+
+        The store is kept open for the lifetime of the resolver, rather than
+        reopened for every lookup; close() releases it.
+        """
+        resolver = cls.__new__(cls)
+        resolver.db_filename = db_filename
+        resolver.unknownResponse = unknownResponse
+        resolver._db = dbm.open(db_filename, 'r')
+        return resolver
+
     def getURL(self, uuid):
-        db = dbm.open(self.db_filename, 'r')
+        db = self._db if self._db is not None else dbm.open(self.db_filename, 'r')
         try:
             url = db[uuid].decode("utf-8")
         except KeyError:
             url = self.unknownResponse
-        db.close()
+        if db is not self._db:
+            db.close()
         return url
+
+    def getURLs(self, uuids):
+        """Return a dict mapping each of uuids to its URL, opening the store once for all of them."""
+        db = self._db if self._db is not None else dbm.open(self.db_filename, 'r')
+        urls = dict()
+        for uuid in uuids:
+            try:
+                urls[uuid] = db[uuid].decode("utf-8")
+            except KeyError:
+                urls[uuid] = self.unknownResponse
+        if db is not self._db:
+            db.close()
+        return urls
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
@@ -0,0 +1,88 @@
+"""
+Record and replay of GDC metadata responses.
+
+A cassette is a zip archive holding one compressed JSON entry per
+(file uuid, requested fields) pair; the zip directory serves as the
+index.  Recording a run's responses and replaying them later reproduces
+the run exactly, offline and without network latency.
+"""
+
+import hashlib
+import json
+import threading
+import time
+import zipfile
+
+RECORD = 'record'
+REPLAY = 'replay'
+
+INFO_ENTRY = 'cassette.json'
+FORMAT_VERSION = 1
+
+
+def entry_name(fields, uuid):
+    fields_digest = hashlib.sha1(fields.encode('utf-8')).hexdigest()[:16]
+    return "{0}/{1}.json".format(uuid, fields_digest)
+
+
+class CassetteMiss(LookupError):
+    """Raised when replaying a request that was not recorded."""
+
+
+class Cassette:
+
+    """A recorded set of GDC metadata responses
+
+    Attributes:
+        filename (str): path of the zip archive
+        mode (str): RECORD to write a new archive (replacing any existing one),
+            REPLAY to serve responses from an existing archive
+        gdc_api_root (str): API root the responses are recorded from; stored in the archive
+    """
+    def __init__(self, filename, mode, gdc_api_root=None):
+        if mode not in (RECORD, REPLAY):
+            raise ValueError("unknown cassette mode {0}".format(mode))
+        self.filename = filename
+        self.mode = mode
+        self.gdc_api_root = gdc_api_root
+        self._lock = threading.Lock()
+        if mode == RECORD:
+            self._zip = zipfile.ZipFile(filename, 'w', compression=zipfile.ZIP_DEFLATED)
+            self._recorded = set()
+            self._start_time = time.time()
+        else:
+            self._zip = zipfile.ZipFile(filename, 'r')
+            self.info = json.loads(self._zip.read(INFO_ENTRY).decode('utf-8'))
+            if self.info.get('format_version') != FORMAT_VERSION:
+                raise ValueError("{0}: unsupported cassette format version {1}".format(filename, self.info.get('format_version')))
+
+    def record(self, fields, uuid, data):
+        """Add the response data for uuid and fields; later responses for the same request are not stored."""
+        name = entry_name(fields, uuid)
+        with self._lock:
+            if name in self._recorded:
+                return
+            self._recorded.add(name)
+            self._zip.writestr(name, json.dumps({'uuid': uuid, 'fields': fields, 'data': data}))
+
+    def replay(self, fields, uuid):
+        """Return the recorded response data for uuid and fields; raises CassetteMiss if there is none."""
+        try:
+            with self._lock:
+                entry = self._zip.read(entry_name(fields, uuid))
+        except KeyError:
+            raise CassetteMiss("{0}: no recorded response for file {1} with fields {2}".format(self.filename, uuid, fields))
+        return json.loads(entry.decode('utf-8'))['data']
+
+    def close(self):
+        """Finish the archive; safe to call more than once."""
+        with self._lock:
+            if self._zip is None:
+                return
+            if self.mode == RECORD:
+                info = {'format_version': FORMAT_VERSION, 'gdc_api_root': self.gdc_api_root,
+                        'recorded': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self._start_time)),
+                        'responses': len(self._recorded)}
+                self._zip.writestr(INFO_ENTRY, json.dumps(info, indent=2))
+            self._zip.close()
+            self._zip = None
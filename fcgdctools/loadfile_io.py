@@ -0,0 +1,134 @@
+"""
+Reading and writing of (optionally chunked and gzip-compressed) load files.
+
+A load file <base>.txt may instead be written as a series of chunks
+<base>.0001.txt, <base>.0002.txt, ..., each holding at most chunk_size
+rows and repeating the header row, and each may be gzip-compressed
+(<base>.txt.gz, <base>.0001.txt.gz, ...).
+"""
+
+import csv
+import glob
+import gzip
+import os
+import re
+
+
+def open_text(filename, mode='r'):
+    """Open a load file for reading or writing text, transparently handling .gz files."""
+    if filename.endswith('.gz'):
+        return gzip.open(filename, mode + 't', newline='')
+    return open(filename, mode, newline='')
+
+
+def find_load_files(basename):
+    """Return the files holding the load file <basename>.txt, in chunk order.
+
+    Returns an empty list if no such load file was written.
+    """
+    pattern = re.compile(re.escape(basename) + r'(\.\d+)?\.txt(\.gz)?$')
+    candidates = glob.glob(glob.escape(basename) + '*.txt') + glob.glob(glob.escape(basename) + '*.txt.gz')
+    return sorted(f for f in candidates if pattern.match(f))
+
+
+def remove_load_files(basename):
+    """Remove the files of the load file <basename>.txt, chunked or not, e.g., as written by an earlier run."""
+    for filename in find_load_files(basename):
+        os.remove(filename)
+
+
+def read_rows(filenames):
+    """Yield the rows (as dicts) of a possibly chunked load file, header rows excluded."""
+    for filename in filenames:
+        with open_text(filename) as fp:
+            reader = csv.DictReader(fp, delimiter='\t')
+            for row in reader:
+                yield row
+
+
+def read_header(filenames):
+    """Return the header row of a possibly chunked load file, or None if there are no files."""
+    if len(filenames) == 0:
+        return None
+    with open_text(filenames[0]) as fp:
+        return next(csv.reader(fp, delimiter='\t'))
+
+
+class ChunkedTsvWriter:
+
+    """A csv.DictWriter-like writer for load files
+
+    Attributes:
+        basename (str): the load file name without its .txt extension
+        fieldnames (list): header row
+        chunk_size (int): maximum number of rows per file, or None to write a single file
+        compress (bool): gzip-compress the files
+        keep_together (str): optional field name; rows sharing a value of this field
+            (e.g., the members of one set) are never split across chunks: a membership
+            upload replaces the set's members.  Such rows are buffered and written, grouped
+            by that field, when the writer is closed; a group larger than chunk_size gets
+            an oversized chunk of its own.
+        filenames (list): the files written so far
+
+    Any files of the load file left by an earlier run, in particular chunks a
+    differently chunked or compressed run wrote, are removed first, so that
+    find_load_files returns just the files of this one.
+    """
+    def __init__(self, basename, fieldnames, chunk_size=None, compress=False, keep_together=None):
+        self.basename = basename
+        self.fieldnames = fieldnames
+        self.chunk_size = chunk_size
+        self.compress = compress
+        self.keep_together = keep_together if chunk_size is not None else None
+        self.filenames = []
+        self._groups = dict()
+        self._fp = None
+        self._writer = None
+        self._rows_in_chunk = 0
+        remove_load_files(basename)
+        if chunk_size is None:
+            self._open_next()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def _open_next(self):
+        if self._fp is not None:
+            self._fp.close()
+        if self.chunk_size is None:
+            filename = self.basename + '.txt'
+        else:
+            filename = '{0}.{1:04d}.txt'.format(self.basename, len(self.filenames) + 1)
+        if self.compress:
+            filename += '.gz'
+        self._fp = open_text(filename, 'w')
+        self._writer = csv.DictWriter(self._fp, fieldnames=self.fieldnames, delimiter='\t')
+        self._writer.writeheader()
+        self._rows_in_chunk = 0
+        self.filenames.append(filename)
+
+    def _write_rows(self, rows):
+        if self._fp is None or (self.chunk_size is not None and
+                                self._rows_in_chunk > 0 and self._rows_in_chunk + len(rows) > self.chunk_size):
+            self._open_next()
+        self._writer.writerows(rows)
+        self._rows_in_chunk += len(rows)
+
+    def writerow(self, row):
+        if self.keep_together is not None:
+            self._groups.setdefault(row[self.keep_together], []).append(row)
+        else:
+            self._write_rows([row])
+
+    def close(self):
+        for rows in self._groups.values():
+            # a group larger than chunk_size gets a chunk of its own
+            self._write_rows(rows)
+        self._groups = dict()
+        if self._fp is None:
+            # no rows at all: still write a file with just the header
+            self._open_next()
+        self._fp.close()
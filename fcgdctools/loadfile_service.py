@@ -0,0 +1,433 @@
+"""
+A long-running genFcWsLoadFiles service with a local job API.
+
+Running genFcWsLoadFiles once per manifest pays every time for
+interpreter startup, building the uuid resolver's dbm store, new HTTP
+connections and a cold metadata cache.  The service keeps these warm:
+each uuid resolver TSV file is turned into a dbm store once (and again
+only when the file changes), a pool of worker processes each keeps a
+requests.Session whose connections are reused from job to job, and all
+jobs share one metadata cache.
+
+Jobs are submitted over HTTP, on a local TCP port or a Unix socket:
+
+    POST /jobs         {"manifest": ... or [...], "resolve_uuids": ..., "output_dir": ..., "args": [...], "wait": false}
+    GET  /jobs         all jobs, without their statistics
+    GET  /jobs/<id>    one job: its status, load files, log and statistics
+    GET  /health       worker count and the number of jobs per status
+
+Up to one job per worker process runs at a time.  Each job runs
+genFcWsLoadFiles, with the given additional arguments, in its output
+directory (by default a directory of its own under the service's state
+directory); relative paths in args are relative to that directory.
+"""
+
+import argparse
+import glob
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import socketserver
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import redirect_stderr, redirect_stdout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from fcgdctools import fc_loadfiles
+from fcgdctools import gdc_metadatacache
+from fcgdctools import gdc_uuidresolver
+from fcgdctools import run_stats
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+# finished jobs kept for GET /jobs; the oldest are forgotten first
+MAX_FINISHED_JOBS = 1000
+
+
+# -- worker processes
+
+_worker_cache = None
+_worker_session = None
+# resolver store -> open gdc_uuidresolver.UuidResolver
+_worker_resolvers = dict()
+
+
+def _init_worker(metadata_cache_filename, pool_size):
+    global _worker_cache, _worker_session
+    _worker_cache = gdc_metadatacache.MetadataCache(metadata_cache_filename)
+    _worker_session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    _worker_session.mount('http://', adapter)
+    _worker_session.mount('https://', adapter)
+
+
+def _reset_run_state():
+    """Undo what a previous job's main() set up, keeping the warm cache and session."""
+    fc_loadfiles.RUN_STATS = run_stats.RunStats()
+    fc_loadfiles.MetadataRetriever.cache = _worker_cache
+    fc_loadfiles.MetadataRetriever.session = _worker_session
+    fc_loadfiles.MetadataRetriever.cassette = None
+    fc_loadfiles.MetadataRetriever.requester = None
+    fc_loadfiles.MetadataRetriever.controller = None
+    fc_loadfiles.DEFERRED_FILE_NUM_OF_CASES.clear()
+
+
+def _remove_store(store):
+    # a dbm store is one or more files named after it, depending on the dbm implementation
+    for filename in glob.glob(glob.escape(store) + '*'):
+        os.remove(filename)
+
+
+def _close_removed_resolvers():
+    """Close the resolvers whose stores the service removed since, having replaced them."""
+    for store in list(_worker_resolvers):
+        if len(glob.glob(glob.escape(store) + '*')) == 0:
+            _worker_resolvers.pop(store).close()
+
+
+def _output_basename(manifests, args):
+    """The basename of a job's load files, as genFcWsLoadFiles will choose it."""
+    for i, arg in enumerate(args):
+        if arg in ('-o', '--output') and i + 1 < len(args):
+            return args[i + 1]
+        if arg.startswith('--output='):
+            return arg[len('--output='):]
+    try:
+        first = fc_loadfiles._expand_manifests(manifests)[0]
+    except ValueError:
+        first = manifests[0]
+    return os.path.splitext(os.path.basename(first))[0]
+
+
+def _load_files(directory, basename, since):
+    """The files a job wrote to directory: named after its manifests and modified since it started."""
+    paths = []
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if name.startswith(basename + '_') and os.path.isfile(path) and os.path.getmtime(path) >= since:
+            paths.append(path)
+    return sorted(paths)
+
+
+def run_job(manifests, output_dir, args, resolver_store):
+    """Run genFcWsLoadFiles for one job in a worker process; returns the job's results."""
+    os.makedirs(output_dir, exist_ok=True)
+    os.chdir(output_dir)
+    _reset_run_state()
+    basename = _output_basename(manifests, args)
+    stats_filename = os.path.join(output_dir, basename + '_stats.json')
+    log_filename = os.path.join(output_dir, basename + '_log.txt')
+    uuid_resolver = None
+    _close_removed_resolvers()
+    if resolver_store is not None:
+        uuid_resolver = _worker_resolvers.get(resolver_store)
+        if uuid_resolver is None:
+            uuid_resolver = _worker_resolvers[resolver_store] = gdc_uuidresolver.UuidResolver.from_store(resolver_store, '__DELETE__')
+
+    # file modification times may have a coarser resolution than time.time()
+    start = int(time.time())
+    error = None
+    with open(log_filename, 'w') as log, redirect_stdout(log), redirect_stderr(log):
+        try:
+            fc_loadfiles.main(list(args) + ['--stats', stats_filename] + list(manifests), uuid_resolver=uuid_resolver)
+        except SystemExit as x:
+            # argparse errors, already described in the log
+            if x.code not in (None, 0):
+                error = "genFcWsLoadFiles exited with status {0}".format(x.code)
+        except Exception as x:
+            traceback.print_exc()
+            error = "{0}: {1}".format(type(x).__name__, x)
+
+    stats = None
+    if os.path.exists(stats_filename):
+        with open(stats_filename) as fp:
+            stats = json.load(fp)
+    load_files = [path for path in _load_files(output_dir, basename, start) if path not in (stats_filename, log_filename)]
+    return {'error': error, 'load_files': load_files, 'stats_file': stats_filename if stats is not None else None,
+            'log_file': log_filename, 'stats': stats}
+
+
+# -- the service
+
+
+class LoadFileService:
+
+    """Queues, runs and tracks genFcWsLoadFiles jobs
+
+    Attributes:
+        state_dir (str): directory for the resolver stores and the default job output directories
+        metadata_cache (str): SQLite metadata cache shared by all jobs
+        workers (int): worker processes, i.e., the most jobs running at a time
+        pool_size (int): HTTP connections kept per worker process
+    """
+    def __init__(self, state_dir, metadata_cache=None, workers=4, pool_size=64):
+        self.state_dir = os.path.abspath(state_dir)
+        os.makedirs(os.path.join(self.state_dir, 'jobs'), exist_ok=True)
+        os.makedirs(os.path.join(self.state_dir, 'resolvers'), exist_ok=True)
+        # stores of an earlier service run are not reused
+        for name in os.listdir(os.path.join(self.state_dir, 'resolvers')):
+            os.remove(os.path.join(self.state_dir, 'resolvers', name))
+        self.metadata_cache = os.path.abspath(metadata_cache if metadata_cache is not None
+                                              else os.path.join(self.state_dir, 'metadata_cache.sqlite'))
+        self.workers = workers
+        self.pool_size = pool_size
+        self._lock = threading.Lock()
+        self._jobs = dict()
+        self._job_ids = itertools.count(1)
+        # resolver TSV file -> ((mtime, size), dbm store) of the file's latest version
+        self._resolvers = dict()
+        self._resolver_locks = dict()
+        # dbm store -> number of jobs using it
+        self._store_jobs = dict()
+        # stores of earlier versions of the TSV files, removed once no job uses them
+        self._replaced_stores = set()
+        # worker processes are spawned rather than forked: the service's threads and sockets must not be inherited
+        self._pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                         initializer=_init_worker, initargs=(self.metadata_cache, pool_size))
+        # one thread per running job: prepares it, hands it to the pool and collects the result
+        self._dispatcher = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+
+    def _resolver_store(self, tsv_filename):
+        """Return the dbm store for a resolver TSV file, building it on first use or if the file changed.
+
+        The store is in use by the caller until it calls _release_resolver_store.
+        The store of the file's previous version is removed once no job uses it.
+        """
+        st = os.stat(tsv_filename)
+        version = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            lock = self._resolver_locks.setdefault(tsv_filename, threading.Lock())
+        with lock:
+            with self._lock:
+                current = self._resolvers.get(tsv_filename)
+            if current is None or current[0] != version:
+                digest = hashlib.sha1(repr((tsv_filename,) + version).encode('utf-8')).hexdigest()[:16]
+                store = os.path.join(self.state_dir, 'resolvers', digest)
+                gdc_uuidresolver.UuidResolver(tsv_filename, '__DELETE__', db_filename=store)
+                with self._lock:
+                    self._resolvers[tsv_filename] = (version, store)
+                if current is not None:
+                    self._replace_store(current[1])
+            with self._lock:
+                store = self._resolvers[tsv_filename][1]
+                self._store_jobs[store] = self._store_jobs.get(store, 0) + 1
+            return store
+
+    def _replace_store(self, store):
+        with self._lock:
+            unused = store not in self._store_jobs
+            if not unused:
+                self._replaced_stores.add(store)
+        if unused:
+            _remove_store(store)
+
+    def _release_resolver_store(self, store):
+        with self._lock:
+            self._store_jobs[store] -= 1
+            unused = self._store_jobs[store] == 0
+            if unused:
+                del self._store_jobs[store]
+                unused = store in self._replaced_stores
+                self._replaced_stores.discard(store)
+        if unused:
+            _remove_store(store)
+
+    def submit(self, manifest, resolve_uuids=None, output_dir=None, args=()):
+        """Queue a job for a manifest, or a list of manifests or glob patterns; returns its id.
+
+        Paths are interpreted relative to the service's working directory.
+        """
+        manifests = [manifest] if isinstance(manifest, str) else manifest
+        if not isinstance(manifests, list) or len(manifests) == 0 or not all(isinstance(m, str) for m in manifests):
+            raise ValueError("manifest must be a path or a non-empty list of paths")
+        manifests = [os.path.abspath(m) for m in manifests]
+        for m in manifests:
+            if not glob.has_magic(m) and not os.path.isfile(m):
+                raise ValueError("no such manifest: {0}".format(m))
+        if resolve_uuids is not None:
+            resolve_uuids = os.path.abspath(resolve_uuids)
+            if not os.path.isfile(resolve_uuids):
+                raise ValueError("no such resolver TSV file: {0}".format(resolve_uuids))
+        if not all(isinstance(arg, str) for arg in args):
+            raise ValueError("args must be a list of strings")
+        with self._lock:
+            job_id = '{0:06d}'.format(next(self._job_ids))
+            if output_dir is None:
+                output_dir = os.path.join(self.state_dir, 'jobs', job_id)
+            job = {'id': job_id, 'status': QUEUED, 'manifest': manifests, 'resolve_uuids': resolve_uuids,
+                   'output_dir': os.path.abspath(output_dir), 'args': list(args),
+                   'submitted': time.time(), 'started': None, 'finished': None, 'seconds': None,
+                   'error': None, 'load_files': [], 'stats_file': None, 'log_file': None, 'stats': None,
+                   'done': threading.Event()}
+            self._jobs[job_id] = job
+        self._dispatcher.submit(self._run, job)
+        return job_id
+
+    def _run(self, job):
+        with self._lock:
+            job['status'] = RUNNING
+            job['started'] = time.time()
+        store = None
+        try:
+            store = self._resolver_store(job['resolve_uuids']) if job['resolve_uuids'] is not None else None
+            result = self._pool.submit(run_job, job['manifest'], job['output_dir'], job['args'], store).result()
+        except Exception as x:
+            result = {'error': "{0}: {1}".format(type(x).__name__, x)}
+        finally:
+            if store is not None:
+                self._release_resolver_store(store)
+        with self._lock:
+            job.update(result)
+            job['status'] = FAILED if job['error'] is not None else SUCCEEDED
+            job['finished'] = time.time()
+            job['seconds'] = job['finished'] - job['started']
+            self._forget_old_jobs()
+        job['done'].set()
+
+    def _forget_old_jobs(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job['status'] in (SUCCEEDED, FAILED)]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[job_id]
+
+    def wait(self, job_id, timeout=None):
+        job = self._jobs.get(job_id)
+        if job is not None:
+            job['done'].wait(timeout)
+
+    def job(self, job_id, with_stats=True):
+        """A JSON-serializable copy of a job, or None."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            return {key: value for key, value in job.items() if key != 'done' and (with_stats or key != 'stats')}
+
+    def jobs(self):
+        with self._lock:
+            job_ids = list(self._jobs)
+        return [job for job in (self.job(job_id, with_stats=False) for job_id in job_ids) if job is not None]
+
+    def health(self):
+        counts = dict()
+        with self._lock:
+            for job in self._jobs.values():
+                counts[job['status']] = counts.get(job['status'], 0) + 1
+        return {'status': 'ok', 'workers': self.workers, 'jobs': counts}
+
+    def shutdown(self):
+        self._dispatcher.shutdown(wait=False, cancel_futures=True)
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+
+    # set on the server subclass created by make_server()
+    service = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        parts = self.path.split('?')[0].strip('/').split('/')
+        if parts == ['health']:
+            self._send_json(200, self.service.health())
+        elif parts == ['jobs']:
+            self._send_json(200, {'jobs': self.service.jobs()})
+        elif len(parts) == 2 and parts[0] == 'jobs':
+            job = self.service.job(parts[1])
+            if job is None:
+                self._send_json(404, {'message': 'no job {0}'.format(parts[1])})
+            else:
+                self._send_json(200, job)
+        else:
+            self._send_json(404, {'message': 'unsupported endpoint {0}'.format(self.path)})
+
+    def do_POST(self):
+        if self.path.split('?')[0].strip('/') != 'jobs':
+            self._send_json(404, {'message': 'unsupported endpoint {0}'.format(self.path)})
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            if not isinstance(body, dict) or 'manifest' not in body:
+                raise ValueError("a job requires a manifest")
+            job_id = self.service.submit(body['manifest'], body.get('resolve_uuids'), body.get('output_dir'),
+                                         body.get('args', []))
+        except ValueError as x:
+            self._send_json(400, {'message': str(x)})
+            return
+        if body.get('wait'):
+            self.service.wait(job_id)
+        job = self.service.job(job_id)
+        self._send_json(200 if job['status'] in (SUCCEEDED, FAILED) else 202, job)
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        socketserver.UnixStreamServer.server_bind(self)
+        # BaseHTTPRequestHandler expects these of an HTTPServer
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+
+def make_server(service, host='127.0.0.1', port=0, socket_path=None):
+    """Create (but do not start) a threaded HTTP server for service, on a Unix socket if socket_path is given."""
+    handler = type('BoundServiceHandler', (ServiceHandler,), {'service': service})
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        return ThreadingUnixHTTPServer(socket_path, handler)
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='serve genFcWsLoadFiles jobs over a local HTTP API, keeping resolvers, metadata cache and connections warm')
+    parser.add_argument("--host", help="address to listen on", default='127.0.0.1')
+    parser.add_argument("--port", help="TCP port to listen on", type=int, default=8089)
+    parser.add_argument("--socket", help="listen on this Unix socket instead of a TCP port")
+    parser.add_argument("--workers", help="worker processes, i.e., the most jobs running at a time", type=int, default=4)
+    parser.add_argument("--state_dir", help="directory for resolver stores and job outputs", default='fcgdctools_service')
+    parser.add_argument("-m", "--metadata_cache", help="SQLite file caching GDC metadata responses for all jobs (default: in STATE_DIR)")
+    args = parser.parse_args()
+
+    service = LoadFileService(args.state_dir, args.metadata_cache, args.workers)
+    server = make_server(service, args.host, args.port, args.socket)
+    if args.socket is not None:
+        print("serving genFcWsLoadFiles jobs on {0}".format(args.socket))
+    else:
+        print("serving genFcWsLoadFiles jobs at http://{0}:{1}".format(*server.server_address[:2]))
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+        if args.socket is not None and os.path.exists(args.socket):
+            os.remove(args.socket)
+
+
+if __name__ == '__main__':
+    main()
@@ -26,7 +26,7 @@ def build_filter_json(filter_attrs):
 	return filt
 
 
-def download_manifest(filt_json):
+def download_manifest(filt_json, directory='.'):
 	
 	#This is the API endpoint for performing a search on the GDC data portal and retrieving file information.
 	files_endpt = 'https://api.gdc.cancer.gov/files'
@@ -41,8 +41,8 @@ def download_manifest(filt_json):
 	# requests URL-encodes automatically
 	response = requests.get(files_endpt, params = params)
 
-	#Writing the output to the manifest file
-	with open(manifest_filename, 'wb') as handle:
+	#Writing the output to the manifest file; the returned name is relative to directory
+	with open(os.path.join(directory, manifest_filename), 'wb') as handle:
 		for block in response.iter_content(1024):
 			handle.write(block)
 
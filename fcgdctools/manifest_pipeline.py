@@ -0,0 +1,228 @@
+"""
+Staged processing of a manifest's files.
+
+The stages run concurrently and are connected by bounded queues, so that
+a slow stage holds back (rather than accumulates) the work of the stages
+feeding it:
+
+    reader -> fetchers -> classifier -> assembler
+                              |
+                              +-> deferred fetcher
+
+The reader resolves each file's URL (unless URLs are resolved once the
+model is complete); several fetchers retrieve metadata
+from the GDC; the classifier restores manifest order and sends files
+associated with multiple cases to the deferred fetcher as well, so that
+their metadata is retrieved while single-case files are still being
+assembled.  The assembler (the calling thread) builds the entity model,
+first from all files in manifest order and then from the deferred files,
+exactly as the serial passes do.  Writing the load files follows once
+the model is complete.
+
+The pipeline is independent of the GDC specifics; fc_loadfiles supplies
+the functions run by each stage.
+"""
+
+import heapq
+import queue
+import threading
+import time
+import traceback
+
+# marks the end of the items in a queue
+_DONE = None
+
+
+class ManifestPipeline:
+
+    """Runs the main and deferred passes over a manifest's files as a staged pipeline
+
+    Attributes:
+        resolve_url (callable): file uuid -> file url; if None, files are assembled with a file url of None
+        fetch (callable): file uuid -> metadata, for the main pass
+        is_deferred (callable): metadata -> True if the file is deferred
+        fetch_deferred (callable): file uuid -> metadata, for the deferred pass
+        assemble (callable): (file uuid, filename, file url, metadata) -> None; adds a file to
+            the model, recording deferred files in the list passed to run()
+        assemble_deferred (callable): (file uuid, filename, file url, metadata) -> None
+        run_stats (RunStats): receives phase timings and retry and failure counts
+        fetch_workers (int): number of concurrent fetchers
+        queue_size (int): capacity of each queue between stages
+        progress (ProgressMetrics): optional; updated by the assembler
+        quiet (bool): do not print a line per file
+        no_retry (tuple): exception types on which a file is skipped without retrying
+    """
+    def __init__(self, resolve_url, fetch, is_deferred, fetch_deferred, assemble, assemble_deferred, run_stats,
+                 fetch_workers=4, queue_size=1000, progress=None, quiet=False, no_retry=()):
+        self.resolve_url = resolve_url
+        self.fetch = fetch
+        self.is_deferred = is_deferred
+        self.fetch_deferred = fetch_deferred
+        self.assemble = assemble
+        self.assemble_deferred = assemble_deferred
+        self.run_stats = run_stats
+        self.fetch_workers = fetch_workers
+        self.queue_size = queue_size
+        self.progress = progress
+        self.quiet = quiet
+        self.no_retry = tuple(no_retry)
+        self._error = None
+        self._deferred_pass = True
+
+    def _attempt(self, action, file_uuid, attempts=5):
+        """Run action, retrying with a growing back-off; returns (succeeded, result)."""
+        for attempt in range(attempts):
+            try:
+                return True, action()
+            except (KeyboardInterrupt, SystemExit):
+                raise
+            except self.no_retry as x:
+                print("{0}; SKIPPING FILE".format(x))
+                break
+            except Exception as x:
+                print(''.join(traceback.format_exception(type(x), x, x.__traceback__)))
+                print("attempt=", attempt, 'file uuid = ', file_uuid)
+                self.run_stats.count('retries')
+                with self.run_stats.phase('retry_sleep'):
+                    time.sleep((attempt+1)**2)
+        else:
+            print("failed {0} attempts! SKIPPING FILE: file uuid = ".format(attempts), file_uuid)
+        self.run_stats.count('failed_files')
+        return False, None
+
+    def _stage(self, target, *args):
+        """Thread body: runs a stage, recording an unexpected error for the assembler to raise."""
+        try:
+            target(*args)
+        except BaseException as x:
+            self._error = x
+            raise
+
+    def _get(self, q):
+        # a stage that died would otherwise leave the assembler waiting forever
+        while True:
+            try:
+                return q.get(timeout=1)
+            except queue.Empty:
+                if self._error is not None:
+                    raise RuntimeError("manifest pipeline stage failed") from self._error
+
+    def _read(self, items, fetch_queue):
+        for i, item in enumerate(items):
+            file_uuid = item['id']
+            filename = item['filename']
+            file_url = None
+            if self.resolve_url is not None:
+                with self.run_stats.phase('resolver_lookup'):
+                    file_url = self.resolve_url(file_uuid)
+            if not self.quiet:
+                print('{0} of {1}: {2}, {3}'.format(i+1, len(items), file_uuid, filename))
+            fetch_queue.put((i, file_uuid, filename, file_url))
+        for _ in range(self.fetch_workers):
+            fetch_queue.put(_DONE)
+
+    def _fetch(self, fetch_queue, classify_queue):
+        while True:
+            item = fetch_queue.get()
+            if item is _DONE:
+                classify_queue.put(_DONE)
+                return
+            i, file_uuid, filename, file_url = item
+            ok, metadata = self._attempt(lambda: self.fetch(file_uuid), file_uuid)
+            classify_queue.put((i, file_uuid, filename, file_url, ok, metadata))
+
+    def _classify(self, classify_queue, assemble_queue, deferred_queue):
+        # fetchers finish out of order; release the files in manifest order
+        pending = []
+        next_index = 0
+        finished_fetchers = 0
+        while finished_fetchers < self.fetch_workers:
+            item = classify_queue.get()
+            if item is _DONE:
+                finished_fetchers += 1
+                continue
+            heapq.heappush(pending, item)
+            while pending and pending[0][0] == next_index:
+                i, file_uuid, filename, file_url, ok, metadata = heapq.heappop(pending)
+                if ok and self._deferred_pass and self.is_deferred(metadata):
+                    deferred_queue.put((file_uuid, file_url))
+                assemble_queue.put((file_uuid, filename, file_url, ok, metadata))
+                next_index += 1
+        assemble_queue.put(_DONE)
+        deferred_queue.put(_DONE)
+
+    def _fetch_deferred(self, deferred_queue, deferred_metadata):
+        while True:
+            item = deferred_queue.get()
+            if item is _DONE:
+                return
+            file_uuid, file_url = item
+            ok, metadata = self._attempt(lambda: self.fetch_deferred(file_uuid), file_uuid)
+            deferred_metadata[file_uuid] = (file_url, ok, metadata)
+
+    def _update_progress(self, queues, remaining, failed):
+        if self.progress is None:
+            return
+        for name, q in queues.items():
+            self.progress.set_queue_depth(name, q.qsize())
+        self.progress.set_queue_depth('manifest', remaining)
+        self.progress.file_done(failed)
+
+    def run(self, items, deferred_file_uuids, deferred_pass=True):
+        """Process the manifest items (dicts with 'id' and 'filename'); deferred_file_uuids
+        receives the [uuid, filename] of the deferred files, as assemble records them.
+        With deferred_pass False the deferred files are only recorded, not processed."""
+        self._deferred_pass = deferred_pass
+        fetch_queue = queue.Queue(self.queue_size)
+        classify_queue = queue.Queue(self.queue_size)
+        assemble_queue = queue.Queue(self.queue_size)
+        deferred_queue = queue.Queue(self.queue_size)
+        deferred_metadata = dict()
+        queues = {'fetch': fetch_queue, 'classify': classify_queue, 'assemble': assemble_queue, 'deferred_fetch': deferred_queue}
+
+        threads = [threading.Thread(target=self._stage, args=(self._read, items, fetch_queue), name='reader', daemon=True),
+                   threading.Thread(target=self._stage, args=(self._classify, classify_queue, assemble_queue, deferred_queue),
+                                    name='classifier', daemon=True)]
+        threads += [threading.Thread(target=self._stage, args=(self._fetch, fetch_queue, classify_queue),
+                                     name='fetcher-{0}'.format(n), daemon=True) for n in range(self.fetch_workers)]
+        deferred_fetcher = threading.Thread(target=self._stage, args=(self._fetch_deferred, deferred_queue, deferred_metadata),
+                                            name='deferred-fetcher', daemon=True)
+        threads.append(deferred_fetcher)
+        for thread in threads:
+            thread.start()
+
+        with self.run_stats.phase('main_pass'):
+            remaining = len(items)
+            while True:
+                item = self._get(assemble_queue)
+                if item is _DONE:
+                    break
+                file_uuid, filename, file_url, ok, metadata = item
+                if ok:
+                    ok, _ = self._attempt(lambda: self.assemble(file_uuid, filename, file_url, metadata), file_uuid)
+                remaining -= 1
+                if self.progress is not None:
+                    self.progress.set_queue_depth('deferred', len(deferred_file_uuids))
+                self._update_progress(queues, remaining, not ok)
+
+        self.run_stats.count('deferred_files', len(deferred_file_uuids))
+        if not deferred_pass:
+            return
+        if self.progress is not None:
+            self.progress.start_phase('deferred', len(deferred_file_uuids))
+        print("Processing deferred files...")
+        with self.run_stats.phase('deferred_pass'):
+            # the deferred metadata was fetched while the main pass was assembling
+            while deferred_fetcher.is_alive():
+                deferred_fetcher.join(timeout=1)
+                if self._error is not None:
+                    raise RuntimeError("manifest pipeline stage failed") from self._error
+            for i, (file_uuid, filename) in enumerate(deferred_file_uuids):
+                if not self.quiet:
+                    print("{0}, {1} ".format(file_uuid, filename))
+                file_url, ok, metadata = deferred_metadata[file_uuid]
+                if ok:
+                    ok, _ = self._attempt(lambda: self.assemble_deferred(file_uuid, filename, file_url, metadata), file_uuid)
+                if self.progress is not None:
+                    self.progress.set_queue_depth('deferred', len(deferred_file_uuids) - i - 1)
+                    self.progress.file_done(not ok)
@@ -0,0 +1,156 @@
+"""
+Combines the partial states written by genFcWsLoadFiles --shard k/N into
+the final load files.
+
+The shards' entities are merged; an attribute that two shards set to
+different files (possible only if the shards were not partitioned by
+case) is reconciled with the same replicate selection rules as a single
+run.  Files associated with multiple cases, which no shard could
+process, are then processed against the combined entity model, in
+manifest order, and the load files are written.
+"""
+
+import argparse
+import time
+import traceback
+
+from fcgdctools import fc_loadfiles
+from fcgdctools import gdc_metadatacache
+from fcgdctools import sharding
+
+
+def _merge_entity(gdc_api_root, entity_id, entity, incoming):
+    for attribute_name, value in incoming.items():
+        if attribute_name.endswith(fc_loadfiles.URL_ATTRIBUTE_SUFFIX):
+            # set together with its uuid attribute
+            continue
+        attribute = fc_loadfiles.ATTRIBUTE_SCHEMA.file_attribute(attribute_name)
+        if attribute is None:
+            entity.setdefault(attribute_name, value)
+            continue
+        if entity.get(attribute_name) == value:
+            continue
+        if attribute_name not in entity:
+            entity[attribute_name] = value
+            entity[attribute.url_name] = incoming[attribute.url_name]
+            continue
+        # both shards attached a file to this attribute: choose between them as a single run would
+        file_uuid, filename = value.split(fc_loadfiles.SEPARATOR, 1)
+        file_url = incoming[attribute.url_name]
+        responseDict = fc_loadfiles.FileMetadataRetriever(gdc_api_root).get_metadata(file_uuid)
+        (data_category, data_type, data_format, access, program,
+         experimental_strategy, workflow_type) = fc_loadfiles._file_properties(responseDict)
+        fc_loadfiles._add_file_attribute(gdc_api_root, entity_id, entity, file_uuid, filename, file_url,
+                                         data_category, data_type, data_format, experimental_strategy, workflow_type,
+                                         access, program)
+
+
+def merge_entities(gdc_api_root, target, incoming):
+    """Merge the entities (dict of entity id -> attributes) of one shard into target."""
+    for entity_id, entity in incoming.items():
+        if entity_id not in target:
+            target[entity_id] = entity
+        else:
+            _merge_entity(gdc_api_root, entity_id, target[entity_id], entity)
+
+
+def check_shards(states):
+    """Raise ValueError unless the states are exactly shards 1..N of one partitioning."""
+    num_shards = set(state['shard'][1] for state in states)
+    if len(num_shards) != 1:
+        raise ValueError("partial states come from different partitionings: {0}".format(sorted(num_shards)))
+    n = num_shards.pop()
+    shards = sorted(state['shard'][0] for state in states)
+    if shards != list(range(1, n + 1)):
+        missing = sorted(set(range(1, n + 1)) - set(shards))
+        duplicated = sorted(set(k for k in shards if shards.count(k) > 1))
+        raise ValueError("expected shards 1..{0}; missing {1}, duplicated {2}".format(n, missing, duplicated))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='merge the partial states of genFcWsLoadFiles --shard runs into FireCloud workspace load files')
+    parser.add_argument("partial_states", help="partial state files (<manifest>.shard<k>of<N>{0})".format(sharding.PARTIAL_STATE_SUFFIX),
+                        nargs="+")
+    parser.add_argument("-o", "--output", help="basename of the load files (default: the sharded manifest's basename)")
+    parser.add_argument("-c", "--all_cases", help="create participant entities for all referenced cases", action="store_true")
+    parser.add_argument("-m", "--metadata_cache", help="SQLite file caching GDC metadata responses; may be shared between runs")
+    parser.add_argument("-k", "--chunk_size", help="split each load file into chunks of at most this many rows", type=int)
+    parser.add_argument("-z", "--gzip", help="gzip-compress the entity and membership load files", action="store_true")
+    parser.add_argument("-s", "--stats", help="write run performance statistics (JSON) to this file")
+    parser.add_argument("--download_batch_gb", help="also split the entities of each file attribute into membership sets <set>__batchNNN of about this many GB of files each, for downloading in balanced batches",
+                        type=float)
+    parser.add_argument("--gdc_api_root", help="root URL of the GDC API", default=fc_loadfiles.GDC_API_ROOT)
+    args = parser.parse_args()
+    if args.chunk_size is not None and args.chunk_size < 1:
+        parser.error("--chunk_size must be at least 1")
+    if args.download_batch_gb is not None and args.download_batch_gb <= 0:
+        parser.error("--download_batch_gb must be positive")
+    batch_bytes = int(args.download_batch_gb * 2**30) if args.download_batch_gb is not None else None
+
+    run_stats = fc_loadfiles.RUN_STATS
+    if args.metadata_cache is not None:
+        fc_loadfiles.MetadataRetriever.cache = gdc_metadatacache.MetadataCache(args.metadata_cache)
+    gdc_api_root = args.gdc_api_root
+
+    with run_stats.phase('read_partial_states'):
+        states = [sharding.read_partial_state(filename) for filename in args.partial_states]
+    try:
+        check_shards(states)
+    except ValueError as x:
+        parser.error(str(x))
+    manifestFileBasename = args.output if args.output is not None else states[0]['manifest']
+
+    cases = dict()
+    samples = dict()
+    pairs = dict()
+    deferred = []
+    file_sizes = dict()
+    with run_stats.phase('merge'):
+        for state in sorted(states, key=lambda state: state['shard'][0]):
+            merge_entities(gdc_api_root, cases, state['cases'])
+            merge_entities(gdc_api_root, samples, state['samples'])
+            merge_entities(gdc_api_root, pairs, state['pairs'])
+            deferred += state['deferred']
+            # partial states written before file sizes were recorded have none
+            file_sizes.update(state.get('file_sizes', {}))
+    deferred.sort()
+    for _, file_uuid, _, _, num_cases in deferred:
+        fc_loadfiles.DEFERRED_FILE_NUM_OF_CASES[file_uuid] = num_cases
+    run_stats.count('deferred_files', len(deferred))
+    print("merged {0} shards: {1} participants, {2} samples, {3} pairs, {4} deferred files".format(
+        len(states), len(cases), len(samples), len(pairs), len(deferred)))
+
+    print("Processing deferred files...")
+    with run_stats.phase('deferred_pass'):
+        for _, file_uuid, filename, file_url, _ in deferred:
+            print("{0}, {1} ".format(file_uuid, filename))
+            for attempt in range(5):
+                try:
+                    fc_loadfiles.process_deferred_file_uuid(gdc_api_root, file_uuid, filename, file_url, cases, samples, args.all_cases)
+                except (KeyboardInterrupt, SystemExit):
+                    raise
+                except Exception as x:
+                    print(''.join(traceback.format_exception(type(x), x, x.__traceback__)))
+                    print("attempt=", attempt, 'file uuid = ', file_uuid)
+                    run_stats.count('retries')
+                    with run_stats.phase('retry_sleep'):
+                        time.sleep((attempt+1)**2)
+                else:
+                    break
+            else:
+                print("failed 5 attempts! SKIPPING FILE: file uuid = ", file_uuid)
+                run_stats.count('failed_files')
+
+    with run_stats.phase('write_load_files'):
+        fc_loadfiles.create_participants_file(cases, manifestFileBasename, args.chunk_size, args.gzip, file_sizes, batch_bytes)
+        fc_loadfiles.create_samples_file(samples, manifestFileBasename, args.chunk_size, args.gzip, file_sizes, batch_bytes)
+        if len(pairs) != 0:
+            fc_loadfiles.create_pairs_file(pairs, samples, manifestFileBasename, args.chunk_size, args.gzip, file_sizes, batch_bytes)
+    fc_loadfiles.create_workspace_attributes_file(manifestFileBasename, False)
+
+    if args.stats is not None:
+        run_stats.write(args.stats)
+
+
+if __name__ == '__main__':
+    main()
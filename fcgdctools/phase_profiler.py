@@ -0,0 +1,75 @@
+"""
+Profiling of named run phases.
+
+In 'cpu' mode each profiled phase is run under cProfile and its
+statistics are written to <prefix>.<phase>.prof (open with pstats,
+snakeviz, gprof2dot, ...).  In 'memory' mode tracemalloc traces the
+phase and a snapshot of the allocations still alive at its end is
+written to <prefix>.<phase>.tracemalloc (load with
+tracemalloc.Snapshot.load).
+
+cProfile only observes the thread that enters the phase, and phases
+selected for profiling must not be nested within one another.
+"""
+
+import cProfile
+import tracemalloc
+from contextlib import contextmanager
+
+MODES = ['cpu', 'memory']
+
+
+class PhaseProfiler:
+
+    """Writes one profile artifact per execution of a selected phase
+
+    Attributes:
+        mode (str): 'cpu' or 'memory'
+        prefix (str): path prefix of the profile artifacts
+        phases (set): names of the phases to profile
+        artifacts (list): files written so far
+    """
+    def __init__(self, mode, prefix, phases):
+        if mode not in MODES:
+            raise ValueError("unknown profile mode: {0}".format(mode))
+        self.mode = mode
+        self.prefix = prefix
+        self.phases = set(phases)
+        self.artifacts = []
+        self._runs = dict()
+
+    def _artifact_name(self, name):
+        run = self._runs.get(name, 0) + 1
+        self._runs[name] = run
+        suffix = '.prof' if self.mode == 'cpu' else '.tracemalloc'
+        if run == 1:
+            return "{0}.{1}{2}".format(self.prefix, name, suffix)
+        return "{0}.{1}.{2}{3}".format(self.prefix, name, run, suffix)
+
+    @contextmanager
+    def profile(self, name):
+        if name not in self.phases:
+            yield
+            return
+
+        if self.mode == 'cpu':
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+                filename = self._artifact_name(name)
+                profiler.dump_stats(filename)
+                self.artifacts.append(filename)
+        else:
+            tracemalloc.start(25)
+            try:
+                yield
+            finally:
+                snapshot = tracemalloc.take_snapshot()
+                tracemalloc.stop()
+                filename = self._artifact_name(name)
+                snapshot.dump(filename)
+                self.artifacts.append(filename)
+        print("wrote {0} profile of phase {1} to {2}".format(self.mode, name, filename))
@@ -0,0 +1,103 @@
+"""
+Progress and throughput metrics in the Prometheus text exposition format.
+
+The metrics are written to a textfile, at most once per interval, so that
+a node exporter's textfile collector can scrape them from long batch-node
+runs.  The file is replaced atomically, as the collector requires.
+"""
+
+import os
+import time
+
+METRIC_PREFIX = "fcgdctools_"
+
+
+def _format_value(value):
+    if value != value:
+        # the exposition format spells not-a-number as NaN
+        return "NaN"
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class ProgressMetrics:
+
+    """Tracks progress through the phases of a run and writes it as a metrics textfile
+
+    Attributes:
+        textfile (str): path of the metrics file (should end in .prom)
+        run_stats (RunStats): source of the GDC request counters
+        interval (float): minimum number of seconds between rewrites of the file
+    """
+    def __init__(self, textfile, run_stats, interval=15):
+        self.textfile = textfile
+        self.run_stats = run_stats
+        self.interval = interval
+        self.start_time = time.time()
+        self.phase = None
+        self.phase_start = None
+        self.total = 0
+        self.processed = 0
+        self.failed = 0
+        self.queue_depths = dict()
+        self._last_write = 0
+
+    def start_phase(self, phase, total):
+        self.phase = phase
+        self.phase_start = time.time()
+        self.total = total
+        self.processed = 0
+        self.failed = 0
+        self.update()
+
+    def file_done(self, failed=False):
+        self.processed += 1
+        if failed:
+            self.failed += 1
+        self.update()
+
+    def set_queue_depth(self, queue, depth):
+        self.queue_depths[queue] = depth
+
+    def update(self, force=False):
+        """Rewrite the metrics file if the interval has elapsed (or force is set)."""
+        now = time.time()
+        if not force and now - self._last_write < self.interval:
+            return
+        self._last_write = now
+        self._write(now)
+
+    def _write(self, now):
+        elapsed = now - self.phase_start if self.phase_start is not None else 0
+        rate = self.processed / elapsed if elapsed > 0 else 0.0
+        remaining = self.total - self.processed
+        eta = remaining / rate if rate > 0 else float('nan')
+        requests, request_errors, in_flight = self.run_stats.request_totals()
+
+        phase_label = '{{phase="{0}"}}'.format(self.phase)
+        lines = []
+
+        def metric(name, metric_type, help_text, samples):
+            lines.append("# HELP {0}{1} {2}".format(METRIC_PREFIX, name, help_text))
+            lines.append("# TYPE {0}{1} {2}".format(METRIC_PREFIX, name, metric_type))
+            for labels, value in samples:
+                lines.append("{0}{1}{2} {3}".format(METRIC_PREFIX, name, labels, _format_value(value)))
+
+        metric("files_total", "gauge", "Number of files to process in the current phase.", [(phase_label, self.total)])
+        metric("files_processed", "gauge", "Number of files processed in the current phase.", [(phase_label, self.processed)])
+        metric("files_failed", "gauge", "Number of files skipped after exhausting retries in the current phase.", [(phase_label, self.failed)])
+        metric("files_per_second", "gauge", "Processing rate in the current phase.", [(phase_label, rate)])
+        metric("eta_seconds", "gauge", "Estimated time to finish the current phase.", [(phase_label, eta)])
+        metric("gdc_requests_total", "counter", "GDC metadata requests issued.", [('', requests)])
+        metric("gdc_request_errors_total", "counter", "GDC metadata requests that failed.", [('', request_errors)])
+        metric("gdc_request_error_ratio", "gauge", "Fraction of GDC metadata requests that failed.",
+               [('', request_errors / requests if requests > 0 else 0.0)])
+        metric("gdc_requests_in_flight", "gauge", "GDC metadata requests currently outstanding.", [('', in_flight)])
+        metric("queue_depth", "gauge", "Items waiting in each work queue.",
+               [('{{queue="{0}"}}'.format(queue), depth) for queue, depth in sorted(self.queue_depths.items())])
+        metric("run_start_time_seconds", "gauge", "Unix time at which the run started.", [('', self.start_time)])
+        metric("last_update_time_seconds", "gauge", "Unix time of the last metrics update.", [('', now)])
+
+        tmp_filename = self.textfile + '.tmp'
+        with open(tmp_filename, 'w') as fp:
+            fp.write("\n".join(lines) + "\n")
+        os.replace(tmp_filename, self.textfile)
@@ -0,0 +1,172 @@
+"""
+Adaptive timeouts and hedged GET requests for GDC metadata retrieval.
+
+Latencies are tracked per request key (the field set requested), over a
+window of recent successful requests.  Timeouts follow the observed tail
+latency instead of being fixed.  With hedging enabled, a request still
+outstanding after the observed p95 latency for its key is duplicated and
+the first response to arrive is used; a budget caps the duplicates at a
+fraction of all requests.  A duplicate that is still waiting for a worker
+when the other request succeeds is not sent.
+"""
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+
+
+class HedgeCancelled(Exception):
+    """A duplicate request was not sent: the other request had already succeeded."""
+
+
+class LatencyWindow:
+
+    """Recent request latencies of one key, with cached percentiles"""
+
+    def __init__(self, size=1000, refresh=20):
+        self.latencies = deque(maxlen=size)
+        self.refresh = refresh
+        self._since_refresh = 0
+        self._sorted = []
+
+    def add(self, seconds):
+        self.latencies.append(seconds)
+        self._since_refresh += 1
+        if self._since_refresh >= self.refresh or len(self.latencies) <= self.refresh:
+            # sorting the whole window for every sample would dominate the cost of tracking
+            self._sorted = sorted(self.latencies)
+            self._since_refresh = 0
+
+    def __len__(self):
+        return len(self.latencies)
+
+    def percentile(self, pct):
+        if not self._sorted:
+            return None
+        index = min(len(self._sorted) - 1, int(round(pct / 100.0 * (len(self._sorted) - 1))))
+        return self._sorted[index]
+
+
+class HedgedRequester:
+
+    """Issues GET requests with adaptive timeouts and, optionally, hedging
+
+    Attributes:
+        hedge (bool): duplicate requests that are slower than the p95 latency
+        max_extra (float): the most duplicates allowed, as a fraction of all requests
+        run_stats (RunStats): optional; counts hedged requests and the requests they won
+        initial_timeout (float): timeout until min_samples latencies are known for a key
+        min_timeout, max_timeout (float): bounds of the adaptive timeout
+        timeout_factor (float): the adaptive timeout is this multiple of the p99 latency
+        min_samples (int): latencies needed for a key before its timeout adapts and it is hedged
+        session (requests.Session): optional; issues the requests, reusing its connections
+    """
+    def __init__(self, hedge=True, max_extra=0.05, run_stats=None, initial_timeout=5.0, min_timeout=2.0, max_timeout=30.0,
+                 timeout_factor=4.0, min_samples=20, max_workers=64, session=None):
+        self.hedge = hedge
+        self.max_extra = max_extra
+        self.run_stats = run_stats
+        self.initial_timeout = initial_timeout
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.timeout_factor = timeout_factor
+        self.min_samples = min_samples
+        self.session = session
+        self._windows = dict()
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._hedges = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='gdc-request')
+
+    def _window(self, key):
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None:
+                window = self._windows[key] = LatencyWindow()
+            return window
+
+    def timeout(self, key):
+        """The timeout for a request of key: timeout_factor times its p99 latency, within bounds."""
+        window = self._window(key)
+        with self._lock:
+            if len(window) < self.min_samples:
+                return self.initial_timeout
+            return min(self.max_timeout, max(self.min_timeout, self.timeout_factor * window.percentile(99)))
+
+    def hedge_delay(self, key):
+        """Seconds after which a request of key is hedged, or None if it may not be."""
+        if not self.hedge:
+            return None
+        window = self._window(key)
+        with self._lock:
+            if len(window) < self.min_samples:
+                return None
+            return max(0.01, window.percentile(95))
+
+    def _take_hedge(self):
+        with self._lock:
+            if self._hedges + 1 > self.max_extra * self._requests:
+                return False
+            self._hedges += 1
+            return True
+
+    def _count(self, name):
+        if self.run_stats is not None:
+            self.run_stats.count(name)
+
+    def _get(self, url, key, timeout, answered=None):
+        if answered is not None and answered.is_set():
+            raise HedgeCancelled(url)
+        start = time.time()
+        getter = self.session if self.session is not None else requests
+        response = getter.get(url, headers=None, timeout=timeout)
+        response.raise_for_status()
+        if answered is not None:
+            answered.set()
+        window = self._window(key)
+        with self._lock:
+            window.add(time.time() - start)
+        return response
+
+    def get(self, url, key):
+        """GET url, hedging if it is slow; returns the first successful response (or raises the first error)."""
+        with self._lock:
+            self._requests += 1
+        timeout = self.timeout(key)
+        delay = self.hedge_delay(key)
+        if delay is None:
+            return self._get(url, key, timeout)
+
+        # set by the first successful request, so that a duplicate that has not been sent yet is not sent at all
+        answered = threading.Event()
+        primary = self._executor.submit(self._get, url, key, timeout, answered)
+        done, _ = wait([primary], timeout=delay)
+        if done or not self._take_hedge():
+            return primary.result()
+
+        self._count('hedged_requests')
+        hedge = self._executor.submit(self._get, url, key, timeout, answered)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        self._count('hedged_requests_won')
+                    # a request in flight is left to finish (or time out) on its own
+                    for other in pending:
+                        other.cancel()
+                    return future.result()
+                if error is None:
+                    error = future.exception()
+        raise error
+
+    def summary(self):
+        """Current timeouts and hedge delays per key, for the run statistics."""
+        keys = list(self._windows)
+        return {'requests': self._requests, 'hedged': self._hedges,
+                'keys': {key: {'timeout': self.timeout(key), 'hedge_delay': self.hedge_delay(key)} for key in keys}}
@@ -0,0 +1,263 @@
+"""
+Dry-run planning of a genFcWsLoadFiles run (genFcWsLoadFiles --plan).
+
+Without fetching any metadata, plan_run() works out what a run over a
+manifest would cost:
+
+  - the GDC requests it would make, by field set: in the file-centric
+    modes, one request for each file's file-level metadata and one for
+    its case (and sample) metadata, less the responses already in the
+    metadata cache; in the case-centric mode, one bulk query per batch
+    of files and of cases
+  - the metadata cache hit rate of those lookups
+  - how many of the files the uuid resolver has a URL for.
+
+Some requests depend on metadata not yet retrieved: which case fields
+a file needs (unless its file-level metadata is cached), which files are
+associated with multiple cases and so are fetched again in the deferred
+pass, and which files are replicates whose aliquots are looked up.
+These are estimated from the --stats files of earlier runs (RunHistory),
+which also provide the request latencies and the time spent per file
+outside of requests for the runtime estimate.
+"""
+
+import json
+import math
+
+from fcgdctools import fc_loadfiles
+from fcgdctools import gdc_bulk
+
+# the field sets of the file-centric requests
+FILE_FIELDS = fc_loadfiles.FileMetadataRetriever(None).fields
+CASE_FIELDS = fc_loadfiles.CaseMetadataRetriever(None).fields
+CASE_SAMPLE_FIELDS = fc_loadfiles.CaseSampleMetadataRetriever(None).fields
+# case metadata requests whose field set is decided by file-level metadata that is not cached
+PENDING_CASE_FIELDS = "cases.* (fields chosen from the file metadata)"
+
+
+class RunHistory:
+
+    """Request and throughput statistics aggregated from earlier runs' --stats files
+
+    Attributes:
+        runs (int): number of runs
+        files (int): manifest files processed by the runs
+        deferred_files (int): files of the runs associated with multiple cases
+        requests (dict): field set -> [number of requests, total seconds]
+        overhead_seconds (float): run time not accounted for by waiting on requests
+        concurrency (float): the highest mean number of requests in flight a run achieved
+    """
+    def __init__(self):
+        self.runs = 0
+        self.files = 0
+        self.deferred_files = 0
+        self.requests = dict()
+        self.overhead_seconds = 0.0
+        self.concurrency = 1.0
+
+    @classmethod
+    def load(cls, filenames):
+        history = cls()
+        for filename in filenames:
+            with open(filename) as fp:
+                history.add(json.load(fp))
+        return history
+
+    def add(self, stats):
+        """Add the statistics (as written by RunStats.write) of one run."""
+        files = stats['counters'].get('manifest_files', 0)
+        if files == 0:
+            return
+        self.runs += 1
+        self.files += files
+        self.deferred_files += stats['counters'].get('deferred_files', 0)
+        request_seconds = 0.0
+        for fields, entry in stats['requests'].items():
+            totals = self.requests.setdefault(fields, [0, 0.0])
+            totals[0] += entry['count']
+            totals[1] += entry['total_seconds']
+            request_seconds += entry['total_seconds']
+        # the mean number of requests in flight while the metadata was retrieved (Little's law)
+        pass_seconds = sum(stats['phases'].get(name, {}).get('seconds', 0.0)
+                           for name in ('main_pass', 'deferred_pass', 'bulk_retrieval'))
+        concurrency = max(1.0, request_seconds / pass_seconds) if pass_seconds > 0 else 1.0
+        self.concurrency = max(self.concurrency, concurrency)
+        self.overhead_seconds += max(0.0, stats['wall_seconds'] - request_seconds / concurrency)
+
+    def rate(self, fields):
+        """Requests with fields per manifest file."""
+        return self.requests.get(fields, [0])[0] / self.files if self.files else 0.0
+
+    def deferred_rate(self):
+        return self.deferred_files / self.files if self.files else 0.0
+
+    def latency(self, fields):
+        """Mean seconds per request with fields (for unseen fields, over all requests), or None."""
+        count, seconds = self.requests.get(fields, (0, 0.0))
+        if count == 0:
+            count = sum(totals[0] for totals in self.requests.values())
+            seconds = sum(totals[1] for totals in self.requests.values())
+        return seconds / count if count else None
+
+    def overhead_per_file(self):
+        return self.overhead_seconds / self.files if self.files else None
+
+
+def _case_fields(data_category, data_type, deferred=False):
+    # the choice fetch_file_metadata makes
+    if data_category in (fc_loadfiles.GDC_DataCategory.CLINICAL, fc_loadfiles.GDC_DataCategory.BIOSPECIMEN):
+        if data_type == fc_loadfiles.GDC_DataType.SLIDE_IMAGE and not deferred:
+            return CASE_SAMPLE_FIELDS
+        return CASE_FIELDS
+    return CASE_SAMPLE_FIELDS
+
+
+def _file_centric_requests(file_uuids, cache, history):
+    """Return (requests by field set, cache lookups, cache hits) of the main and deferred passes."""
+    requests = dict()
+    lookups = hits = 0
+
+    def add(fields, n=1):
+        if n > 0:
+            requests[fields] = requests.get(fields, 0) + n
+
+    if cache is None:
+        add(FILE_FIELDS, len(file_uuids))
+        add(PENDING_CASE_FIELDS, len(file_uuids))
+        deferred = round(len(file_uuids) * history.deferred_rate()) if history is not None else 0
+        # without the cache, a deferred file's metadata is retrieved again
+        add(FILE_FIELDS, deferred)
+        add(PENDING_CASE_FIELDS, deferred)
+        return requests, None, None
+
+    cached_files = cache.get_many(FILE_FIELDS, file_uuids)
+    lookups += len(file_uuids)
+    hits += len(cached_files)
+    add(FILE_FIELDS, len(file_uuids) - len(cached_files))
+    unknown = len(file_uuids) - len(cached_files)
+
+    # files whose case fields are known, by field set
+    by_case_fields = dict()
+    for file_uuid, data in cached_files.items():
+        if any(name not in data for name in ('data_category', 'data_type', 'data_format', 'access')) or not data.get('cases'):
+            # fetch_file_metadata does not retrieve the cases of such files
+            continue
+        fields = _case_fields(data['data_category'], data['data_type'])
+        by_case_fields.setdefault(fields, []).append(file_uuid)
+    deferred_by_case_fields = dict()
+    for fields, uuids in by_case_fields.items():
+        cached_cases = cache.get_many(fields, uuids)
+        lookups += len(uuids)
+        hits += len(cached_cases)
+        add(fields, len(uuids) - len(cached_cases))
+        for file_uuid, data in cached_cases.items():
+            if len(data.get('cases', [])) > 1:
+                file_data = cached_files[file_uuid]
+                deferred_fields = _case_fields(file_data['data_category'], file_data['data_type'], deferred=True)
+                deferred_by_case_fields.setdefault(deferred_fields, []).append(file_uuid)
+        # whether files with uncached case metadata are deferred is not known
+        unknown += len(uuids) - len(cached_cases)
+
+    add(PENDING_CASE_FIELDS, len(file_uuids) - len(cached_files))
+    lookups += len(file_uuids) - len(cached_files)
+    # a deferred file's file-level metadata is in the cache by then
+    for fields, uuids in deferred_by_case_fields.items():
+        lookups += 2 * len(uuids)
+        hits += len(uuids)
+        cached = cache.get_many(fields, uuids)
+        hits += len(cached)
+        add(fields, len(uuids) - len(cached))
+    if history is not None:
+        add(PENDING_CASE_FIELDS, round(unknown * history.deferred_rate()))
+    return requests, lookups, hits
+
+
+def resolver_tsv_uuids(tsv_filename, file_uuids):
+    """Return those of file_uuids that the uuid resolver TSV file maps to a URL, without building its store."""
+    wanted = set(file_uuids)
+    known = set()
+    with open(tsv_filename) as f:
+        for line in f:
+            uuid_url_pair = line.rstrip().split('\t')
+            if len(uuid_url_pair) > 1 and uuid_url_pair[0] in wanted:
+                known.add(uuid_url_pair[0])
+    return known
+
+
+def plan_run(items, cache=None, known_urls=None, case_centric=False, batch_size=gdc_bulk.BULK_BATCH_SIZE,
+             concurrency=1, history=None):
+    """Return the plan (a JSON-serializable dict) of a run over the manifest items.
+
+    cache is the run's gdc_metadatacache.MetadataCache, known_urls the set of
+    the items' uuids the uuid resolver knows (None without a resolver),
+    concurrency the number of requests the run keeps in flight and history
+    an optional RunHistory.
+    """
+    file_uuids = [item['id'] for item in items]
+    if case_centric:
+        # the case-centric mode queries the GDC in bulk, without the metadata cache
+        file_batches = int(math.ceil(len(file_uuids) / float(batch_size)))
+        case_ratio = 1.0
+        if history is not None and history.requests.get(gdc_bulk.FILE_FIELDS, [0])[0] > 0:
+            case_ratio = history.requests.get(gdc_bulk.CASE_FIELDS, [0])[0] / float(history.requests[gdc_bulk.FILE_FIELDS][0])
+        requests = {gdc_bulk.FILE_FIELDS: file_batches, gdc_bulk.CASE_FIELDS: int(math.ceil(file_batches * case_ratio))}
+        lookups = hits = None
+        known_kinds = set(requests)
+    else:
+        requests, lookups, hits = _file_centric_requests(file_uuids, cache, history)
+        known_kinds = {FILE_FIELDS, CASE_FIELDS, CASE_SAMPLE_FIELDS, PENDING_CASE_FIELDS}
+    if history is not None:
+        # requests depending on the model, such as those for the aliquots of replicates
+        for fields in history.requests:
+            if fields not in known_kinds and fields not in (gdc_bulk.FILE_FIELDS, gdc_bulk.CASE_FIELDS):
+                n = round(len(file_uuids) * history.rate(fields))
+                if cache is not None and not case_centric and n > 0:
+                    cached = min(n, len(cache.get_many(fields, file_uuids)))
+                    lookups += n
+                    hits += cached
+                    n -= cached
+                if n > 0:
+                    requests[fields] = n
+
+    estimated_seconds = None
+    if history is not None and history.runs > 0 and history.latency(FILE_FIELDS) is not None:
+        pending_latency = history.latency(CASE_SAMPLE_FIELDS)
+        request_seconds = sum(n * (pending_latency if fields == PENDING_CASE_FIELDS else history.latency(fields))
+                              for fields, n in requests.items())
+        # runs rarely keep all their fetchers busy; assume no more concurrency than the earlier runs achieved
+        concurrency = min(concurrency, history.concurrency)
+        estimated_seconds = request_seconds / concurrency + len(file_uuids) * history.overhead_per_file()
+
+    return {'files': len(file_uuids),
+            'mode': 'case_centric' if case_centric else 'file_centric',
+            'requests': requests,
+            'total_requests': sum(requests.values()),
+            'metadata_cache': None if lookups is None else
+                {'lookups': lookups, 'hits': hits, 'hit_ratio': hits / float(lookups) if lookups else None},
+            'resolver': None if known_urls is None else
+                {'resolved': len(known_urls), 'unresolved': len(file_uuids) - len(known_urls)},
+            'concurrency': concurrency,
+            'history_runs': history.runs if history is not None else 0,
+            'estimated_seconds': estimated_seconds}
+
+
+def format_plan(plan):
+    """The plan as lines of text."""
+    lines = ["plan for {0} files ({1} retrieval):".format(plan['files'], plan['mode'].replace('_', '-'))]
+    if plan['resolver'] is not None:
+        lines.append("  uuid resolver: {0} files have a URL, {1} do not".format(
+            plan['resolver']['resolved'], plan['resolver']['unresolved']))
+    cache = plan['metadata_cache']
+    if cache is not None:
+        ratio = cache['hit_ratio']
+        lines.append("  metadata cache: {0} of {1} lookups hit ({2})".format(
+            cache['hits'], cache['lookups'], "{0:.1%}".format(ratio) if ratio is not None else "n/a"))
+    lines.append("  expected GDC requests: {0}".format(plan['total_requests']))
+    for fields, n in sorted(plan['requests'].items(), key=lambda item: -item[1]):
+        lines.append("    {0:>9}  {1}".format(n, fields))
+    if plan['estimated_seconds'] is not None:
+        lines.append("  estimated runtime: {0:.0f} s at {1:.1f} request(s) in flight on average (from {2} earlier runs)".format(
+            plan['estimated_seconds'], plan['concurrency'], plan['history_runs']))
+    else:
+        lines.append("  no runtime estimate: give the --stats files of earlier runs with --plan_history")
+    return lines
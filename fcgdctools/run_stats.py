@@ -0,0 +1,126 @@
+"""
+Per-run performance statistics for genFcWsLoadFiles.
+
+RunStats accumulates wall time per named phase, GDC request counts and
+latencies per field set, named event counters (retries, failures, cache
+hits, ...) and collision counts per attribute.  The collected statistics
+are written as JSON so that runs can be compared over time.
+"""
+
+import json
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+
+def _percentile(sorted_values, pct):
+    if len(sorted_values) == 0:
+        return None
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def peak_rss_bytes():
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in kilobytes on Linux and in bytes on macOS
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+class RunStats:
+
+    """Statistics collected during a run; safe to update from several threads.
+
+    If profiler (a phase_profiler.PhaseProfiler) is set, phases it selects are also profiled.
+    """
+
+    def __init__(self):
+        self.profiler = None
+        self._lock = threading.Lock()
+        self.start_time = time.time()
+        self.phases = dict()
+        self.requests = dict()
+        self.counters = dict()
+        self.collisions = dict()
+        self.reports = dict()
+
+    @contextmanager
+    def phase(self, name):
+        """Context manager adding the wall time spent in the block to phase name."""
+        start = time.time()
+        try:
+            if self.profiler is not None:
+                with self.profiler.profile(name):
+                    yield
+            else:
+                yield
+        finally:
+            elapsed = time.time() - start
+            with self._lock:
+                seconds, calls = self.phases.get(name, (0.0, 0))
+                self.phases[name] = (seconds + elapsed, calls + 1)
+
+    def request_started(self):
+        self.count('requests_in_flight')
+
+    def record_request(self, fields, seconds, ok=True):
+        """Record a completed request (one that was announced with request_started)."""
+        with self._lock:
+            self.counters['requests_in_flight'] = self.counters.get('requests_in_flight', 0) - 1
+            entry = self.requests.setdefault(fields, {'latencies': [], 'errors': 0})
+            entry['latencies'].append(seconds)
+            if not ok:
+                entry['errors'] += 1
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def record_collision(self, attribute_name):
+        with self._lock:
+            self.collisions[attribute_name] = self.collisions.get(attribute_name, 0) + 1
+
+    def add_report(self, name, report):
+        """Include report() (JSON-serializable) under name in the statistics, evaluated when they are written."""
+        self.reports[name] = report
+
+    def request_totals(self):
+        """Return (requests, failed requests, requests in flight), without computing percentiles."""
+        with self._lock:
+            requests = sum(len(entry['latencies']) for entry in self.requests.values())
+            errors = sum(entry['errors'] for entry in self.requests.values())
+            return requests, errors, self.counters.get('requests_in_flight', 0)
+
+    def _ratio(self, hits, misses):
+        hits = self.counters.get(hits, 0)
+        total = hits + self.counters.get(misses, 0)
+        return hits / total if total > 0 else None
+
+    def to_dict(self):
+        reports = {name: report() for name, report in self.reports.items()}
+        with self._lock:
+            requests = dict()
+            for fields, entry in self.requests.items():
+                latencies = sorted(entry['latencies'])
+                requests[fields] = {'count': len(latencies),
+                                    'errors': entry['errors'],
+                                    'total_seconds': sum(latencies),
+                                    'p50': _percentile(latencies, 50),
+                                    'p90': _percentile(latencies, 90),
+                                    'p95': _percentile(latencies, 95),
+                                    'p99': _percentile(latencies, 99),
+                                    'max': latencies[-1] if latencies else None}
+            return {'wall_seconds': time.time() - self.start_time,
+                    'phases': {name: {'seconds': seconds, 'calls': calls}
+                               for name, (seconds, calls) in self.phases.items()},
+                    'requests': requests,
+                    'counters': dict(self.counters),
+                    'metadata_cache_hit_ratio': self._ratio('metadata_cache_hits', 'metadata_cache_misses'),
+                    'collisions': dict(self.collisions),
+                    'peak_rss_bytes': peak_rss_bytes(),
+                    'reports': reports}
+
+    def write(self, filename):
+        with open(filename, 'w') as fp:
+            json.dump(self.to_dict(), fp, indent=2, sort_keys=True)
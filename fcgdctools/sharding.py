@@ -0,0 +1,106 @@
+"""
+Partitioning of a manifest across several genFcWsLoadFiles processes.
+
+With --shard k/N, a process handles only the files whose shard key
+hashes to partition k of N.  The key of a file is its (first) case, so
+that all files of a case, and so all of the case's replicates, land on
+the same shard.  The manifest itself names no cases; they are looked up
+with bulk queries of the GDC files endpoint.
+
+Each shard writes its partial entity model to a gzipped JSON state file.
+Files associated with multiple cases cannot be processed until the whole
+model is known; the shard lists them in its state and mergeFcWsLoadFiles
+processes them after combining the shards.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+
+from fcgdctools import gdc_bulk
+from fcgdctools import http_cassette
+
+FORMAT_VERSION = 1
+PARTIAL_STATE_SUFFIX = ".partial.json.gz"
+
+# number of file uuids per bulk case lookup
+LOOKUP_BATCH_SIZE = 500
+# fields of the bulk case lookup
+LOOKUP_FIELDS = 'file_id,cases.case_id'
+
+
+def parse_shard(spec):
+    """Parse "k/N" (1 <= k <= N) into (k, N); raises ValueError."""
+    try:
+        k, n = [int(part) for part in spec.split('/')]
+    except ValueError:
+        raise ValueError("shard must be given as k/N, e.g. 1/4: {0}".format(spec))
+    if n < 1 or not 1 <= k <= n:
+        raise ValueError("shard k/N requires 1 <= k <= N: {0}".format(spec))
+    return k, n
+
+
+def shard_of(key, num_shards):
+    """Return the shard (1..num_shards) of key; stable across processes, platforms and runs."""
+    digest = hashlib.sha1(key.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % num_shards + 1
+
+
+def lookup_file_cases(gdc_api_root, file_uuids, batch_size=LOOKUP_BATCH_SIZE, attempts=5, controller=None, cassette=None):
+    """Return a dict mapping each file uuid to the sorted ids of its cases, using bulk queries.
+
+    With an aimd_controller.AimdController, its batch size is used instead of
+    batch_size, and it observes every query.  With an http_cassette.Cassette,
+    each file's case ids are recorded, or replayed without querying the GDC;
+    a file the GDC did not return is recorded with no cases.
+    """
+    if cassette is not None and cassette.mode == http_cassette.REPLAY:
+        file_cases = dict()
+        for file_uuid in file_uuids:
+            case_ids = cassette.replay(LOOKUP_FIELDS, file_uuid)
+            if case_ids:
+                file_cases[file_uuid] = case_ids
+        return file_cases
+    file_cases = dict()
+    for hit in gdc_bulk.bulk_query(gdc_api_root, 'files', 'file_id', file_uuids, LOOKUP_FIELDS,
+                                   batch_size, attempts, controller):
+        file_cases[hit['file_id']] = sorted(case['case_id'] for case in hit.get('cases', []))
+    if cassette is not None:
+        for file_uuid in file_uuids:
+            cassette.record(LOOKUP_FIELDS, file_uuid, file_cases.get(file_uuid, []))
+    return file_cases
+
+
+def select_shard(manifest_items, shard, num_shards, gdc_api_root, controller=None, cassette=None):
+    """Return the (index, item) pairs of the manifest items belonging to shard.
+
+    A file is keyed by its first case id; a file the GDC reports no cases for
+    is keyed by its own uuid.
+    """
+    file_cases = lookup_file_cases(gdc_api_root, [item['id'] for item in manifest_items], controller=controller,
+                                   cassette=cassette)
+    selected = []
+    for i, item in enumerate(manifest_items):
+        cases = file_cases.get(item['id'])
+        key = cases[0] if cases else item['id']
+        if shard_of(key, num_shards) == shard:
+            selected.append((i, item))
+    return selected
+
+
+def write_partial_state(filename, state):
+    state = dict(state, format_version=FORMAT_VERSION)
+    tmp_filename = filename + '.tmp'
+    with gzip.open(tmp_filename, 'wt') as fp:
+        json.dump(state, fp)
+    # replace atomically, so that a merge never reads a partly written state
+    os.replace(tmp_filename, filename)
+
+
+def read_partial_state(filename):
+    with gzip.open(filename, 'rt') as fp:
+        state = json.load(fp)
+    if state.get('format_version') != FORMAT_VERSION:
+        raise ValueError("{0}: unsupported partial state version {1}".format(filename, state.get('format_version')))
+    return state
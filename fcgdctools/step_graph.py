@@ -0,0 +1,165 @@
+"""
+A small make-style step graph used by ws_builder.
+
+Each step records, in a JSON state file, a fingerprint of its inputs
+(its parameters plus the outputs of the steps it depends on) and a
+fingerprint of the outputs it produced.  Files are fingerprinted by
+content.  When the graph is run again, a step is skipped if its input
+fingerprint is unchanged and its recorded outputs are still intact on disk.
+"""
+
+import hashlib
+import json
+import os
+import time
+
+
+def _file_digest(filename):
+    sha = hashlib.sha256()
+    with open(filename, 'rb') as fp:
+        for block in iter(lambda: fp.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def _digest(obj):
+    return hashlib.sha256(json.dumps(obj, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def fingerprint_outputs(outputs, directory='.'):
+    """Fingerprint a step's outputs; returns None if an output file is missing.
+
+    Outputs are a dict of JSON-serializable values.  The paths listed under
+    the 'files' key (relative to directory) are fingerprinted by content
+    rather than by name.
+    """
+    files = dict()
+    for filename in outputs.get('files', []):
+        path = os.path.join(directory, filename)
+        if not os.path.exists(path):
+            return None
+        files[filename] = _file_digest(path)
+    values = {k: v for k, v in outputs.items() if k != 'files'}
+    return _digest({'files': files, 'values': values})
+
+
+class Step:
+
+    """A single step of a StepGraph
+
+    Attributes:
+        name (str): step name, unique within the graph
+        action (callable): called with a dict mapping each dependency's name to
+            its outputs; returns the step's outputs (see fingerprint_outputs)
+        deps (list): names of steps this step depends on
+        params (dict): JSON-serializable parameters that, when changed,
+            cause the step to be rerun
+        resource (str): name of the shared resource (e.g. a remote service)
+            the step uses; see StepGraph.run
+    """
+    def __init__(self, name, action, deps, params, resource):
+        self.name = name
+        self.action = action
+        self.deps = list(deps)
+        self.params = params
+        self.resource = resource
+
+
+class StepGraph:
+
+    """A DAG of steps whose state persists across runs.
+
+    The state file and the steps' output files are located in directory.
+    After run(), timings maps each step name to a (status, seconds) tuple,
+    where status is 'ran', 'skipped' or 'failed'.
+    """
+
+    def __init__(self, state_filename, directory='.'):
+        self.directory = directory
+        self.state_filename = os.path.join(directory, state_filename)
+        self.steps = []
+        self.state = dict()
+        self.timings = dict()
+        if os.path.exists(self.state_filename):
+            with open(self.state_filename, 'r') as fp:
+                self.state = json.load(fp)
+
+    def add_step(self, name, action, deps=(), params=None, resource=None):
+        # steps may only depend on steps that were added before them,
+        # which keeps the graph acyclic and the insertion order topological
+        known = set(step.name for step in self.steps)
+        if name in known:
+            raise ValueError("duplicate step name: {0}".format(name))
+        for dep in deps:
+            if dep not in known:
+                raise ValueError("step {0} depends on unknown step {1}".format(name, dep))
+        self.steps.append(Step(name, action, deps, params if params is not None else dict(), resource))
+
+    def _save_state(self):
+        tmp_filename = self.state_filename + '.tmp'
+        with open(tmp_filename, 'w') as fp:
+            json.dump(self.state, fp, indent=2, sort_keys=True)
+        os.replace(tmp_filename, self.state_filename)
+
+    def _run_action(self, step, inputs, profiler):
+        if profiler is None:
+            return step.action(inputs)
+        with profiler.profile(step.name):
+            return step.action(inputs)
+
+    def run(self, force=(), limits=None, profiler=None):
+        """Run out-of-date steps in order; steps named in force are always rerun.
+
+        limits optionally maps a resource name to a context manager (e.g. a
+        threading.Semaphore shared between graphs) that is held while a step
+        using that resource runs.  profiler is an optional
+        phase_profiler.PhaseProfiler; steps are profiled as phases named
+        after the step.
+
+        Returns a dict mapping step name to that step's outputs.
+        """
+        results = dict()
+        output_fingerprints = dict()
+        for step in self.steps:
+            inputs = {dep: results[dep] for dep in step.deps}
+            input_fingerprint = _digest({'params': step.params,
+                                         'deps': {dep: output_fingerprints[dep] for dep in step.deps}})
+            recorded = self.state.get(step.name)
+
+            if (step.name not in force and recorded is not None and
+                    recorded['input_fingerprint'] == input_fingerprint and
+                    fingerprint_outputs(recorded['outputs'], self.directory) == recorded['output_fingerprint']):
+                print("Step {0} is up to date; skipping".format(step.name))
+                self.timings[step.name] = ('skipped', 0.0)
+                results[step.name] = recorded['outputs']
+                output_fingerprints[step.name] = recorded['output_fingerprint']
+                continue
+
+            print("Running step {0}".format(step.name))
+            start = time.time()
+            limit = limits.get(step.resource) if limits is not None else None
+            try:
+                if limit is not None:
+                    with limit:
+                        outputs = self._run_action(step, inputs, profiler)
+                else:
+                    outputs = self._run_action(step, inputs, profiler)
+            except Exception:
+                self.timings[step.name] = ('failed', time.time() - start)
+                raise
+            self.timings[step.name] = ('ran', time.time() - start)
+            if outputs is None:
+                outputs = dict()
+            output_fingerprint = fingerprint_outputs(outputs, self.directory)
+            if output_fingerprint is None:
+                raise RuntimeError("step {0} did not produce all of its output files".format(step.name))
+
+            results[step.name] = outputs
+            output_fingerprints[step.name] = output_fingerprint
+            self.state[step.name] = {'input_fingerprint': input_fingerprint,
+                                     'outputs': outputs,
+                                     'output_fingerprint': output_fingerprint}
+            # persist after every step so a failure later on does not discard completed work
+            self._save_state()
+
+        return results
@@ -0,0 +1,255 @@
+"""
+A table-oriented engine assembling the entity model from bulk metadata.
+
+The file-by-file assembly (add_file_to_model and _add_file_attribute)
+redoes the same dict work for every file: it classifies the file's
+cases and samples, derives the attribute name from the file's
+properties and looks the attribute up on its entity.  With the metadata
+retrieved in bulk (genFcWsLoadFiles --case_centric), this engine instead
+lays the manifest out as a FileTable of column arrays and works a column
+at a time:
+
+  - classification: the number of cases and samples of every file, and
+    the tumor/normal class of every distinct sample type, decide whether
+    a file belongs to a participant, a sample or a pair, or is deferred
+  - naming: the attribute names come from the registry of
+    attribute_schema, derived once per kind of file
+  - replicate selection: files are grouped by (entity, attribute name);
+    a group of one file is assigned directly, and only groups of
+    replicates go through the usual selection rules, with the aliquot
+    metadata those rules need prefetched for all replicates in bulk.
+
+The model is identical to the one built file by file, so it feeds the
+same load file writers; as there, the file URLs are filled in once the
+model is complete.  Files associated with multiple cases are left
+to the usual deferred pass.  The rules and state of the file-by-file
+assembly that the engine shares are handed to it by fc_loadfiles as
+ModelRules.
+"""
+
+from fcgdctools import gdc_bulk
+
+# entity kinds
+PARTICIPANT = 'participant'
+SAMPLE = 'sample'
+PAIR = 'pair'
+
+
+class ModelRules:
+
+    """What the engine shares with the file-by-file assembly of fc_loadfiles
+
+    Attributes:
+        schema (attribute_schema.AttributeSchema): registry of the attribute names
+        deferred_num_of_cases (dict): file uuid -> number of cases, of the files left to the deferred pass
+        cache (gdc_metadatacache.MetadataCache): the metadata cache add_file_attribute's replicate
+            selection reads; the aliquot metadata of replicates is prefetched into it
+        sample_type (DataSource): the GDC sample types, with their tumor/normal classification
+        data_category, data_type (class): the GDC_DataCategory and GDC_DataType enumerations
+        aliquot_fields, paired_aliquot_fields (str): the field sets replicate selection retrieves
+        separator (str): separates a file's uuid and filename in its uuid attribute
+        is_paired_data (callable): (data_category, data_type) -> whether the files are associated with pairs
+        image_code_and_portion (callable): slide image filename -> (image code, portion)
+        add_to_known_cases, add_to_known_pairs (callable): add a case or pair to the model, returning its id
+        add_file_attribute (callable): add a file to an entity, selecting among replicates
+    """
+    def __init__(self, schema, deferred_num_of_cases, cache, sample_type, data_category, data_type,
+                 aliquot_fields, paired_aliquot_fields, separator, is_paired_data, image_code_and_portion,
+                 add_to_known_cases, add_to_known_pairs, add_file_attribute):
+        self.schema = schema
+        self.deferred_num_of_cases = deferred_num_of_cases
+        self.cache = cache
+        self.sample_type = sample_type
+        self.data_category = data_category
+        self.data_type = data_type
+        self.aliquot_fields = aliquot_fields
+        self.paired_aliquot_fields = paired_aliquot_fields
+        self.separator = separator
+        self.is_paired_data = is_paired_data
+        self.image_code_and_portion = image_code_and_portion
+        self.add_to_known_cases = add_to_known_cases
+        self.add_to_known_pairs = add_to_known_pairs
+        self.add_file_attribute = add_file_attribute
+
+
+class FileTable:
+
+    """The manifest's files as column arrays, in manifest order
+
+    Attributes:
+        uuid, filename (list of str): one entry per file
+        data_category, data_type, data_format, access, experimental_strategy, workflow_type, program (list):
+            file properties; None where missing
+        case_ids (list of list of str): the file's cases
+        sample_ids (list of list of str): the samples of a single-case file, if its kind of data is associated
+            with samples (as fetch_file_metadata decides); otherwise empty
+        failed (list of bool): no metadata for the file, or its cases or samples
+    """
+    COLUMNS = ['uuid', 'filename', 'data_category', 'data_type', 'data_format', 'access',
+               'experimental_strategy', 'workflow_type', 'program', 'case_ids', 'sample_ids', 'failed']
+
+    def __init__(self):
+        for column in self.COLUMNS:
+            setattr(self, column, [])
+
+    def __len__(self):
+        return len(self.uuid)
+
+    @classmethod
+    def build(cls, items, bulk_metadata, rules):
+        """Lay out manifest items using gdc_bulk.CaseCentricMetadata and the ModelRules rules."""
+        table = cls()
+        with_samples_by_kind = dict()
+        for item in items:
+            hit = bulk_metadata.files.get(item['id'])
+            table.uuid.append(item['id'])
+            table.filename.append(item['filename'])
+            if hit is None:
+                hit = dict()
+            case_ids = [case['case_id'] for case in hit.get('cases', [])]
+            failed = item['id'] not in bulk_metadata.files or any(case_id not in bulk_metadata.cases for case_id in case_ids)
+            program = None
+            if case_ids and not failed:
+                program = bulk_metadata.cases[case_ids[0]].get('project', {}).get('program', {}).get('name')
+            table.data_category.append(hit.get('data_category'))
+            table.data_type.append(hit.get('data_type'))
+            table.data_format.append(hit.get('data_format'))
+            table.access.append(hit.get('access'))
+            table.experimental_strategy.append(hit.get('experimental_strategy'))
+            table.workflow_type.append(hit.get('analysis', {}).get('workflow_type'))
+            table.program.append(program)
+            table.case_ids.append(case_ids)
+
+            kind = (hit.get('data_category'), hit.get('data_type'))
+            with_samples = with_samples_by_kind.get(kind)
+            if with_samples is None:
+                # the same choice of case fields as fetch_file_metadata makes
+                with_samples = with_samples_by_kind[kind] = (
+                    kind[0] not in (rules.data_category.CLINICAL, rules.data_category.BIOSPECIMEN)
+                    or kind[1] == rules.data_type.SLIDE_IMAGE)
+            sample_ids = []
+            if with_samples and len(case_ids) == 1:
+                sample_ids = [sample['sample_id'] for sample in hit['cases'][0].get('samples', [])]
+                failed = failed or any(sample_id not in bulk_metadata.samples for sample_id in sample_ids)
+            table.sample_ids.append(sample_ids)
+            table.failed.append(failed)
+        return table
+
+
+def _file_attributes(table, rows, rules):
+    """The attribute_schema.FileAttribute of each of rows, from the registry of the rules."""
+    attributes = dict()
+    for i in rows:
+        image_code = None
+        if table.data_type[i] == rules.data_type.SLIDE_IMAGE:
+            image_code, _ = rules.image_code_and_portion(table.filename[i])
+        attributes[i] = rules.schema.attribute(table.experimental_strategy[i], table.workflow_type[i],
+                                               table.data_type[i], table.data_format[i], image_code)
+    return attributes
+
+
+def _prefetch_replicate_metadata(gdc_api_root, table, groups, rules, controller=None, run_stats=None):
+    """Retrieve, in bulk, the aliquot metadata replicate selection will look up for the replicates, into the cache."""
+    uuids_by_fields = dict()
+    for rows in groups:
+        if len(rows) < 2 or table.data_type[rows[0]] == rules.data_type.SLIDE_IMAGE:
+            # slide images are chosen by the portion in their filename
+            continue
+        if rules.is_paired_data(table.data_category[rows[0]], table.data_type[rows[0]]):
+            fields = rules.paired_aliquot_fields
+        else:
+            fields = rules.aliquot_fields
+        uuids_by_fields.setdefault(fields, []).extend(table.uuid[i] for i in rows)
+    for fields, uuids in uuids_by_fields.items():
+        for hit in gdc_bulk.bulk_query(gdc_api_root, 'files', 'file_id', uuids, 'file_id,' + fields,
+                                       controller=controller, run_stats=run_stats):
+            file_uuid = hit.pop('file_id')
+            hit.pop('id', None)
+            rules.cache.put(fields, file_uuid, hit)
+
+
+def assemble(gdc_api_root, table, bulk_metadata, known_cases, known_samples, known_pairs, deferred_file_uuids,
+             rules, run_stats, controller=None, progress=None):
+    """Add the files of table to the entity model, as add_file_to_model would one by one, following the ModelRules rules."""
+    num_failed = 0
+    rows = []
+    for i in range(len(table)):
+        if table.failed[i]:
+            print("no metadata for file {0}; SKIPPING FILE".format(table.uuid[i]))
+            num_failed += 1
+        elif None in (table.data_category[i], table.data_type[i], table.data_format[i], table.access[i], table.program[i]) \
+                or not table.case_ids[i]:
+            # we expect all files to have at least a data_category, data_type, access type and program assigned to them
+            print("SKIPPING FILE: file uuid = {0}, file name = {1}".format(table.uuid[i], table.filename[i]))
+        elif len(table.case_ids[i]) > 1:
+            rules.deferred_num_of_cases[table.uuid[i]] = len(table.case_ids[i])
+            deferred_file_uuids.append([table.uuid[i], table.filename[i]])
+        else:
+            rows.append(i)
+
+    # classification: the tumor/normal class of each distinct sample type
+    classes = dict()
+    for sample in bulk_metadata.samples.values():
+        sample_type_id = sample.get('sample_type_id')
+        if sample_type_id not in classes:
+            try:
+                classes[sample_type_id] = rules.sample_type.getTumorNormalClassification(sample_type_id)
+            except KeyError:
+                classes[sample_type_id] = None
+
+    # the entities, created in manifest order; each file is assigned its entity
+    entity_of_row = dict()
+    for i in rows:
+        case = bulk_metadata.cases[table.case_ids[i][0]]
+        case_id = rules.add_to_known_cases(case, known_cases)
+        sample_ids = table.sample_ids[i]
+        for sample_id in sample_ids:
+            sample = bulk_metadata.samples[sample_id]
+            if sample_id not in known_samples:
+                known_samples[sample_id] = {'submitter_id': sample['submitter_id'],
+                                            'sample_type_id': sample.get('sample_type_id'), 'case_id': case_id}
+        sample_classes = [classes[bulk_metadata.samples[sample_id].get('sample_type_id')] for sample_id in sample_ids]
+        if len(sample_ids) == 0:
+            entity_of_row[i] = (PARTICIPANT, case_id)
+        elif None in sample_classes:
+            print("unknown sample type; SKIPPING FILE: file uuid = {0}".format(table.uuid[i]))
+            num_failed += 1
+        elif len(sample_ids) == 1:
+            entity_of_row[i] = (SAMPLE, sample_ids[0])
+        elif len(sample_ids) == 2 and sample_classes[0] != sample_classes[1]:
+            if sample_classes[0] == rules.sample_type.TUMOR:
+                tumor_sample_id, normal_sample_id = sample_ids
+            else:
+                normal_sample_id, tumor_sample_id = sample_ids
+            entity_of_row[i] = (PAIR, rules.add_to_known_pairs(tumor_sample_id, normal_sample_id, known_pairs))
+        else:
+            # not a tumor/normal pair, or more than two samples
+            print("{0} samples, not a tumor/normal pair; SKIPPING FILE: file uuid = {1}".format(len(sample_ids), table.uuid[i]))
+            num_failed += 1
+
+    # replicate selection: group the files by (entity, attribute name), in order of first appearance
+    attributes = _file_attributes(table, [i for i in rows if i in entity_of_row], rules)
+    groups = dict()
+    for i in rows:
+        if i in entity_of_row:
+            groups.setdefault(entity_of_row[i] + (attributes[i],), []).append(i)
+
+    with run_stats.phase('replicate_prefetch'):
+        _prefetch_replicate_metadata(gdc_api_root, table, groups.values(), rules, controller, run_stats)
+
+    stores = {PARTICIPANT: known_cases, SAMPLE: known_samples, PAIR: known_pairs}
+    for (kind, entity_id, attribute), group_rows in groups.items():
+        entity = stores[kind][entity_id]
+        first = group_rows[0]
+        entity[attribute.uuid_name] = table.uuid[first] + rules.separator + table.filename[first]
+        entity[attribute.url_name] = None
+        for i in group_rows[1:]:
+            rules.add_file_attribute(gdc_api_root, entity_id, entity, table.uuid[i], table.filename[i], None,
+                                     table.data_category[i], table.data_type[i], table.data_format[i],
+                                     table.experimental_strategy[i], table.workflow_type[i], table.access[i],
+                                     table.program[i])
+
+    run_stats.count('failed_files', num_failed)
+    if progress is not None:
+        for i in range(len(table)):
+            progress.file_done(table.failed[i])
@@ -0,0 +1,132 @@
+import argparse
+import csv
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from ws_builder import build_workspace_graph, cohort_dir_name, STEP_NAMES
+
+
+def read_cohort_spec(spec_file, defaults):
+    """Read a TSV cohort spec file.
+
+    The file must have project_name and cohort_name columns; optional auth_domain and
+    ws_suffix columns override the corresponding command line values for that row.
+    """
+    cohorts = []
+    with open(spec_file, 'r') as fp:
+        reader = csv.DictReader(fp, delimiter='\t')
+        for row in reader:
+            cohort = dict(defaults)
+            cohort.update({k: v for k, v in row.items() if v})
+            cohorts.append(cohort)
+    return cohorts
+
+
+def parse_cohort_list(cohort_ids, defaults):
+    """Turn identifiers of the form <project>-<cohort> (e.g., TCGA-LUAD) into cohort specs."""
+    cohorts = []
+    for cohort_id in cohort_ids:
+        project_name, cohort_name = cohort_id.split("-", 1)
+        cohort = dict(defaults)
+        cohort.update({'project_name': project_name, 'cohort_name': cohort_name})
+        cohorts.append(cohort)
+    return cohorts
+
+
+def build_cohort(cohort, limits, config_cache, metadata_cache, diff_upload, chunk_size, compress, force):
+    """Run the workspace step graph for one cohort; returns a status record for the report."""
+    work_dir = cohort_dir_name(cohort['project_name'], cohort['cohort_name'], cohort['auth_domain'])
+    record = {'cohort': cohort['project_name'] + "-" + cohort['cohort_name'], 'status': 'ok', 'timings': dict(), 'error': None}
+    start = time.time()
+    try:
+        os.makedirs(work_dir, exist_ok=True)
+        graph = build_workspace_graph(work_dir, cohort['project_name'], cohort['cohort_name'], cohort['billing_project'],
+                                      cohort['ws_suffix'], cohort['auth_domain'], config_cache, metadata_cache, diff_upload,
+                                      chunk_size, compress)
+        try:
+            graph.run(force=force, limits=limits)
+        finally:
+            record['timings'] = graph.timings
+    except (KeyboardInterrupt, SystemExit):
+        raise
+    except Exception as x:
+        print(''.join(traceback.format_exception(type(x), x, x.__traceback__)))
+        record['status'] = 'failed'
+        record['error'] = str(x)
+    record['total'] = time.time() - start
+    return record
+
+
+def print_report(records, wall_time):
+    print("")
+    print("Batch report")
+    header = ['cohort', 'status'] + STEP_NAMES + ['total']
+    print("\t".join(header))
+    for record in records:
+        row = [record['cohort'], record['status']]
+        for step_name in STEP_NAMES:
+            if step_name in record['timings']:
+                status, seconds = record['timings'][step_name]
+                row.append("{0:.1f}s".format(seconds) if status == 'ran' else status)
+            else:
+                row.append('-')
+        row.append("{0:.1f}s".format(record['total']))
+        print("\t".join(row))
+    for record in records:
+        if record['error'] is not None:
+            print("{0}: {1}".format(record['cohort'], record['error']))
+    num_failed = sum(1 for record in records if record['status'] != 'ok')
+    print("{0} cohorts, {1} failed, wall time {2:.1f}s".format(len(records), num_failed, wall_time))
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='create FireCloud workspaces for several project + cohort combinations')
+    parser.add_argument("billing_project", help="name of billing project to create the workspaces under. e.g: broad-firecloud-tcga")
+    parser.add_argument("ws_suffix", help="descriptive suffix to add to the workspace auto-generated names. e.g: ControlledAccess_hg38_V1-0_DATA")
+    parser.add_argument("cohorts", nargs="*", help="cohorts to build, as <project>-<cohort>. e.g: TCGA-LUAD TARGET-AML")
+    parser.add_argument("-s", "--spec", help="TSV file with project_name and cohort_name columns (and optional auth_domain and ws_suffix columns)")
+    parser.add_argument("-a", "--auth_domain", help="authorization domain. for dbGaP controlled access the domain name is TCGA-dbGaP-Authorized.", default="")
+    parser.add_argument("-w", "--workers", help="number of cohorts processed concurrently", type=int, default=8)
+    parser.add_argument("--gdc_concurrency", help="maximum number of concurrent GDC steps (manifest download, load file generation)", type=int, default=4)
+    parser.add_argument("--firecloud_concurrency", help="maximum number of concurrent FireCloud steps (workspace creation, uploads, method configs)", type=int, default=2)
+    parser.add_argument("--config_cache", help="directory in which to cache method config templates fetched from the method repository", default=None)
+    parser.add_argument("-m", "--metadata_cache", help="SQLite file caching GDC metadata responses, shared by all cohorts (default: none); entries never expire, so a cache kept from an earlier batch serves its stale metadata", default=None)
+    parser.add_argument("-d", "--diff_upload", help="upload only entities that changed since the last upload (snapshot) or relative to the workspaces' current entities (remote)",
+                        choices=['snapshot', 'remote'], default=None)
+    parser.add_argument("-k", "--chunk_size", help="split each load file into chunks of at most this many rows", type=int, default=None)
+    parser.add_argument("-z", "--gzip", help="gzip-compress the load files", action="store_true")
+    parser.add_argument("-f", "--force", help="rerun the named step even if it is up to date (may be repeated)",
+                        action="append", default=[], choices=STEP_NAMES)
+    args = parser.parse_args()
+    if args.chunk_size is not None and args.chunk_size < 1:
+        parser.error("--chunk_size must be at least 1")
+
+    defaults = {'billing_project': args.billing_project, 'ws_suffix': args.ws_suffix, 'auth_domain': args.auth_domain}
+    cohorts = parse_cohort_list(args.cohorts, defaults)
+    if args.spec is not None:
+        cohorts += read_cohort_spec(args.spec, defaults)
+    if len(cohorts) == 0:
+        parser.error("no cohorts given; list cohorts or use --spec")
+
+    config_cache = os.path.abspath(args.config_cache) if args.config_cache is not None else None
+    metadata_cache = os.path.abspath(args.metadata_cache) if args.metadata_cache is not None else None
+
+    limits = {'gdc': threading.BoundedSemaphore(args.gdc_concurrency),
+              'firecloud': threading.BoundedSemaphore(args.firecloud_concurrency)}
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = [executor.submit(build_cohort, cohort, limits, config_cache, metadata_cache, args.diff_upload,
+                                   args.chunk_size, args.gzip, args.force)
+                   for cohort in cohorts]
+        records = [future.result() for future in futures]
+
+    print_report(records, time.time() - start)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,10 +2,17 @@ import requests
 import json
 import sys
 import argparse
+import copy
 import os
+import subprocess
 import datetime
+from concurrent.futures import ThreadPoolExecutor
 import firecloud.api as api
 from manifest_downloader import build_filter_json, download_manifest
+from step_graph import StepGraph
+import loadfile_io
+import phase_profiler
+import entity_diff
 
 FILE_TYPE_DICT = {
 	"default": ["open"],
@@ -33,10 +40,9 @@ def prepare_workspace_attribute_list(attr_file, auth_domain):
 def list_downloadable_attrs(prefix, entities):
 	downloadable_attr_names = []
 	for ent in entities:
-		filename = prefix + "_" + ent + "s.txt"
-		if os.path.exists(filename):
-			fp = open(filename, 'r')
-			attribute_list = fp.readline().strip().split(":")[1].split("\t")
+		header = loadfile_io.read_header(loadfile_io.find_load_files(prefix + "_" + ent + "s"))
+		if header is not None:
+			attribute_list = header[1:]
 			for attr in attribute_list:
 				if attr.endswith("uuid_and_filename"):
 					downloadable_attr_names.append((attr, ent))
@@ -44,13 +50,69 @@ def list_downloadable_attrs(prefix, entities):
 	return downloadable_attr_names
 
 
-def create_method_configs(billing_project, ws_name, attr_list, auth_domain):
-
-	config_namespace = "broadinstitute_cga"
-	file_downloader_name = "gdc_file_downloader__default_cfg"
-	bam_downloader_name = "gdc_bam_downloader__default_cfg"
-	file_downloader_cfg_snapshot_id = 3
-	bam_downloader_cfg_snapshot_id = 2
+CONFIG_NAMESPACE = "broadinstitute_cga"
+FILE_DOWNLOADER_CFG = ("gdc_file_downloader__default_cfg", 3)
+BAM_DOWNLOADER_CFG = ("gdc_bam_downloader__default_cfg", 2)
+
+def get_template_config(namespace, config_name, snapshot_id, template_cache, cache_dir=None):
+	"""Return the method configuration stored in the method repository as a dict.
+
+	Templates are fetched at most once per run (memoized in template_cache). If cache_dir
+	is given, templates are also stored on disk keyed by snapshot id; a repository snapshot
+	is immutable, so the on-disk copy never needs to be refreshed.
+	"""
+	key = (namespace, config_name, snapshot_id)
+	if key in template_cache:
+		return template_cache[key]
+
+	cache_filename = None
+	if cache_dir is not None:
+		cache_filename = os.path.join(cache_dir, "{0}.{1}.{2}.json".format(namespace, config_name, snapshot_id))
+		if os.path.exists(cache_filename):
+			with open(cache_filename, 'r') as fp:
+				template_cache[key] = json.load(fp)
+			return template_cache[key]
+
+	print("Fetching method config template {0}/{1}, snapshot {2}".format(namespace, config_name, snapshot_id))
+	response = api.get_repository_config(namespace, config_name, snapshot_id)
+	response.raise_for_status()
+	template = json.loads(response.json()['payload'])
+
+	if cache_filename is not None:
+		os.makedirs(cache_dir, exist_ok=True)
+		with open(cache_filename, 'w') as fp:
+			json.dump(template, fp)
+
+	template_cache[key] = template
+	return template
+
+def render_method_config(template, namespace, config_name, attr_name, attr_entity, auth_domain):
+	"""Render the workspace method config for one downloadable attribute from a repository template."""
+	attr_name_base = attr_name[:-17]
+	config = copy.deepcopy(template)
+	config['namespace'] = namespace
+	config['name'] = config_name
+	config['rootEntityType'] = attr_entity
+
+	inputs = config['inputs']
+	outputs = config['outputs']
+	if "aligned_reads" in attr_name:
+		inputs['gdc_bam_downloader_workflow.uuid_and_filename'] = "this.{0}".format(attr_name)
+		outputs['gdc_bam_downloader_workflow.gdc_bam_downloader.bam_file'] = "this.{0}bam_url".format(attr_name_base)
+		outputs['gdc_bam_downloader_workflow.gdc_bam_downloader.bai_file'] = "this.{0}bai_url".format(attr_name_base)
+	else:
+		if not auth_domain:
+			inputs.pop('gdc_file_downloader_workflow.gdc_file_downloader.gdc_user_token', None)
+		inputs['gdc_file_downloader_workflow.uuid_and_filename'] = "this.{0}".format(attr_name)
+		outputs['gdc_file_downloader_workflow.gdc_file_downloader.file'] = "this.{0}url".format(attr_name_base)
+
+	return config
+
+def create_method_configs(billing_project, ws_name, attr_list, auth_domain, cache_dir=None):
+
+	# the two repository templates are fetched once per run (or read from cache_dir);
+	# each per-attribute config is then rendered locally and pushed with a single call
+	template_cache = dict()
 
 	for attr in attr_list:
 		
@@ -58,141 +120,253 @@ def create_method_configs(billing_project, ws_name, attr_list, auth_domain):
 		attr_name_base = attr_name[:-17]
 		attr_entity = attr[1]
 		if "aligned_reads" in attr_name:
+			template_name, snapshot_id = BAM_DOWNLOADER_CFG
 			new_config_name = "gdc_bam_downloader__" + attr_name_base + "cfg"
-			print("Uploading and configuring method config {0}, based on {1}".format(new_config_name, bam_downloader_name))
-			api.copy_config_from_repo(billing_project, ws_name, config_namespace, bam_downloader_name, bam_downloader_cfg_snapshot_id,
-						  config_namespace, new_config_name)
-			
-			current_config = api.get_workspace_config(billing_project, ws_name, config_namespace, new_config_name)
-			current_config = current_config.json()
-
-			inputs = current_config['inputs']
-			outputs = current_config['outputs']
-
-			inputs['gdc_bam_downloader_workflow.uuid_and_filename'] = "this.{0}".format(attr_name)
-			
-			outputs['gdc_bam_downloader_workflow.gdc_bam_downloader.bam_file'] = "this.{0}bam_url".format(attr_name_base)
-			outputs['gdc_bam_downloader_workflow.gdc_bam_downloader.bai_file'] = "this.{0}bai_url".format(attr_name_base)
-
-			current_config['inputs'] = inputs
-			current_config['outputs'] = outputs
-			current_config['rootEntityType'] = attr_entity
-			
-			api.update_workspace_config(billing_project, ws_name, config_namespace, new_config_name, current_config)
-
 		else:
+			template_name, snapshot_id = FILE_DOWNLOADER_CFG
 			new_config_name = "gdc_file_downloader__" + attr_name_base + "cfg"
-			print("Uploading and configuring method config {0}, based on {1}".format(new_config_name, file_downloader_name))
-			api.copy_config_from_repo(billing_project, ws_name, config_namespace, file_downloader_name, file_downloader_cfg_snapshot_id, 
-						  config_namespace, new_config_name)
-			
-			current_config = api.get_workspace_config(billing_project, ws_name, config_namespace, new_config_name)
-			current_config = current_config.json()
 
-			inputs = current_config['inputs']
-			outputs = current_config['outputs']
-
-			if not auth_domain:
-				inputs.pop('gdc_file_downloader_workflow.gdc_file_downloader.gdc_user_token', None)
-				
-			inputs['gdc_file_downloader_workflow.uuid_and_filename'] = "this.{0}".format(attr_name)
-			
-			outputs['gdc_file_downloader_workflow.gdc_file_downloader.file'] = "this.{0}url".format(attr_name_base)
+		print("Uploading and configuring method config {0}, based on {1}".format(new_config_name, template_name))
+		template = get_template_config(CONFIG_NAMESPACE, template_name, snapshot_id, template_cache, cache_dir)
+		config = render_method_config(template, CONFIG_NAMESPACE, new_config_name, attr_name, attr_entity, auth_domain)
+		api.create_workspace_config(billing_project, ws_name, config)
 			
-			current_config['inputs'] = inputs
-			current_config['outputs'] = outputs
-			current_config['rootEntityType'] = attr_entity
 
-			api.update_workspace_config(billing_project, ws_name, config_namespace, new_config_name, current_config)
-			
-
-def main():
-
-    parser = argparse.ArgumentParser(description='create FireCloud workspace for a specific project + cohort + access type')
-    parser.add_argument("project_name", help="the name of the project. e.g: TCGA")
-    parser.add_argument("cohort_name", help="name_of_cancer_cohort. e.g: LUAD")
-    parser.add_argument("billing_project", help="name of billing project to create the workspace under. e.g: broad-firecloud-tcga")
-    parser.add_argument("ws_suffix", help="descriptive suffix to add to the workspace auto-generated name. e.g: ControlledAccess_hg38_V1-0_DATA")
-    parser.add_argument("-a", "--auth_domain", help="authorization domain. for dbGaP controlled access the domain name is TCGA-dbGaP-Authorized.", default="")
-    
-    args = parser.parse_args()
+DATA_MODEL_FILE_TYPES = ["participants", "participant_sets_membership", "samples", "sample_sets_membership", "pairs", "pair_sets_membership"]
+STATE_FILENAME = "ws_builder_state.json"
+STEP_NAMES = ['manifest', 'load_files', 'workspace', 'upload', 'method_configs']
 
-    #STEP 1:
-    #Create new directory for the cohort and switch wd to this directory
-    if args.auth_domain:
-    	new_dir_name = args.project_name + "-" + args.cohort_name + "_" + args.auth_domain
+def cohort_dir_name(project_name, cohort_name, auth_domain):
+    if auth_domain:
+        return project_name + "-" + cohort_name + "_" + auth_domain
     else:
-    	new_dir_name = args.project_name + "-" + args.cohort_name
-    os.mkdir(new_dir_name)
-    print("Created new directory for the {0} cohort".format(args.cohort_name))
-    os.chdir(new_dir_name)
-    print("Switched working directory to ./{0}".format(new_dir_name))
-
-	#STEP 2:
-	#Create creteria for downloading manifest and then download it.    
+        return project_name + "-" + cohort_name
+
+def manifest_filters(project_name, cohort_name, auth_domain):
     #Right now the file types that are selected for a new workspace depend on whether that workspace is to have open/controlled access to the GDC data portal.
     #This code will need to be redesigned, or new keys will have to be added to the dictionary if this assumption ever changes.
-    if args.auth_domain:
-    	file_types = FILE_TYPE_DICT[args.auth_domain] 
-    else: 
-    	file_types = FILE_TYPE_DICT["default"]
+    if auth_domain:
+        file_types = FILE_TYPE_DICT[auth_domain]
+    else:
+        file_types = FILE_TYPE_DICT["default"]
 
     filters = dict()
-    filters["cases.project.program.name"] = [args.project_name]
-    filters["cases.project.project_id"] = [args.project_name+"-"+args.cohort_name]
+    filters["cases.project.program.name"] = [project_name]
+    filters["cases.project.project_id"] = [project_name+"-"+cohort_name]
     filters["files.access"] = file_types
     #Following directions from the GDC, we were told that controlled access workspaces should not contain BAM files
-    if args.auth_domain:
-    	filters["files.data_format"] = ["BCR XML","TXT","VCF","TSV","MAF","XLSX"]
+    if auth_domain:
+        filters["files.data_format"] = ["BCR XML","TXT","VCF","TSV","MAF","XLSX"]
     else:
         filters["files.data_format"] = ["BCR XML","TXT","VCF","TSV","MAF","XLSX"]
+    return filters
 
-    filt_json = build_filter_json(filters)
+def upload_load_file(billing_project, workspace_name, filename):
+    print("Uploading file {0}".format(filename))
+    if filename.endswith('.gz'):
+        with loadfile_io.open_text(filename) as fp:
+            response = api.upload_entities(billing_project, workspace_name, fp.read())
+    else:
+        response = api.upload_entities_tsv(billing_project, workspace_name, filename)
+    response.raise_for_status()
+    return filename
+
+def upload_load_files(billing_project, workspace_name, load_files, upload_workers):
+    """Upload load files in dependency order; the chunks of one load file are uploaded in parallel.
+
+    load_files maps each of DATA_MODEL_FILE_TYPES to the list of files (chunks) holding it.
+    """
+    uploaded = []
+    with ThreadPoolExecutor(max_workers=upload_workers) as executor:
+        for filetype in DATA_MODEL_FILE_TYPES:
+            futures = [executor.submit(upload_load_file, billing_project, workspace_name, filename)
+                       for filename in load_files[filetype]]
+            uploaded += [future.result() for future in futures]
+    return uploaded
+
+def build_workspace_graph(work_dir, project_name, cohort_name, billing_project, ws_suffix, auth_domain,
+                          config_cache=None, metadata_cache=None, diff_upload=None,
+                          chunk_size=None, compress=False, upload_workers=4, profile=None, download_batch_gb=None):
+    """Build the step graph that creates and populates one cohort workspace.
+
+    The graph's state file and all generated files live in work_dir.  Steps
+    that talk to the GDC use the 'gdc' resource and steps that talk to
+    FireCloud use the 'firecloud' resource (see StepGraph.run).
+
+    diff_upload selects differential uploads of the load files: 'snapshot'
+    compares against the files last uploaded from work_dir, 'remote' against
+    the entities currently in the workspace; None uploads the full files.
+    Only differential uploads refresh a workspace that already exists; a full
+    upload would leave entities the load files no longer have in place, so
+    then the workspace step fails instead.
+
+    chunk_size and compress are passed on to genFcWsLoadFiles; chunks are
+    uploaded upload_workers at a time.  profile ('cpu' or 'memory') is passed
+    on as well, so that genFcWsLoadFiles writes per-phase profiles into work_dir.
+    download_batch_gb is passed on too; the load files then include size-balanced
+    download batch sets.
+    """
+    workspace_name = "{0}_{1}_{2}".format(project_name, cohort_name, ws_suffix)
+    graph = StepGraph(STATE_FILENAME, work_dir)
+
+    #Download the manifest
+    def download_manifest_step(inputs):
+        filt_json = build_filter_json(manifest_filters(project_name, cohort_name, auth_domain))
+        manifest_filename = download_manifest(filt_json, work_dir)
+        print("manifest downloaded")
+        return {'files': [manifest_filename], 'manifest': manifest_filename}
 
-    #Download manifest file to the new directory
-    manifest_filename = download_manifest(filt_json)
-    print("manifest downloaded")
-    
-    #Step 3:
     #Run fcgdctools on the manifest file
-    if args.project_name == "TARGET":
-        fcgdctools_command = "genFcWsLoadFiles -c " + manifest_filename + ">genFcWsLoadFiles_output.txt"
-    else:
-        fcgdctools_command = "genFcWsLoadFiles " + manifest_filename + ">genFcWsLoadFiles_output.txt"
+    def load_files_step(inputs):
+        manifest_filename = inputs['manifest']['manifest']
+        fcgdctools_command = "genFcWsLoadFiles "
+        if project_name == "TARGET":
+            fcgdctools_command += "-c "
+        if metadata_cache is not None:
+            fcgdctools_command += "-m " + metadata_cache + " "
+        if chunk_size is not None:
+            fcgdctools_command += "-k " + str(chunk_size) + " "
+        if compress:
+            fcgdctools_command += "-z "
+        if profile is not None:
+            fcgdctools_command += "-p " + profile + " "
+        if download_batch_gb is not None:
+            fcgdctools_command += "--download_batch_gb " + str(download_batch_gb) + " "
+        fcgdctools_command += manifest_filename + ">genFcWsLoadFiles_output.txt"
+
+        print("Executing command {0}\nPlease check the output file to see progress and check for errors.".format(fcgdctools_command))
+        if subprocess.call(fcgdctools_command, shell=True, cwd=work_dir) != 0:
+            raise RuntimeError("command failed: {0}".format(fcgdctools_command))
+
+        data_model_file_prefix = manifest_filename.split(".")[0]
+        data_files = []
+        for filetype in DATA_MODEL_FILE_TYPES:
+            data_files += loadfile_io.find_load_files(os.path.join(work_dir, data_model_file_prefix + "_" + filetype))
+        workspace_attribute_filename = data_model_file_prefix + "_workspace_attributes.txt"
+        return {'files': [os.path.relpath(f, work_dir) for f in data_files] + [workspace_attribute_filename],
+                'prefix': data_model_file_prefix,
+                'workspace_attributes': workspace_attribute_filename}
 
-    print("Executing command {0}\nPlease check the output file to see progress and check for errors.".format(fcgdctools_command))
-    os.system(fcgdctools_command)
-    
-    #Step 4:
-    #Prepare attributes to be loaded
-    workspace_attribute_filename = manifest_filename.split(".")[0] + "_workspace_attributes.txt"
-    attribute_list = prepare_workspace_attribute_list(workspace_attribute_filename, args.auth_domain)
-    
-    #Step 5:
     #Create the new workspace on FireCloud
-    workspace_name = "{0}_{1}_{2}".format(args.project_name, args.cohort_name, args.ws_suffix)
-    print("New workspace name is: {0}\nPreparing to create workspace.".format(workspace_name))
-    api.create_workspace(args.billing_project, workspace_name, args.auth_domain, attribute_list)
+    def create_workspace_step(inputs):
+        workspace_attribute_filename = os.path.join(work_dir, inputs['load_files']['workspace_attributes'])
+        attribute_list = prepare_workspace_attribute_list(workspace_attribute_filename, auth_domain)
+        print("New workspace name is: {0}\nPreparing to create workspace.".format(workspace_name))
+        response = api.create_workspace(billing_project, workspace_name, auth_domain, attribute_list)
+        if response.status_code == 409 and diff_upload is not None:
+            # only a differential upload deletes the entities the new load files no longer have
+            print("Workspace {0} already exists; it will be refreshed".format(workspace_name))
+        else:
+            response.raise_for_status()
+        # the creation time makes a recreated workspace invalidate the steps that populate it
+        return {'workspace': workspace_name, 'created': '{:%Y-%m-%d_%H-%M-%S}'.format(datetime.datetime.now())}
 
-    #Step 6:
     #Upload data model .tsv files to the newly created workspace
-    data_model_file_prefix = manifest_filename.split(".")[0]
-    data_files = ["participants", "participant_sets_membership", "samples", "sample_sets_membership", "pairs", "pair_sets_membership"]
-    for filetype in data_files:
-    	full_name = data_model_file_prefix + "_" + filetype + ".txt"
-    	if os.path.exists(full_name):
-    		print("Uploading file {0}".format(full_name))
-    		api.upload_entities_tsv(args.billing_project, workspace_name, full_name)
-
-    #Step 7:
+    def upload_step(inputs):
+        data_model_file_prefix = os.path.join(work_dir, inputs['load_files']['prefix'])
+        load_files = dict()
+        for filetype in DATA_MODEL_FILE_TYPES:
+            load_files[filetype] = loadfile_io.find_load_files(data_model_file_prefix + "_" + filetype)
+
+        snapshot_dir = os.path.join(work_dir, entity_diff.SNAPSHOT_DIRNAME)
+        if diff_upload is not None:
+            uploaded = entity_diff.upload_differences(api, billing_project, workspace_name, load_files, data_model_file_prefix,
+                                                      snapshot_dir if diff_upload == 'snapshot' else None)
+        else:
+            uploaded = upload_load_files(billing_project, workspace_name, load_files, upload_workers)
+        # remember what the workspace now contains for the next differential upload
+        entity_diff.save_snapshot(snapshot_dir, load_files)
+        return {'uploaded': [os.path.basename(f) for f in uploaded]}
+
     #Create and Upload method configurations for downloading files to the new workspace
-    downloadable_attrs = list_downloadable_attrs(data_model_file_prefix, ["participant", "sample", "pair"])
-    print("The downloadable attributes are:")
-    for attr in downloadable_attrs:
-    	print(attr[0])
-    create_method_configs(args.billing_project, workspace_name, downloadable_attrs, args.auth_domain)
+    def method_configs_step(inputs):
+        data_model_file_prefix = os.path.join(work_dir, inputs['load_files']['prefix'])
+        downloadable_attrs = list_downloadable_attrs(data_model_file_prefix, ["participant", "sample", "pair"])
+        print("The downloadable attributes are:")
+        for attr in downloadable_attrs:
+            print(attr[0])
+        create_method_configs(billing_project, workspace_name, downloadable_attrs, auth_domain, config_cache)
+        return {'configs': [attr[0] for attr in downloadable_attrs]}
+
+    graph.add_step('manifest', download_manifest_step,
+                   params={'filters': manifest_filters(project_name, cohort_name, auth_domain)},
+                   resource='gdc')
+    load_files_params = {'all_cases': project_name == "TARGET", 'chunk_size': chunk_size, 'compress': compress}
+    if download_batch_gb is not None:
+        # only when given, so that the load files of earlier runs stay up to date
+        load_files_params['download_batch_gb'] = download_batch_gb
+    graph.add_step('load_files', load_files_step, deps=['manifest'],
+                   params=load_files_params,
+                   resource='gdc')
+    graph.add_step('workspace', create_workspace_step, deps=['load_files'],
+                   params={'billing_project': billing_project, 'workspace': workspace_name, 'auth_domain': auth_domain},
+                   resource='firecloud')
+    graph.add_step('upload', upload_step, deps=['load_files', 'workspace'],
+                   params={'diff_upload': diff_upload},
+                   resource='firecloud')
+    graph.add_step('method_configs', method_configs_step, deps=['load_files', 'workspace'],
+                   resource='firecloud')
+    return graph
 
-if __name__ == '__main__':
-    main()
+def main():
 
+    parser = argparse.ArgumentParser(description='create FireCloud workspace for a specific project + cohort + access type')
+    parser.add_argument("project_name", help="the name of the project. e.g: TCGA")
+    parser.add_argument("cohort_name", help="name_of_cancer_cohort. e.g: LUAD")
+    parser.add_argument("billing_project", help="name of billing project to create the workspace under. e.g: broad-firecloud-tcga")
+    parser.add_argument("ws_suffix", help="descriptive suffix to add to the workspace auto-generated name. e.g: ControlledAccess_hg38_V1-0_DATA")
+    parser.add_argument("-a", "--auth_domain", help="authorization domain. for dbGaP controlled access the domain name is TCGA-dbGaP-Authorized.", default="")
+    parser.add_argument("--config_cache", help="directory in which to cache method config templates fetched from the method repository", default=None)
+    parser.add_argument("-m", "--metadata_cache", help="SQLite file caching GDC metadata responses; passed on to genFcWsLoadFiles", default=None)
+    parser.add_argument("-d", "--diff_upload", help="upload only entities that changed since the last upload from this directory (snapshot) or relative to the workspace's current entities (remote)",
+                        choices=['snapshot', 'remote'], default=None)
+    parser.add_argument("-k", "--chunk_size", help="split each load file into chunks of at most this many rows", type=int, default=None)
+    parser.add_argument("-z", "--gzip", help="gzip-compress the load files", action="store_true")
+    parser.add_argument("-u", "--upload_workers", help="number of load file chunks uploaded concurrently", type=int, default=4)
+    parser.add_argument("-p", "--profile", help="profile each step (and the phases of genFcWsLoadFiles); profiles are written to the cohort directory",
+                        choices=phase_profiler.MODES, default=None)
+    parser.add_argument("-b", "--download_batch_gb", help="passed on to genFcWsLoadFiles: also create membership sets of about this many GB of files each, for downloading in balanced batches",
+                        type=float, default=None)
+    parser.add_argument("--plan", help="download the manifest and report what genFcWsLoadFiles would cost (see genFcWsLoadFiles --plan), without building the workspace",
+                        action="store_true")
+    parser.add_argument("--plan_history", help="--stats file of an earlier genFcWsLoadFiles run, passed on to genFcWsLoadFiles --plan (may be repeated)",
+                        action="append", default=[])
+    parser.add_argument("-f", "--force", help="rerun the named step even if it is up to date (may be repeated)",
+                        action="append", default=[], choices=STEP_NAMES)
+    
+    args = parser.parse_args()
+    if args.chunk_size is not None and args.chunk_size < 1:
+        parser.error("--chunk_size must be at least 1")
+    if args.metadata_cache is not None:
+        # genFcWsLoadFiles runs in the cohort directory; resolve the cache location up front
+        args.metadata_cache = os.path.abspath(args.metadata_cache)
+
+    #Create (or reuse) the directory for the cohort.
+    #Steps completed by a previous run in this directory are skipped if their inputs have not changed.
+    new_dir_name = cohort_dir_name(args.project_name, args.cohort_name, args.auth_domain)
+    os.makedirs(new_dir_name, exist_ok=True)
+    print("Working directory for the {0} cohort is ./{1}".format(args.cohort_name, new_dir_name))
+
+    if args.plan:
+        manifest_filename = download_manifest(build_filter_json(manifest_filters(args.project_name, args.cohort_name, args.auth_domain)),
+                                              new_dir_name)
+        fcgdctools_command = "genFcWsLoadFiles --plan "
+        if args.project_name == "TARGET":
+            fcgdctools_command += "-c "
+        if args.metadata_cache is not None:
+            fcgdctools_command += "-m " + args.metadata_cache + " "
+        for stats_filename in args.plan_history:
+            fcgdctools_command += "--plan_history " + os.path.abspath(stats_filename) + " "
+        fcgdctools_command += manifest_filename
+        sys.exit(subprocess.call(fcgdctools_command, shell=True, cwd=new_dir_name))
+
+    graph = build_workspace_graph(new_dir_name, args.project_name, args.cohort_name, args.billing_project, args.ws_suffix,
+                                  args.auth_domain, args.config_cache, args.metadata_cache, args.diff_upload,
+                                  args.chunk_size, args.gzip, args.upload_workers, args.profile, args.download_batch_gb)
+    profiler = None
+    if args.profile is not None:
+        profiler = phase_profiler.PhaseProfiler(args.profile, os.path.join(new_dir_name, "ws_builder_profile"), STEP_NAMES)
+    graph.run(force=args.force, profiler=profiler)
 
+if __name__ == '__main__':
+    main()
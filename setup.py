@@ -25,7 +25,10 @@ setup(
     entry_points={
         'console_scripts': [
             'genFcWsLoadFiles=fcgdctools.fc_loadfiles:main',
+            'mergeFcWsLoadFiles=fcgdctools.merge_loadfiles:main',
+            'genFcWsLoadFilesService=fcgdctools.loadfile_service:main',
         ],
     },
-    install_requires=['requests']
+    install_requires=['requests'],
+    extras_require={'columnar': ['pyarrow']}
 )    
@@ -0,0 +1,9 @@
+import os
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# ws_builder and the modules it uses are run as scripts from fcgdctools/ and import one another by module name;
+# the synthetic manifests and the mock GDC server of the benchmarks serve as test fixtures
+sys.path.insert(0, os.path.join(REPO_ROOT, 'fcgdctools'))
+sys.path.insert(0, os.path.join(REPO_ROOT, 'benchmarks'))
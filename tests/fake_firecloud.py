@@ -0,0 +1,82 @@
+"""
+A local stand-in for the FireCloud entity endpoints of firecloud.api.
+
+FakeEntityApi keeps the entities of one workspace in memory, applies
+uploaded load files the way FireCloud does (attributes are upserted,
+__DELETE__ removes an attribute, a membership upload defines the
+members of its sets) and records every upload and delete call.
+"""
+
+import csv
+
+import requests
+
+# load file columns that FireCloud turns into references to other entities
+REFERENCE_COLUMNS = {'participant_id': 'participant', 'case_sample_id': 'sample', 'control_sample_id': 'sample'}
+
+
+class FakeResponse:
+
+    def __init__(self, status_code, body=None):
+        self.status_code = status_code
+        self._body = body
+
+    def json(self):
+        return self._body
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError("{0} error".format(self.status_code), response=self)
+
+
+class FakeEntityApi:
+
+    """The entity endpoints of one workspace
+
+    Attributes:
+        entities (dict): entity type -> entity name -> attributes, as FireCloud returns them
+        uploads (list): (header, rows) of each uploaded load file, rows as lists of values
+        deletions (list): the entity lists passed to delete_entities
+    """
+    def __init__(self):
+        self.entities = dict()
+        self.uploads = []
+        self.deletions = []
+
+    def get_entities(self, namespace, workspace, etype):
+        return FakeResponse(200, [{'name': name, 'entityType': etype, 'attributes': attributes}
+                                  for name, attributes in self.entities.get(etype, dict()).items()])
+
+    def upload_entities_tsv(self, namespace, workspace, entities_tsv):
+        with open(entities_tsv, newline='') as fp:
+            reader = csv.reader(fp, delimiter='\t')
+            header = next(reader)
+            rows = list(reader)
+        self.uploads.append((header, rows))
+        kind, id_column = header[0].split(':')
+        entity_type = id_column[:-len('_id')]
+        if kind == 'membership':
+            member_type = header[1][:-len('_id')]
+            members = dict()
+            for set_id, member_id in rows:
+                members.setdefault(set_id, []).append({'entityType': member_type, 'entityName': member_id})
+            for set_id, items in members.items():
+                self.entities.setdefault(entity_type, dict())[set_id] = \
+                    {member_type + 's': {'itemsType': 'EntityReference', 'items': items}}
+        else:
+            for row in rows:
+                attributes = self.entities.setdefault(entity_type, dict()).setdefault(row[0], dict())
+                for column, value in zip(header[1:], row[1:]):
+                    if column in REFERENCE_COLUMNS:
+                        attributes[column[:-len('_id')]] = {'entityType': REFERENCE_COLUMNS[column], 'entityName': value}
+                    elif value == '__DELETE__':
+                        attributes.pop(column, None)
+                    elif value != '':
+                        attributes[column] = value
+        return FakeResponse(200)
+
+    def delete_entities(self, namespace, workspace, json_body):
+        self.deletions.append(json_body)
+        for entity in json_body:
+            self.entities.get(entity['entityType'], dict()).pop(entity['entityName'], None)
+        return FakeResponse(204)
@@ -0,0 +1,73 @@
+import threading
+
+from fcgdctools import aimd_controller
+
+
+def _controller(**kwargs):
+    return aimd_controller.AimdController(concurrency=4, max_concurrency=6, batch_size=500, max_batch_size=600,
+                                          batch_step=50, window=10, **kwargs)
+
+
+def _window(controller, seconds=0.1, errors=0):
+    for i in range(controller.window):
+        controller.record(seconds, ok=i >= errors)
+
+
+def test_settings_increase_while_the_gdc_keeps_up():
+    controller = _controller()
+    _window(controller)
+    assert (controller.concurrency, controller.batch_size) == (5, 550)
+
+    for _ in range(3):
+        _window(controller)
+    # up to the bounds
+    assert (controller.concurrency, controller.batch_size) == (6, 600)
+    assert controller.summary()['increases'] == 4
+    assert [entry['reason'] for entry in controller.history] == ['increase', 'increase']
+
+
+def test_throttling_halves_the_settings_at_once():
+    controller = _controller()
+    controller.record(0.1)
+    controller.record(0.1, ok=False, throttled=True)
+
+    assert (controller.concurrency, controller.batch_size) == (2, 250)
+    assert controller.history[-1]['reason'] == 'throttled'
+
+
+def test_errors_and_rising_latency_halve_the_settings():
+    controller = _controller()
+    _window(controller, errors=1)
+    assert (controller.concurrency, controller.batch_size) == (2, 250)
+    assert controller.history[-1]['reason'] == 'errors'
+
+    _window(controller, seconds=0.1)
+    _window(controller, seconds=0.5)
+    assert (controller.concurrency, controller.batch_size) == (1, 150)
+    assert controller.history[-1]['reason'] == 'latency'
+    assert controller.summary()['decreases'] == 2
+
+
+def test_slots_limit_the_requests_in_flight():
+    controller = _controller()
+    controller.concurrency = 2
+    in_flight = []
+    peak = []
+    lock = threading.Lock()
+
+    def request():
+        with controller.slot():
+            with lock:
+                in_flight.append(1)
+                peak.append(len(in_flight))
+            threading.Event().wait(0.02)
+            with lock:
+                in_flight.pop()
+
+    threads = [threading.Thread(target=request) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert max(peak) == 2
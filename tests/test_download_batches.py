@@ -0,0 +1,30 @@
+from fcgdctools import download_batches
+
+
+def test_batches_are_balanced():
+    sizes = [10, 50, 30, 40, 20, 50]
+
+    batches = download_batches.balanced_batches(sizes, 100)
+
+    assert batches == [[0, 1, 3], [2, 4, 5]]
+    assert [sum(sizes[i] for i in batch) for batch in batches] == [100, 100]
+
+
+def test_unknown_sizes_count_as_the_mean():
+    # 300 + 200 + 100 + 200 bytes
+    batches = download_batches.balanced_batches([300, None, 100, None], 400)
+
+    assert batches == [[0, 2], [1, 3]]
+
+
+def test_no_known_sizes_give_one_batch():
+    assert download_batches.balanced_batches([None, None, None], 10) == [[0, 1, 2]]
+    assert download_batches.balanced_batches([], 10) == []
+
+
+def test_batch_larger_than_total_gives_one_batch():
+    assert download_batches.balanced_batches([30, None, 10], 1000) == [[0, 1, 2]]
+
+
+def test_batch_set_names():
+    assert download_batches.batch_set_name('rna__uuid_and_filename', 12) == 'rna__uuid_and_filename__batch012'
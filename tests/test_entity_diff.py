@@ -0,0 +1,110 @@
+import csv
+
+import pytest
+
+import entity_diff
+from fake_firecloud import FakeEntityApi
+
+PARTICIPANTS = (['entity:participant_id', 'submitter_id', 'clinical__uuid_and_filename'],
+                [['P1', 'TCGA-01', 'c1/c1.xml'],
+                 ['P2', 'TCGA-02', 'c2/c2.xml']])
+SAMPLES = (['entity:sample_id', 'participant_id', 'sample_type', 'rna__uuid_and_filename', 'rna__url', 'old__uuid_and_filename'],
+           [['S1', 'P1', 'TP', 'a1/a1.txt', 'gs://b/a1.txt', 'o1/o1.txt'],
+            ['S2', 'P1', 'NT', 'a2/a2.txt', '__DELETE__', ''],
+            ['S3', 'P2', 'TP', 'a3/a3.txt', 'gs://b/a3.txt', '']])
+SAMPLE_SETS = (['membership:sample_set_id', 'sample_id'],
+               [['rna', 'S1'], ['rna', 'S2'], ['rna', 'S3'], ['old', 'S1']])
+
+
+def _write_load_files(directory, name, tables):
+    load_files = dict()
+    for filetype, (header, rows) in tables.items():
+        filename = str(directory / '{0}_{1}.txt'.format(name, filetype))
+        with open(filename, 'w', newline='') as fp:
+            writer = csv.writer(fp, delimiter='\t')
+            writer.writerow(header)
+            writer.writerows(rows)
+        load_files[filetype] = [filename]
+    return load_files
+
+
+def _uploaded(load_files):
+    api = FakeEntityApi()
+    for filetype in ['participants', 'samples', 'pairs', 'participant_sets_membership', 'sample_sets_membership']:
+        for filename in load_files.get(filetype, []):
+            api.upload_entities_tsv('ns', 'ws', filename)
+    return api
+
+
+def _state(api):
+    # membership order does not matter
+    state = dict()
+    for entity_type, entities in api.entities.items():
+        for name, attributes in entities.items():
+            state[(entity_type, name)] = {
+                attribute: sorted(item['entityName'] for item in value['items'])
+                if isinstance(value, dict) and 'items' in value else value
+                for attribute, value in attributes.items()}
+    return state
+
+
+def _diff_upload(tmp_path, mode, old_tables, new_tables):
+    """Upload old_tables in full, then new_tables as differences; return the api, its calls since and the new load files."""
+    old_files = _write_load_files(tmp_path, 'old', old_tables)
+    api = _uploaded(old_files)
+    api.uploads = []
+    snapshot_dir = None
+    if mode == 'snapshot':
+        snapshot_dir = str(tmp_path / entity_diff.SNAPSHOT_DIRNAME)
+        entity_diff.save_snapshot(snapshot_dir, old_files)
+    new_files = _write_load_files(tmp_path, 'new', new_tables)
+    entity_diff.upload_differences(api, 'ns', 'ws', new_files, str(tmp_path / 'delta'), snapshot_dir)
+    return api, new_files
+
+
+@pytest.mark.parametrize('mode', ['snapshot', 'remote'])
+def test_changed_and_removed_entities(tmp_path, mode):
+    samples = (SAMPLES[0], [['S1', 'P1', 'TP', 'a1/a1.txt', 'gs://b/a1-v2.txt', 'o1/o1.txt'],
+                            ['S2', 'P1', 'NT', 'a2/a2.txt', '__DELETE__', '']])
+    sample_sets = (SAMPLE_SETS[0], [['rna', 'S1'], ['rna', 'S2']])
+    new_tables = {'participants': PARTICIPANTS, 'samples': samples, 'sample_sets_membership': sample_sets}
+    api, new_files = _diff_upload(tmp_path, mode, {'participants': PARTICIPANTS, 'samples': SAMPLES,
+                                                   'sample_sets_membership': SAMPLE_SETS}, new_tables)
+
+    # only the changed column of the changed sample, and the set that lost a member
+    assert api.uploads == [(['entity:sample_id', 'rna__url'], [['S1', 'gs://b/a1-v2.txt']]),
+                           (['membership:sample_set_id', 'sample_id'], [['rna', 'S1'], ['rna', 'S2']])]
+    assert api.deletions == [[{'entityType': 'sample_set', 'entityName': 'old'},
+                              {'entityType': 'sample', 'entityName': 'S3'}]]
+    assert _state(api) == _state(_uploaded(new_files))
+
+
+@pytest.mark.parametrize('mode', ['snapshot', 'remote'])
+def test_added_entities_and_columns(tmp_path, mode):
+    header = SAMPLES[0][:-1] + ['mirna__uuid_and_filename']
+    samples = (header, [['S1', 'P1', 'TP', 'a1/a1.txt', 'gs://b/a1.txt', ''],
+                        ['S2', 'P1', 'NT', 'a2/a2.txt', '__DELETE__', ''],
+                        ['S3', 'P2', 'TP', 'a3/a3.txt', 'gs://b/a3.txt', ''],
+                        ['S4', 'P2', 'NB', 'a4/a4.txt', 'gs://b/a4.txt', 'm4/m4.txt']])
+    new_tables = {'participants': PARTICIPANTS, 'samples': samples, 'sample_sets_membership': SAMPLE_SETS}
+    api, new_files = _diff_upload(tmp_path, mode, {'participants': PARTICIPANTS, 'samples': SAMPLES,
+                                                   'sample_sets_membership': SAMPLE_SETS}, new_tables)
+
+    assert len(api.uploads) == 1
+    header, rows = api.uploads[0]
+    # the new sample, and the sample whose attribute's column disappeared; S2 and S3 are unchanged
+    assert header == ['entity:sample_id', 'participant_id', 'sample_type', 'rna__uuid_and_filename', 'rna__url',
+                      'mirna__uuid_and_filename', 'old__uuid_and_filename']
+    assert sorted(rows) == [['S1', 'P1', 'TP', 'a1/a1.txt', 'gs://b/a1.txt', '__DELETE__', '__DELETE__'],
+                            ['S4', 'P2', 'NB', 'a4/a4.txt', 'gs://b/a4.txt', 'm4/m4.txt', '__DELETE__']]
+    assert api.deletions == []
+    assert _state(api) == _state(_uploaded(new_files))
+
+
+@pytest.mark.parametrize('mode', ['snapshot', 'remote'])
+def test_unchanged_load_files_upload_nothing(tmp_path, mode):
+    tables = {'participants': PARTICIPANTS, 'samples': SAMPLES, 'sample_sets_membership': SAMPLE_SETS}
+    api, _ = _diff_upload(tmp_path, mode, tables, tables)
+
+    assert api.uploads == []
+    assert api.deletions == []
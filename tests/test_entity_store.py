@@ -0,0 +1,60 @@
+import pytest
+
+from fcgdctools import entity_store
+
+
+@pytest.fixture
+def spill_file(tmp_path):
+    # spills on the first insert, and keeps two entities per store in memory
+    spill_file = entity_store.SpillFile(0, str(tmp_path), cache_size=2, check_interval=1)
+    yield spill_file
+    spill_file.close()
+
+
+def test_entity_changed_before_eviction_keeps_change(spill_file):
+    samples = spill_file.store('sample')
+    for i in range(5):
+        samples['S{0}'.format(i)] = {'submitter_id': 'TCGA-{0}'.format(i)}
+    assert spill_file.spilled
+
+    samples['S0']['rna__uuid_and_filename'] = 'a0/a0.txt'
+    # evicts S0, writing it back
+    samples['S3']
+    samples['S4']
+    assert 'S0' not in samples._cache
+
+    assert samples['S0'] == {'submitter_id': 'TCGA-0', 'rna__uuid_and_filename': 'a0/a0.txt'}
+
+
+def test_entity_changed_after_eviction_keeps_change(spill_file):
+    samples = spill_file.store('sample')
+    for i in range(5):
+        samples['S{0}'.format(i)] = {'submitter_id': 'TCGA-{0}'.format(i)}
+    assert 'S0' not in samples._cache
+
+    # read back from the file, changed, and evicted again
+    samples['S0']['rna__uuid_and_filename'] = 'a0/a0.txt'
+    samples['S1']['rna__uuid_and_filename'] = 'a1/a1.txt'
+    samples['S2']
+    samples['S3']
+    assert 'S0' not in samples._cache and 'S1' not in samples._cache
+
+    assert samples['S0']['rna__uuid_and_filename'] == 'a0/a0.txt'
+    assert samples['S1']['rna__uuid_and_filename'] == 'a1/a1.txt'
+    # the entities keep their insertion order
+    assert list(samples) == ['S{0}'.format(i) for i in range(5)]
+    assert len(samples) == 5
+
+
+def test_stores_of_a_spill_file_are_separate(spill_file):
+    cases = spill_file.store('participant')
+    samples = spill_file.store('sample')
+    for i in range(4):
+        cases['X{0}'.format(i)] = {'kind': 'case'}
+        samples['X{0}'.format(i)] = {'kind': 'sample'}
+
+    del samples['X0']
+
+    assert [entity['kind'] for entity in cases.values()] == ['case'] * 4
+    assert 'X0' in cases and 'X0' not in samples
+    assert list(samples) == ['X1', 'X2', 'X3']
@@ -0,0 +1,53 @@
+import zipfile
+
+import pytest
+
+from fcgdctools import http_cassette
+
+FIELDS = 'data_category,data_type'
+
+
+def _record(filename, responses):
+    cassette = http_cassette.Cassette(filename, http_cassette.RECORD, 'https://api.gdc.cancer.gov')
+    for fields, uuid, data in responses:
+        cassette.record(fields, uuid, data)
+    cassette.close()
+    # closing again does nothing
+    cassette.close()
+
+
+def test_replay_serves_recorded_responses(tmp_path):
+    filename = str(tmp_path / 'run.zip')
+    _record(filename, [(FIELDS, 'f1', {'data_type': 'VCF'}),
+                       ('cases.case_id', 'f1', {'cases': [{'case_id': 'c1'}]}),
+                       # a later response for the same request is not stored
+                       (FIELDS, 'f1', {'data_type': 'MAF'})])
+
+    cassette = http_cassette.Cassette(filename, http_cassette.REPLAY)
+
+    assert cassette.replay(FIELDS, 'f1') == {'data_type': 'VCF'}
+    assert cassette.replay('cases.case_id', 'f1') == {'cases': [{'case_id': 'c1'}]}
+    assert cassette.info['responses'] == 2
+    assert cassette.info['gdc_api_root'] == 'https://api.gdc.cancer.gov'
+    cassette.close()
+
+
+def test_replay_of_unrecorded_request_raises_miss(tmp_path):
+    filename = str(tmp_path / 'run.zip')
+    _record(filename, [(FIELDS, 'f1', {'data_type': 'VCF'})])
+    cassette = http_cassette.Cassette(filename, http_cassette.REPLAY)
+
+    # neither another file, nor the same file with other fields
+    with pytest.raises(http_cassette.CassetteMiss):
+        cassette.replay(FIELDS, 'f2')
+    with pytest.raises(http_cassette.CassetteMiss):
+        cassette.replay('cases.case_id', 'f1')
+
+
+def test_cassette_of_other_format_version_is_refused(tmp_path):
+    filename = str(tmp_path / 'run.zip')
+    with zipfile.ZipFile(filename, 'w') as archive:
+        archive.writestr(http_cassette.INFO_ENTRY, '{"format_version": 0}')
+
+    with pytest.raises(ValueError):
+        http_cassette.Cassette(filename, http_cassette.REPLAY)
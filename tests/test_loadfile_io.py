@@ -0,0 +1,58 @@
+import os
+
+from fcgdctools import loadfile_io
+
+
+def _write(basename, rows, chunk_size=None, compress=False, keep_together=None):
+    with loadfile_io.ChunkedTsvWriter(basename, ['set_id', 'member_id'], chunk_size, compress,
+                                      keep_together=keep_together) as writer:
+        for row in rows:
+            writer.writerow(row)
+    return writer.filenames
+
+
+def _rows(n_sets, n_members):
+    return [{'set_id': 'set{0}'.format(s), 'member_id': 'm{0}'.format(m)}
+            for s in range(n_sets) for m in range(n_members)]
+
+
+def test_rewrite_removes_files_of_earlier_run(tmp_path):
+    basename = str(tmp_path / 'm_samples')
+    _write(basename, _rows(1, 10), chunk_size=3)
+    _write(basename, _rows(1, 10), chunk_size=4, compress=True)
+    filenames = _write(basename, _rows(1, 10))
+
+    assert loadfile_io.find_load_files(basename) == filenames == [basename + '.txt']
+    assert len(list(loadfile_io.read_rows(filenames))) == 10
+
+
+def test_rewrite_keeps_other_load_files(tmp_path):
+    _write(str(tmp_path / 'm_samples'), _rows(1, 2))
+    _write(str(tmp_path / 'm_sample_sets_membership'), _rows(1, 2))
+
+    assert os.path.exists(str(tmp_path / 'm_samples.txt'))
+
+
+def test_keep_together_groups_are_not_split(tmp_path):
+    basename = str(tmp_path / 'm_sample_sets_membership')
+    filenames = _write(basename, _rows(3, 2), chunk_size=5, keep_together='set_id')
+
+    chunks = [list(loadfile_io.read_rows([filename])) for filename in filenames]
+    assert [len(chunk) for chunk in chunks] == [4, 2]
+    # every set is in exactly one chunk
+    set_ids = [set(row['set_id'] for row in chunk) for chunk in chunks]
+    assert sum(len(ids) for ids in set_ids) == 3
+
+
+def test_keep_together_keeps_groups_larger_than_chunk_size_in_one_chunk(tmp_path):
+    basename = str(tmp_path / 'm_sample_sets_membership')
+    rows = _rows(1, 2) + [{'set_id': 'ALL', 'member_id': 'm{0}'.format(m)} for m in range(7)]
+    filenames = _write(basename, rows, chunk_size=3, keep_together='set_id')
+
+    chunks = [list(loadfile_io.read_rows([filename])) for filename in filenames]
+    # uploading a chunk replaces the members of its sets, so ALL must arrive whole
+    all_chunks = [chunk for chunk in chunks if any(row['set_id'] == 'ALL' for row in chunk)]
+    assert len(all_chunks) == 1
+    assert sorted(row['member_id'] for row in all_chunks[0] if row['set_id'] == 'ALL') == \
+        ['m{0}'.format(m) for m in range(7)]
+    assert sum(len(chunk) for chunk in chunks) == len(rows)
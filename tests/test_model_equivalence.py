@@ -0,0 +1,161 @@
+"""
+The alternative ways of building the entity model give the same load files
+as the serial file-by-file run: the table engine (--assembly table), the
+pipeline (--pipeline), sharding (--shard with mergeFcWsLoadFiles) and
+recording and replaying a cassette (--record, --replay).  A shard replayed
+from a cassette gives the same partial state as the recorded run, and a
+run whose entity model spills to disk (--spill_mb) gives the same load
+files as one that keeps it in dicts.
+
+Each run is a genFcWsLoadFiles process against a mock GDC serving a fixed
+synthetic cohort with replicates and multi-case files.
+"""
+
+import csv
+import glob
+import os
+import subprocess
+import sys
+
+import pytest
+
+import mock_gdc_server
+import synthetic_manifest
+from conftest import REPO_ROOT
+from fcgdctools import sharding
+
+
+@pytest.fixture(scope='module')
+def cohort(tmp_path_factory):
+    files = synthetic_manifest.generate(400, seed=7, replicate_rate=0.3, multi_case_rate=0.02)
+    # the cohort exercises replicate selection and the deferred pass
+    kinds = [(doc['data_type'], doc.get('analysis', {}).get('workflow_type'),
+              tuple(sample['sample_id'] for case in doc['cases'] for sample in case.get('samples', [])))
+             for doc in files if len(doc['cases']) == 1]
+    assert len(kinds) - len(set(kinds)) > 10
+    assert sum(1 for doc in files if len(doc['cases']) > 1) > 4
+
+    manifest = str(tmp_path_factory.mktemp('cohort') / 'cohort.txt')
+    synthetic_manifest.write_manifest(files, manifest)
+    server, api_root = mock_gdc_server.start_in_thread(mock_gdc_server.MockGdc({doc['file_id']: doc for doc in files}))
+    yield manifest, api_root
+    server.shutdown()
+    server.server_close()
+
+
+# genFcWsLoadFiles with an entity store that spills at once and keeps two entities per store in memory
+SPILL_EVERYTHING = ("import functools, sys\n"
+                    "from fcgdctools import entity_store, fc_loadfiles\n"
+                    "entity_store.SpillFile = functools.partial(entity_store.SpillFile, cache_size=2, check_interval=1)\n"
+                    "fc_loadfiles.main(sys.argv[1:])\n")
+
+
+def _run(module, directory, args, code=None):
+    """Run the module's main in directory; with code, run code instead, given the arguments."""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = REPO_ROOT + os.pathsep + env.get('PYTHONPATH', '')
+    command = ['-c', code] if code is not None else ['-m', module]
+    result = subprocess.run([sys.executable] + command + args, cwd=str(directory), env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    assert result.returncode == 0, result.stdout
+
+
+def _load_files(cohort, directory, *args):
+    """Run genFcWsLoadFiles over the cohort in directory; returns its load files by name."""
+    manifest, api_root = cohort
+    os.makedirs(str(directory))
+    _run('fcgdctools.fc_loadfiles', directory, ['-q', '--gdc_api_root', api_root] + list(args) + [manifest])
+    return _read_load_files(directory)
+
+
+def _read_load_files(directory):
+    load_files = dict()
+    for filename in glob.glob(os.path.join(str(directory), 'cohort_*.txt')):
+        with open(filename) as fp:
+            load_files[os.path.basename(filename)] = fp.read()
+    return load_files
+
+
+def _rows(content):
+    """A load file's rows, regardless of row and column order."""
+    return sorted(sorted(row.items()) for row in csv.DictReader(content.splitlines(), delimiter='\t'))
+
+
+@pytest.fixture(scope='module')
+def serial(cohort, tmp_path_factory):
+    return _load_files(cohort, tmp_path_factory.mktemp('runs') / 'serial')
+
+
+def test_cohort_has_all_load_files(serial):
+    assert sorted(serial) == ['cohort_pair_sets_membership.txt', 'cohort_pairs.txt',
+                              'cohort_participant_sets_membership.txt', 'cohort_participants.txt',
+                              'cohort_sample_sets_membership.txt', 'cohort_samples.txt',
+                              'cohort_workspace_attributes.txt']
+
+
+def test_table_assembly_matches_file_by_file(cohort, tmp_path):
+    file_by_file = _load_files(cohort, tmp_path / 'files', '--case_centric')
+    table = _load_files(cohort, tmp_path / 'table', '--case_centric', '--assembly', 'table')
+
+    assert table == file_by_file
+
+
+def test_case_centric_matches_serial(cohort, serial, tmp_path):
+    assert _load_files(cohort, tmp_path / 'case_centric', '--case_centric') == serial
+
+
+def test_pipeline_matches_serial(cohort, serial, tmp_path):
+    pipeline = _load_files(cohort, tmp_path / 'pipeline', '--pipeline', '--fetch_workers', '4', '--queue_size', '8')
+
+    assert pipeline == serial
+
+
+def test_shards_merged_match_serial(cohort, serial, tmp_path):
+    manifest, api_root = cohort
+    for k in (1, 2, 3):
+        _run('fcgdctools.fc_loadfiles', tmp_path, ['-q', '--gdc_api_root', api_root, '--shard', '{0}/3'.format(k), manifest])
+    partial_states = sorted(glob.glob(str(tmp_path / 'cohort.shard*of3.partial.json.gz')))
+    assert len(partial_states) == 3
+    _run('fcgdctools.merge_loadfiles', tmp_path, ['--gdc_api_root', api_root] + partial_states)
+    merged = _read_load_files(tmp_path)
+
+    # the shards' entities are merged in shard order rather than manifest order
+    assert sorted(merged) == sorted(serial)
+    for name in serial:
+        assert _rows(merged[name]) == _rows(serial[name]), name
+
+
+def test_replayed_shard_matches_recorded(cohort, tmp_path):
+    manifest, api_root = cohort
+    cassette = str(tmp_path / 'cohort.zip')
+    states = []
+    # the replay's api root serves nothing: the shard selection too must come from the cassette
+    for name, args in (('record', ['--gdc_api_root', api_root, '--record', cassette]),
+                       ('replay', ['--gdc_api_root', 'http://127.0.0.1:9', '--replay', cassette])):
+        os.makedirs(str(tmp_path / name))
+        _run('fcgdctools.fc_loadfiles', tmp_path / name, ['-q', '--shard', '2/3'] + args + [manifest])
+        states.append(sharding.read_partial_state(str(tmp_path / name / 'cohort.shard2of3.partial.json.gz')))
+
+    assert states[0] == states[1]
+
+
+def test_spilled_entity_model_matches_serial(cohort, serial, tmp_path):
+    manifest, api_root = cohort
+    _run(None, tmp_path, ['-q', '--gdc_api_root', api_root, '--spill_mb', '0', '--spill_dir', str(tmp_path), manifest],
+         code=SPILL_EVERYTHING)
+
+    assert _read_load_files(tmp_path) == serial
+    # the spill file is removed
+    assert not glob.glob(str(tmp_path / 'fcgdctools_entities_*'))
+
+
+def test_replayed_run_matches_serial(cohort, serial, tmp_path):
+    cassette = str(tmp_path / 'cohort.zip')
+    recorded = _load_files(cohort, tmp_path / 'record', '--record', cassette)
+    manifest, _ = cohort
+    os.makedirs(str(tmp_path / 'replay'))
+    # the api root serves nothing: every response must come from the cassette
+    _run('fcgdctools.fc_loadfiles', tmp_path / 'replay', ['-q', '--gdc_api_root', 'http://127.0.0.1:9', '--replay', cassette, manifest])
+
+    assert recorded == serial
+    assert _read_load_files(tmp_path / 'replay') == serial
@@ -0,0 +1,74 @@
+import threading
+
+from fcgdctools import request_hedging
+from fcgdctools import run_stats
+from fake_firecloud import FakeResponse
+
+
+class FakeSession:
+
+    """Answers GET requests at once, except those listed in slow, which wait for release"""
+
+    def __init__(self, slow=()):
+        self.slow = list(slow)
+        self.release = threading.Event()
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def get(self, url, headers=None, timeout=None):
+        with self._lock:
+            call = len(self.calls)
+            self.calls.append(url)
+        if call in self.slow:
+            self.release.wait(5)
+        return FakeResponse(200, {'call': call})
+
+
+def _requester(session, stats=None, max_extra=1.0, max_workers=4):
+    requester = request_hedging.HedgedRequester(max_extra=max_extra, run_stats=stats, min_samples=3,
+                                                max_workers=max_workers, session=session)
+    # latencies for the key, so that requests are hedged after its (short) p95 latency
+    for _ in range(3):
+        requester.get('http://gdc/files/warmup', 'fields')
+    return requester
+
+
+def test_slow_request_is_hedged_and_hedge_wins():
+    session = FakeSession(slow=[3])
+    stats = run_stats.RunStats()
+    requester = _requester(session, stats)
+
+    response = requester.get('http://gdc/files/f1', 'fields')
+    session.release.set()
+
+    assert response.json() == {'call': 4}
+    assert session.calls[3:] == ['http://gdc/files/f1'] * 2
+    assert stats.counters['hedged_requests'] == 1
+    assert stats.counters['hedged_requests_won'] == 1
+
+
+def test_hedge_waiting_for_a_worker_is_cancelled():
+    # with one worker, the hedge waits behind the slow request and is cancelled once it answers
+    session = FakeSession(slow=[3])
+    requester = _requester(session, max_workers=1)
+    threading.Timer(0.2, session.release.set).start()
+
+    response = requester.get('http://gdc/files/f1', 'fields')
+    requester.get('http://gdc/files/f2', 'fields')
+
+    assert response.json() == {'call': 3}
+    assert requester.summary()['hedged'] == 1
+    # the hedge was never sent
+    assert session.calls[3:] == ['http://gdc/files/f1', 'http://gdc/files/f2']
+
+
+def test_hedges_are_limited_by_the_budget():
+    session = FakeSession(slow=[3])
+    requester = _requester(session, max_extra=0.0)
+    threading.Timer(0.2, session.release.set).start()
+
+    response = requester.get('http://gdc/files/f1', 'fields')
+
+    assert response.json() == {'call': 3}
+    assert session.calls[3:] == ['http://gdc/files/f1']
+    assert requester.summary()['hedged'] == 0
@@ -0,0 +1,73 @@
+import pytest
+
+from fcgdctools import fc_loadfiles
+from fcgdctools import gdc_bulk
+from fcgdctools import gdc_metadatacache
+from fcgdctools import run_planner
+
+ITEMS = [{'id': 'f{0}'.format(i)} for i in range(4)]
+FILE_DATA = {'data_category': fc_loadfiles.GDC_DataCategory.TRANSCRIPTOME_PROFILING, 'data_type': 'Gene Expression Quantification',
+             'data_format': 'TSV', 'access': 'open', 'cases': [{'project': {'program': {'name': 'TCGA'}}}]}
+
+
+def _stats(files, deferred, requests, pass_seconds, wall_seconds):
+    """Statistics shaped like those RunStats.write writes; requests maps fields to (count, total seconds)."""
+    return {'counters': {'manifest_files': files, 'deferred_files': deferred},
+            'requests': {fields: {'count': count, 'total_seconds': seconds} for fields, (count, seconds) in requests.items()},
+            'phases': {'main_pass': {'seconds': pass_seconds}},
+            'wall_seconds': wall_seconds}
+
+
+def test_plan_without_cache_or_history():
+    plan = run_planner.plan_run(ITEMS)
+
+    assert plan['requests'] == {run_planner.FILE_FIELDS: 4, run_planner.PENDING_CASE_FIELDS: 4}
+    assert plan['total_requests'] == 8
+    assert plan['metadata_cache'] is None
+    assert plan['estimated_seconds'] is None
+
+
+def test_plan_counts_cached_responses():
+    cache = gdc_metadatacache.MetadataCache(':memory:')
+    cache.put(run_planner.FILE_FIELDS, 'f0', FILE_DATA)
+    cache.put(run_planner.FILE_FIELDS, 'f1', FILE_DATA)
+    cache.put(run_planner.CASE_SAMPLE_FIELDS, 'f0', {'cases': [{'case_id': 'c0'}]})
+
+    plan = run_planner.plan_run(ITEMS, cache, known_urls={'f0'})
+
+    # f2 and f3 need everything; f1 needs only its (known) case fields
+    assert plan['requests'] == {run_planner.FILE_FIELDS: 2, run_planner.CASE_SAMPLE_FIELDS: 1,
+                                run_planner.PENDING_CASE_FIELDS: 2}
+    assert plan['metadata_cache'] == {'lookups': 8, 'hits': 3, 'hit_ratio': 3 / 8.0}
+    assert plan['resolver'] == {'resolved': 1, 'unresolved': 3}
+
+
+def test_plan_estimates_runtime_from_history():
+    history = run_planner.RunHistory()
+    history.add(_stats(100, 10, {run_planner.FILE_FIELDS: (100, 10.0), run_planner.CASE_SAMPLE_FIELDS: (110, 11.0),
+                                 fc_loadfiles.ALIQUOT_FIELDS: (20, 2.0)},
+                       pass_seconds=23.0, wall_seconds=33.0))
+    # a run that processed no files is left out
+    history.add(_stats(0, 0, {}, pass_seconds=0.0, wall_seconds=1.0))
+    items = [{'id': 'f{0}'.format(i)} for i in range(50)]
+
+    plan = run_planner.plan_run(items, concurrency=4, history=history)
+
+    # the deferred files are fetched again, and replicates' aliquots are looked up at the earlier runs' rates
+    assert plan['requests'] == {run_planner.FILE_FIELDS: 55, run_planner.PENDING_CASE_FIELDS: 55,
+                                fc_loadfiles.ALIQUOT_FIELDS: 10}
+    assert plan['history_runs'] == 1
+    # the earlier run had one request in flight, so no more are assumed
+    assert plan['concurrency'] == 1.0
+    # 120 requests of 0.1 s, and 0.1 s per file outside of requests
+    assert plan['estimated_seconds'] == pytest.approx(17.0)
+
+
+def test_case_centric_plan_counts_bulk_queries():
+    items = [{'id': 'f{0}'.format(i)} for i in range(1200)]
+
+    plan = run_planner.plan_run(items, case_centric=True, batch_size=500)
+
+    assert plan['mode'] == 'case_centric'
+    assert plan['requests'] == {gdc_bulk.FILE_FIELDS: 3, gdc_bulk.CASE_FIELDS: 3}
+    assert plan['metadata_cache'] is None
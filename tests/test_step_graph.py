@@ -0,0 +1,63 @@
+from fcgdctools import step_graph
+
+
+def _graph(directory, calls):
+    """A graph reading input.txt and writing its upper-cased copy to output.txt; calls records the steps run."""
+    def read(inputs):
+        calls.append('read')
+        return {'files': ['input.txt']}
+
+    def convert(inputs):
+        calls.append('convert')
+        with open(str(directory / 'input.txt')) as fp:
+            content = fp.read()
+        with open(str(directory / 'output.txt'), 'w') as fp:
+            fp.write(content.upper())
+        return {'files': ['output.txt'], 'length': len(content)}
+
+    graph = step_graph.StepGraph('state.json', str(directory))
+    graph.add_step('read', read)
+    graph.add_step('convert', convert, deps=['read'], params={'case': 'upper'})
+    return graph
+
+
+def test_up_to_date_steps_are_skipped(tmp_path):
+    (tmp_path / 'input.txt').write_text('abc')
+    calls = []
+    _graph(tmp_path, calls).run()
+
+    graph = _graph(tmp_path, calls)
+    results = graph.run()
+
+    assert calls == ['read', 'convert']
+    assert graph.timings == {'read': ('skipped', 0.0), 'convert': ('skipped', 0.0)}
+    assert results['convert'] == {'files': ['output.txt'], 'length': 3}
+
+
+def test_steps_are_rerun_when_their_input_is_newer(tmp_path):
+    (tmp_path / 'input.txt').write_text('abc')
+    calls = []
+    _graph(tmp_path, calls).run()
+
+    (tmp_path / 'input.txt').write_text('abcd')
+    graph = _graph(tmp_path, calls)
+    results = graph.run()
+
+    assert calls == ['read', 'convert', 'read', 'convert']
+    assert results['convert']['length'] == 4
+    assert (tmp_path / 'output.txt').read_text() == 'ABCD'
+
+
+def test_step_with_damaged_output_is_rerun(tmp_path):
+    (tmp_path / 'input.txt').write_text('abc')
+    calls = []
+    _graph(tmp_path, calls).run()
+
+    (tmp_path / 'output.txt').write_text('damaged')
+    graph = _graph(tmp_path, calls)
+    graph.run()
+
+    # the input is unchanged, so only the step whose output is not intact runs
+    assert calls == ['read', 'convert', 'convert']
+    assert graph.timings['read'] == ('skipped', 0.0)
+    assert (tmp_path / 'output.txt').read_text() == 'ABC'